@@ -0,0 +1,5 @@
+"""
+Shared invoice data layer for the Python API endpoints
+Vercel does not expose underscore-prefixed paths, so this package is only
+importable by the handlers in api/
+"""
@@ -0,0 +1,326 @@
+"""
+Receivables Aging
+Open invoices (unpaid balance, not draft or cancelled) kept sorted by due
+date, overall and per customer, so an aging report as of any date is a few
+binary searches rather than a pass over the ledger:
+
+    current (not yet due) | 0-30 | 31-60 | 61-90 | 90+ days past due
+
+Ages come from dueDate (or the invoice date plus DEFAULT_TERMS_DAYS), not
+from the client's 'overdue' status flag. Paying, editing or removing an
+invoice moves or drops its single entry. AgingTally gives the same report
+in one pass over a (possibly streamed) batch when nothing is kept resident.
+"""
+
+import os
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+
+from .columnar import parse_day
+from .indexes import normalize_name
+
+DEFAULT_TERMS_DAYS = int(os.environ.get('AGING_DEFAULT_TERMS_DAYS', 30))
+CLOSED_STATUSES = ('paid', 'cancelled', 'draft')
+# Balances below half a cent are rounding leftovers, not receivables
+MIN_BALANCE = 0.005
+
+# (bucket, min days past due, max days past due); None = unbounded
+BUCKETS = [
+    ('current', None, -1),
+    ('0-30', 0, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None)
+]
+
+BLOCK_SIZE = 512
+
+
+def _amount(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def due_day(inv):
+    """Ordinal due day: dueDate, else invoice date + default terms, else None"""
+    due = parse_day(inv.get('dueDate'))
+    if due is not None:
+        return due
+    issued = parse_day(inv.get('date'))
+    return issued + DEFAULT_TERMS_DAYS if issued is not None else None
+
+
+def open_balance(inv):
+    """Outstanding balance if the invoice is an open receivable, else None"""
+    if inv.get('status') in CLOSED_STATUSES:
+        return None
+    balance = _amount(inv.get('total', 0)) - _amount(inv.get('amountPaid', 0))
+    return balance if balance >= MIN_BALANCE else None
+
+
+def bucket_for(days_past_due):
+    for name, min_days, max_days in BUCKETS:
+        if (min_days is None or days_past_due >= min_days) and (max_days is None or days_past_due <= max_days):
+            return name
+
+
+def aging_report(as_of, totals, undated):
+    """Report dict from {bucket: (count, balance)} and undated (count, balance)"""
+    open_count = sum(count for count, _ in totals.values()) + undated[0]
+    open_balance = sum(balance for _, balance in totals.values()) + undated[1]
+    return {
+        'as_of': as_of.isoformat(),
+        'open_invoices': open_count,
+        'open_balance': round(open_balance, 2),
+        'past_due_balance': round(open_balance - totals['current'][1] - undated[1], 2),
+        'buckets': {name: {'count': count, 'balance': round(balance, 2)}
+                    for name, (count, balance) in totals.items()},
+        'undated': {'count': undated[0], 'balance': round(undated[1], 2)}
+    }
+
+
+def due_window(as_of, min_days, max_days):
+    """Inclusive ordinal due-day range for invoices min..max days past due as of a day"""
+    return (as_of - max_days if max_days is not None else None,
+            as_of - min_days if min_days is not None else None)
+
+
+class DueDateList:
+    """(due day, key, balance) entries kept sorted in blocks, with count/balance per block
+
+    Inserts and deletes bisect the block heads and then one block, so they
+    cost O(log n) comparisons plus a shift within a block of at most
+    2 * BLOCK_SIZE. Range totals add whole blocks and only visit the entries
+    of the two edge blocks.
+    """
+
+    def __init__(self, entries=()):
+        entries = sorted(entries)
+        self.blocks = [entries[start:start + BLOCK_SIZE] for start in range(0, len(entries), BLOCK_SIZE)]
+        self.heads = [block[0] for block in self.blocks]
+        self.totals = [[len(block), sum(entry[2] for entry in block)] for block in self.blocks]
+        self.size = len(entries)
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, entry):
+        self.size += 1
+        if not self.blocks:
+            self.blocks.append([entry])
+            self.heads.append(entry)
+            self.totals.append([1, entry[2]])
+            return
+        index = max(bisect_right(self.heads, entry) - 1, 0)
+        block = self.blocks[index]
+        insort(block, entry)
+        self.heads[index] = block[0]
+        totals = self.totals[index]
+        totals[0] += 1
+        totals[1] += entry[2]
+        if len(block) > 2 * BLOCK_SIZE:
+            half = block[BLOCK_SIZE:]
+            del block[BLOCK_SIZE:]
+            moved = sum(item[2] for item in half)
+            totals[0] -= len(half)
+            totals[1] -= moved
+            self.blocks.insert(index + 1, half)
+            self.heads.insert(index + 1, half[0])
+            self.totals.insert(index + 1, [len(half), moved])
+
+    def remove(self, entry):
+        index = bisect_right(self.heads, entry) - 1
+        block = self.blocks[index]
+        position = bisect_left(block, entry)
+        del block[position]
+        self.size -= 1
+        if not block:
+            del self.blocks[index], self.heads[index], self.totals[index]
+            return
+        self.heads[index] = block[0]
+        totals = self.totals[index]
+        totals[0] -= 1
+        totals[1] -= entry[2]
+        if not totals[0]:
+            totals[1] = 0
+
+    def _first_block(self, low):
+        return 0 if low is None else max(bisect_right(self.heads, (low,)) - 1, 0)
+
+    def total(self, low=None, high=None):
+        """(count, balance) of entries with low <= due day <= high (None = unbounded)"""
+        count, balance = 0, 0
+        for index in range(self._first_block(low), len(self.blocks)):
+            block = self.blocks[index]
+            if high is not None and block[0][0] > high:
+                break
+            if (low is None or block[0][0] >= low) and (high is None or block[-1][0] <= high):
+                count += self.totals[index][0]
+                balance += self.totals[index][1]
+                continue
+            for due, _, amount in block:
+                if (low is None or due >= low) and (high is None or due <= high):
+                    count += 1
+                    balance += amount
+        return count, balance
+
+    def between(self, low=None, high=None):
+        """Entries with low <= due day <= high, oldest due date first"""
+        for index in range(self._first_block(low), len(self.blocks)):
+            block = self.blocks[index]
+            if high is not None and block[0][0] > high:
+                return
+            for entry in block:
+                if high is not None and entry[0] > high:
+                    return
+                if low is None or entry[0] >= low:
+                    yield entry
+
+
+class ReceivablesLedger:
+    """Open invoices by due date, overall and per normalized customer, keyed by a stable invoice key"""
+
+    def __init__(self):
+        self.entries = {}
+        self.docs = {}
+        self.overall = DueDateList()
+        self.by_customer = {}
+        # Open invoices with no due or invoice date can't be aged
+        self.undated = {}
+
+    @classmethod
+    def from_invoices(cls, invoices, key=None):
+        """Bulk build: one sort per list instead of one insert per invoice"""
+        ledger = cls()
+        grouped = {}
+        for pos, inv in enumerate(invoices):
+            item = ledger._item(key(inv) if key else pos, inv)
+            if item is not None:
+                grouped.setdefault(item[0], []).append(item[1])
+        ledger.overall = DueDateList(entry for entries in grouped.values() for entry in entries)
+        ledger.by_customer = {customer: DueDateList(entries) for customer, entries in grouped.items()}
+        return ledger
+
+    def __len__(self):
+        return len(self.entries) + len(self.undated)
+
+    def _item(self, key, inv):
+        """Record an open invoice; returns (customer, entry) when it has a due date"""
+        balance = open_balance(inv)
+        if balance is None:
+            return None
+        customer = normalize_name(inv.get('customer'))
+        due = due_day(inv)
+        self.docs[key] = inv
+        if due is None:
+            self.undated[key] = (customer, balance)
+            return None
+        item = (customer, (due, key, balance))
+        self.entries[key] = item
+        return item
+
+    def add(self, key, inv):
+        """Track an invoice, replacing any previous version (a paid invoice just drops out)"""
+        self.remove(key)
+        item = self._item(key, inv)
+        if item is not None:
+            customer, entry = item
+            self.overall.insert(entry)
+            dues = self.by_customer.get(customer)
+            if dues is None:
+                dues = self.by_customer[customer] = DueDateList()
+            dues.insert(entry)
+
+    def remove(self, key):
+        self.docs.pop(key, None)
+        self.undated.pop(key, None)
+        item = self.entries.pop(key, None)
+        if item is None:
+            return
+        customer, entry = item
+        self.overall.remove(entry)
+        dues = self.by_customer[customer]
+        dues.remove(entry)
+        if not dues:
+            del self.by_customer[customer]
+
+    def _dues(self, customer_name):
+        if not customer_name:
+            return self.overall
+        return self.by_customer.get(normalize_name(customer_name)) or DueDateList()
+
+    def report(self, as_of=None, customer_name=None):
+        """Aging buckets (count and balance) as of a date, overall or for one customer"""
+        as_of = as_of or date.today()
+        day = as_of.toordinal()
+        dues = self._dues(customer_name)
+        totals = {name: dues.total(*due_window(day, min_days, max_days))
+                  for name, min_days, max_days in BUCKETS}
+        name = normalize_name(customer_name) if customer_name else None
+        undated = [balance for customer, balance in self.undated.values() if name is None or customer == name]
+        return aging_report(as_of, totals, (len(undated), sum(undated)))
+
+    def customer_names(self):
+        """Display name per normalized customer with open invoices (least spelling, any update order)"""
+        names = {}
+        for inv in self.docs.values():
+            key = normalize_name(inv.get('customer'))
+            name = inv.get('customer') or 'Unknown'
+            if key not in names or name < names[key]:
+                names[key] = name
+        return names
+
+    def select(self, min_days=None, max_days=None, as_of=None, customer_name=None, limit=None):
+        """(count, balance, invoices) between min and max days past due, oldest first (up to limit)"""
+        day = (as_of or date.today()).toordinal()
+        dues = self._dues(customer_name)
+        low, high = due_window(day, min_days, max_days)
+        count, balance = dues.total(low, high)
+        invoices = []
+        if limit is None or limit > 0:
+            for _, key, _ in dues.between(low, high):
+                invoices.append(self.docs[key])
+                if limit is not None and len(invoices) >= limit:
+                    break
+        return count, balance, invoices
+
+
+class AgingTally:
+    """One-pass aging totals, overall and per normalized customer, as of a fixed date"""
+
+    def __init__(self, as_of=None):
+        self.as_of = as_of or date.today()
+        self._day = self.as_of.toordinal()
+        self.overall = self._empty()
+        self.by_customer = {}
+
+    @staticmethod
+    def _empty():
+        return {'buckets': {name: [0, 0] for name, _, _ in BUCKETS}, 'undated': [0, 0]}
+
+    def add(self, inv):
+        balance = open_balance(inv)
+        if balance is None:
+            return
+        customer = normalize_name(inv.get('customer'))
+        tally = self.by_customer.get(customer)
+        if tally is None:
+            tally = self.by_customer[customer] = self._empty()
+        due = due_day(inv)
+        for target in (self.overall, tally):
+            slot = target['undated'] if due is None else target['buckets'][bucket_for(self._day - due)]
+            slot[0] += 1
+            slot[1] += balance
+
+    def track(self, invoices):
+        """Pass invoices through, tallying each one (for a consumer that needs the same stream)"""
+        for inv in invoices:
+            self.add(inv)
+            yield inv
+
+    def report(self, customer_name=None):
+        if customer_name:
+            tally = self.by_customer.get(normalize_name(customer_name)) or self._empty()
+        else:
+            tally = self.overall
+        return aging_report(self.as_of, {name: tuple(slot) for name, slot in tally['buckets'].items()},
+                            tuple(tally['undated']))
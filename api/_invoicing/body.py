@@ -0,0 +1,45 @@
+"""
+Request Body Parsing
+- application/json: parsed straight from the bytes (no decoded str copy)
+- application/x-ndjson: the first line is the request object and every
+  following line is one invoice, yielded lazily from the socket so
+  aggregations run while the upload is still arriving
+"""
+
+import json
+
+from .metrics import stage
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def is_ndjson(headers):
+    content_type = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+    return content_type in NDJSON_TYPES
+
+
+def read_json(rfile, content_length):
+    with stage('read'):
+        body = rfile.read(content_length)
+    with stage('decode'):
+        return json.loads(body) if body.strip() else {}
+
+
+def iter_lines(rfile, content_length):
+    """Non-empty lines of a body, read incrementally up to Content-Length"""
+    remaining = content_length
+    while remaining > 0:
+        line = rfile.readline(remaining)
+        if not line:
+            break
+        remaining -= len(line)
+        if line.strip():
+            yield line
+
+
+def read_ndjson(rfile, content_length):
+    """(request object, lazy iterator of the remaining line objects)"""
+    lines = iter_lines(rfile, content_length)
+    first = next(lines, None)
+    header = json.loads(first) if first else {}
+    return header, (json.loads(line) for line in lines)
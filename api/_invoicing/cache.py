@@ -0,0 +1,102 @@
+"""
+Response Cache
+Serialized endpoint results keyed by a content hash of the request, with
+LRU + TTL eviction, ETags for If-None-Match revalidation, and hit/miss
+counters for monitoring
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+DEFAULT_TTL = float(os.environ.get('RESULT_CACHE_TTL', 60))
+
+
+def content_hash(value):
+    """Stable digest of a JSON-like value (dict key order does not matter)"""
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+class ResultCache:
+    """Thread-safe LRU cache of (body, etag) with a per-entry time to live"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """(body, etag) for a live entry, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, body, etag=None):
+        etag = etag or make_etag(body)
+        if self.max_entries <= 0:
+            return etag
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return etag
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+_default_cache = None
+
+
+def get_cache():
+    """Process-wide cache shared by every endpoint (keys include the endpoint)"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
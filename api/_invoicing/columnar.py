@@ -0,0 +1,172 @@
+"""
+Columnar Invoice Aggregation
+Converts an invoice batch once into column arrays and computes the analyst
+metrics in vectorized passes. NumPy is optional: without it the same metrics
+come from a single pure-Python pass.
+
+Building columns from JSON dicts costs about as much as the Python pass
+itself, so the vectorized path pays off when columns are reused across calls
+(see benchmarks/bench_crew_metrics.py).
+"""
+
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on deployment
+    np = None
+
+STATUS_CODES = {'draft': 1, 'sent': 2, 'paid': 3, 'overdue': 4, 'partial': 5, 'cancelled': 6}
+STATUS_OTHER = 0
+
+
+def parse_day(value):
+    """Date or ISO timestamp string -> proleptic ordinal day, or None"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value[:10]).toordinal()
+    except ValueError:
+        return None
+
+
+def _amount(value):
+    """JSON numbers as-is; anything else (null, strings, booleans) counts as 0"""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+class InvoiceColumns:
+    """Struct-of-arrays view over an invoice batch (requires NumPy)"""
+
+    def __init__(self, status, total, amount_paid, issued, paid_on):
+        self.status = status
+        self.total = total
+        self.amount_paid = amount_paid
+        self.issued = issued
+        self.paid_on = paid_on
+
+    @classmethod
+    def from_invoices(cls, invoices):
+        """Build columns in one pass (works on a one-shot iterator)"""
+        status, total, amount_paid, issued, paid_on = [], [], [], [], []
+        for inv in invoices:
+            status.append(STATUS_CODES.get(inv.get('status'), STATUS_OTHER))
+            total.append(inv.get('total', 0))
+            amount_paid.append(inv.get('amountPaid', 0))
+            issued.append(inv.get('date'))
+            paid_on.append(inv.get('paidDate'))
+        return cls(np.array(status, dtype=np.int8), cls._amounts(total), cls._amounts(amount_paid),
+                   cls._days(issued), cls._days(paid_on))
+
+    @staticmethod
+    def _amounts(values):
+        """Numbers -> float64 array; other values count as 0, exactly like the Python path"""
+        # No direct cast: NumPy would turn null into NaN and parse numeric strings
+        return np.array([_amount(value) for value in values], dtype=np.float64)
+
+    @staticmethod
+    def _days(values):
+        """Date strings -> datetime64[D] array (NaT where missing or malformed)"""
+        strings = [value[:10] if isinstance(value, str) and value else 'NaT' for value in values]
+        try:
+            return np.array(strings, dtype='datetime64[D]')
+        except ValueError:
+            days = [parse_day(value) for value in strings]
+            return np.array([date.fromordinal(day).isoformat() if day else 'NaT' for day in days],
+                            dtype='datetime64[D]')
+
+    def __len__(self):
+        return len(self.status)
+
+
+def columnar_metrics(cols):
+    """Analyst metrics from prebuilt InvoiceColumns, entirely in vectorized passes"""
+    paid = cols.status == STATUS_CODES['paid']
+    overdue = cols.status == STATUS_CODES['overdue']
+
+    timed = paid & ~np.isnat(cols.issued) & ~np.isnat(cols.paid_on)
+    payment_days = np.maximum((cols.paid_on[timed] - cols.issued[timed]).astype(np.int64), 0)
+
+    return {
+        'total_invoices': len(cols),
+        'paid_count': int(paid.sum()),
+        'overdue_count': int(overdue.sum()),
+        'total_revenue': float(cols.total.sum()),
+        'total_paid': float(cols.amount_paid.sum()),
+        'overdue_amount': float((cols.total[overdue] - cols.amount_paid[overdue]).sum()),
+        'avg_payment_days': float(payment_days.mean()) if len(payment_days) else 0
+    }
+
+
+class MetricsAccumulator:
+    """Running analyst metrics; add() one invoice at a time"""
+
+    __slots__ = ('total_invoices', 'paid_count', 'overdue_count', 'total_revenue', 'total_paid',
+                 'overdue_amount', 'payment_days_sum', 'payment_days_count')
+
+    def __init__(self):
+        self.total_invoices = self.paid_count = self.overdue_count = 0
+        self.total_revenue = self.total_paid = self.overdue_amount = 0
+        self.payment_days_sum = self.payment_days_count = 0
+
+    def add(self, inv):
+        total = _amount(inv.get('total', 0))
+        amount_paid = _amount(inv.get('amountPaid', 0))
+        self.total_invoices += 1
+        self.total_revenue += total
+        self.total_paid += amount_paid
+
+        status = inv.get('status')
+        if status == 'paid':
+            self.paid_count += 1
+            issued = parse_day(inv.get('date'))
+            paid_on = parse_day(inv.get('paidDate'))
+            if issued is not None and paid_on is not None:
+                self.payment_days_sum += max(paid_on - issued, 0)
+                self.payment_days_count += 1
+        elif status == 'overdue':
+            self.overdue_count += 1
+            self.overdue_amount += total - amount_paid
+
+    def result(self):
+        return {
+            'total_invoices': self.total_invoices,
+            'paid_count': self.paid_count,
+            'overdue_count': self.overdue_count,
+            'total_revenue': self.total_revenue,
+            'total_paid': self.total_paid,
+            'overdue_amount': self.overdue_amount,
+            'avg_payment_days': (self.payment_days_sum / self.payment_days_count
+                                 if self.payment_days_count else 0)
+        }
+
+
+def _metrics_python(invoices):
+    acc = MetricsAccumulator()
+    for inv in invoices:
+        acc.add(inv)
+    return acc.result()
+
+
+def grouped_payment_metrics(invoices, key):
+    """Metrics per group in a single pass; returns {group: metrics} in first-seen order"""
+    groups = {}
+    for inv in invoices:
+        group = key(inv)
+        acc = groups.get(group)
+        if acc is None:
+            acc = groups[group] = MetricsAccumulator()
+        acc.add(inv)
+    return {group: acc.result() for group, acc in groups.items()}
+
+
+def payment_metrics(invoices, engine='python'):
+    """Counts, sums and average payment days for an invoice batch
+
+    engine: 'python' (single pass) or 'numpy' (columnar, needs NumPy installed)
+    """
+    if engine == 'numpy':
+        if np is None:
+            raise RuntimeError('NumPy is not installed')
+        return columnar_metrics(InvoiceColumns.from_invoices(invoices))
+    return _metrics_python(invoices)
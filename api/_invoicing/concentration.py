@@ -0,0 +1,154 @@
+"""
+Customer Concentration Analytics
+One streaming pass over (customer, revenue) pairs produces the top-N
+customers, the Herfindahl-Hirschman index (HHI, 0-10000) and the cumulative
+top-5/top-10 revenue shares.
+
+Up to `max_customers` distinct customers everything is exact. Past that the
+tracker switches to bounded memory: a weighted Space-Saving summary for the
+top customers and a count sketch for the sum of squared revenues, so memory
+depends on N rather than on the size of the customer base.
+"""
+
+import hashlib
+import heapq
+import os
+from itertools import count
+
+MAX_EXACT_CUSTOMERS = int(os.environ.get('CONCENTRATION_MAX_CUSTOMERS', 50000))
+# Largest top_n a request may ask for
+MAX_TOP_N = 100
+
+SKETCH_DEPTH = 5
+SKETCH_WIDTH = 1024
+
+
+class SquaredSumSketch:
+    """AMS/count sketch estimating sum(revenue_per_customer ** 2) in fixed memory"""
+
+    def __init__(self, depth=SKETCH_DEPTH, width=SKETCH_WIDTH):
+        self.depth = depth
+        self.width = width
+        self.rows = [[0.0] * width for _ in range(depth)]
+
+    def add(self, item, amount):
+        # One digest supplies a 4-byte (sign, bucket) hash for every row
+        digest = hashlib.blake2b(str(item).encode(), digest_size=4 * self.depth).digest()
+        for depth, row in enumerate(self.rows):
+            h = int.from_bytes(digest[4 * depth:4 * depth + 4], 'little')
+            row[(h >> 1) % self.width] += amount if h & 1 else -amount
+
+    def estimate(self):
+        estimates = sorted(sum(value * value for value in row) for row in self.rows)
+        return estimates[len(estimates) // 2]
+
+
+class SpaceSaving:
+    """Weighted Space-Saving heavy hitters with `capacity` counters
+
+    Heap entries are (count, insertion order, item): the order is a total
+    tie-breaker, so items (None and str customers alike) are never compared.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self._heap = []
+        self._order = count()
+
+    def add(self, item, amount):
+        if amount <= 0:
+            return
+        counts = self.counts
+        if item in counts:
+            counts[item] += amount
+        elif len(counts) < self.capacity:
+            counts[item] = amount
+        else:
+            # Replace the smallest counter; the newcomer inherits its count as error
+            while True:
+                smallest, _, victim = heapq.heappop(self._heap)
+                if counts.get(victim) == smallest:
+                    break
+            del counts[victim]
+            counts[item] = smallest + amount
+        heapq.heappush(self._heap, (counts[item], next(self._order), item))
+        if len(self._heap) > 8 * self.capacity:
+            self._heap = [(total, next(self._order), key) for key, total in counts.items()]
+            heapq.heapify(self._heap)
+
+
+class ConcentrationTracker:
+    """Feed add(customer, revenue) once per invoice, then call result()"""
+
+    def __init__(self, top_n=10, max_customers=MAX_EXACT_CUSTOMERS):
+        self.top_n = min(max(1, top_n), MAX_TOP_N)
+        self.max_customers = max_customers
+        self.total = 0
+        self.exact = {}
+        self.heavy = None
+        self.sketch = None
+
+    @property
+    def approximate(self):
+        return self.heavy is not None
+
+    def add(self, customer, amount):
+        self.total += amount
+        if self.heavy is None:
+            self.exact[customer] = self.exact.get(customer, 0) + amount
+            if len(self.exact) > self.max_customers:
+                self._go_bounded()
+        else:
+            self.heavy.add(customer, amount)
+            self.sketch.add(customer, amount)
+
+    def _go_bounded(self):
+        self.heavy = SpaceSaving(max(4 * max(self.top_n, 10), 100))
+        self.sketch = SquaredSumSketch()
+        for customer, amount in self.exact.items():
+            self.heavy.add(customer, amount)
+            self.sketch.add(customer, amount)
+        self.exact = None
+
+    def top(self, n=None):
+        """Largest customers by revenue as [(customer, revenue)]"""
+        counts = self.exact if self.heavy is None else self.heavy.counts
+        return heapq.nlargest(n or self.top_n, counts.items(), key=lambda item: item[1])
+
+    def result(self):
+        total = self.total
+        leaders = self.top(max(self.top_n, 10))
+
+        def share(amount):
+            return round(amount / total * 100, 2) if total > 0 else 0
+
+        if self.heavy is None:
+            squares = sum(amount * amount for amount in self.exact.values())
+        else:
+            squares = self.sketch.estimate()
+        hhi = round(squares / (total * total) * 10000, 1) if total > 0 else 0
+
+        return {
+            'top_customers': [
+                {'customer': customer, 'revenue': round(amount, 2), 'share': share(amount)}
+                for customer, amount in leaders[:self.top_n]
+            ],
+            'hhi': hhi,
+            'top5_share': share(sum(amount for _, amount in leaders[:5])),
+            'top10_share': share(sum(amount for _, amount in leaders[:10])),
+            'customers': len(self.exact) if self.heavy is None else None,
+            'approximate': self.approximate
+        }
+
+
+def parse_top_n(value, default=10):
+    """Validated top_n request value: an integer in 1..MAX_TOP_N (default when missing)
+
+    Raises ValueError otherwise.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_TOP_N:
+        raise ValueError(f'top_n must be an integer between 1 and {MAX_TOP_N}')
+    return value
@@ -0,0 +1,105 @@
+"""
+Product Co-occurrence Index
+Sparse SKU x SKU basket counts (sku -> {other sku: invoices containing both})
+built from invoice line items and maintained incrementally as invoices are
+added, replaced or removed. Candidates for a basket are scored with
+association-rule confidence and lift, so lookups only touch the basket's own
+neighbour lists rather than the whole catalog.
+"""
+
+import heapq
+
+
+def basket(inv):
+    """Distinct SKUs on an invoice"""
+    return frozenset(item.get('sku') for item in inv.get('items') or () if item.get('sku'))
+
+
+class CooccurrenceIndex:
+    """Invoice-level SKU pair counts keyed by a stable invoice key"""
+
+    def __init__(self):
+        self.pairs = {}
+        self.sku_count = {}
+        self.baskets = {}
+        self.products = {}
+
+    @classmethod
+    def from_invoices(cls, invoices, key=None):
+        index = cls()
+        for pos, inv in enumerate(invoices):
+            index.add(key(inv) if key else pos, inv)
+        return index
+
+    def __len__(self):
+        return len(self.baskets)
+
+    def add(self, key, inv):
+        """Count an invoice's basket, replacing any previous version with the same key"""
+        if key in self.baskets:
+            self.remove(key)
+        skus = basket(inv)
+        self.baskets[key] = skus
+        for item in inv.get('items') or ():
+            if item.get('sku'):
+                # Name and price as last invoiced, for SKUs missing from the request's catalog
+                self.products[item['sku']] = (item.get('name') or item.get('description'), item.get('price'))
+        for sku in skus:
+            self.sku_count[sku] = self.sku_count.get(sku, 0) + 1
+            if len(skus) < 2:
+                continue
+            neighbours = self.pairs.setdefault(sku, {})
+            for other in skus:
+                if other != sku:
+                    neighbours[other] = neighbours.get(other, 0) + 1
+
+    def remove(self, key):
+        skus = self.baskets.pop(key, None)
+        if skus is None:
+            return
+        for sku in skus:
+            count = self.sku_count[sku] - 1
+            if count:
+                self.sku_count[sku] = count
+            else:
+                del self.sku_count[sku]
+            if len(skus) < 2:
+                continue
+            neighbours = self.pairs[sku]
+            for other in skus:
+                if other == sku:
+                    continue
+                count = neighbours[other] - 1
+                if count:
+                    neighbours[other] = count
+                else:
+                    del neighbours[other]
+            if not neighbours:
+                del self.pairs[sku]
+
+    def recommend(self, skus, limit=3, min_support=1):
+        """Top SKUs bought with the basket: [(sku, confidence, lift, support, because_of)]
+
+        Each candidate keeps its strongest rule (basket sku -> candidate),
+        ranked by confidence, then lift, then support. Equal rules go by SKU,
+        so the order does not depend on the index's update history.
+        """
+        skus = set(skus)
+        total = len(self.baskets)
+        best = {}
+        for antecedent in skus:
+            neighbours = self.pairs.get(antecedent)
+            if not neighbours:
+                continue
+            base = self.sku_count[antecedent]
+            for candidate, support in neighbours.items():
+                if support < min_support or candidate in skus:
+                    continue
+                rule = (support / base, support * total / (base * self.sku_count[candidate]), support)
+                current = best.get(candidate)
+                if current is None or rule > current[:3] or (rule == current[:3] and str(antecedent) < str(current[3])):
+                    best[candidate] = rule + (antecedent,)
+        top = heapq.nsmallest(limit, best.items(), key=lambda entry: (
+            -entry[1][0], -entry[1][1], -entry[1][2], str(entry[0])))
+        return [(sku, confidence, lift, support, antecedent)
+                for sku, (confidence, lift, support, antecedent) in top]
@@ -0,0 +1,201 @@
+"""
+Invoice Aggregate Cube
+Pre-aggregated sums per (customer, time bucket) at day, week, month, quarter
+and year granularity, plus an all-customer copy of every bucket, maintained
+incrementally as invoices are added, replaced or removed. A date range is
+covered by the fewest aligned buckets (whole years, then quarters, months,
+weeks and days at the edges), so any window costs a few dozen lookups
+however many invoices it spans.
+"""
+
+from datetime import MAXYEAR, date
+
+from .columnar import parse_day
+from .indexes import normalize_name
+
+# Cell layout: one list of running sums per bucket
+COUNT, TOTAL, AMOUNT_PAID, OUTSTANDING, OVERDUE_COUNT, OVERDUE_BALANCE, PAID_COUNT, PAID_TOTAL = range(8)
+FIELDS = ('count', 'total', 'amount_paid', 'outstanding', 'overdue_count', 'overdue_balance',
+          'paid_count', 'paid_total')
+
+# (status filter, summed value) -> (sum field, count field), matching queryplan.scan()
+AGGREGATES = {
+    (None, 'total'): (TOTAL, COUNT),
+    ('paid', 'total'): (PAID_TOTAL, PAID_COUNT),
+    ('overdue', 'balance'): (OVERDUE_BALANCE, OVERDUE_COUNT)
+}
+
+LEVELS = ('year', 'quarter', 'month', 'week')
+
+# The day after date.max: buckets in year 9999 end here, and no range reaches past it
+END_DAY = date.max.toordinal() + 1
+
+
+def _amount(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def contribution(inv):
+    """(normalized customer, ordinal day or None, ((field, value), ...)) for one invoice
+
+    Only non-zero fields are listed; COUNT always is.
+    """
+    total = _amount(inv.get('total', 0))
+    amount_paid = _amount(inv.get('amountPaid', 0))
+    values = [(COUNT, 1), (TOTAL, total), (AMOUNT_PAID, amount_paid), (OUTSTANDING, total - amount_paid)]
+    status = inv.get('status')
+    if status == 'overdue':
+        values += [(OVERDUE_COUNT, 1), (OVERDUE_BALANCE, total - amount_paid)]
+    elif status == 'paid':
+        values += [(PAID_COUNT, 1), (PAID_TOTAL, total)]
+    return (normalize_name(inv.get('customer')), parse_day(inv.get('date')),
+            tuple(pair for pair in values if pair[1]))
+
+
+def _first_of_month(year, month):
+    """Ordinal of the 1st of a month, END_DAY once past the last representable year"""
+    return date(year, month, 1).toordinal() if year <= MAXYEAR else END_DAY
+
+
+def bucket_bounds(level, day):
+    """(bucket id, first day, day after last) of the `level` bucket containing an ordinal day"""
+    if level == 'week':
+        # Ordinal 1 (0001-01-01) is a Monday
+        week = (day - 1) // 7
+        return week, week * 7 + 1, min(week * 7 + 8, END_DAY)
+    current = date.fromordinal(day)
+    if level == 'year':
+        return current.year, date(current.year, 1, 1).toordinal(), _first_of_month(current.year + 1, 1)
+    if level == 'quarter':
+        month = (current.month - 1) // 3 * 3
+        bucket, span = current.year * 4 + month // 3, 3
+    else:
+        month = current.month - 1
+        bucket, span = current.year * 12 + month, 1
+    stop = current.year * 12 + month + span
+    return (bucket, date(current.year, month + 1, 1).toordinal(),
+            _first_of_month(stop // 12, stop % 12 + 1))
+
+
+def cover(start, end):
+    """Fewest aligned (level, bucket) cells covering ordinal days [start, end)"""
+    cells = []
+    day = start
+    while day < end:
+        month_end = bucket_bounds('month', day)[2]
+        for level in LEVELS:
+            bucket, first, stop = bucket_bounds(level, day)
+            # Weeks never cross a month boundary, so later months stay reachable
+            if first == day and stop <= end and (level != 'week' or stop <= month_end):
+                break
+        else:
+            level, bucket, stop = 'day', day, day + 1
+        cells.append((level, bucket))
+        day = stop
+    return cells
+
+
+class AggregateCube:
+    """Running sums per (customer, level, bucket) keyed by a stable invoice key
+
+    Customer None holds the all-customer sums; level 'all' (bucket None)
+    also counts undated invoices.
+    """
+
+    def __init__(self):
+        self.cells = {}
+        self.entries = {}
+        self.years = {}
+        # Ordinal day -> the buckets it rolls up into
+        self._targets = {}
+
+    @classmethod
+    def from_invoices(cls, invoices, key=None):
+        cube = cls()
+        for pos, inv in enumerate(invoices):
+            cube.add(key(inv) if key else pos, inv)
+        return cube
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _targets_for(self, day):
+        targets = self._targets.get(day)
+        if targets is None:
+            targets = [('all', None)]
+            if day is not None:
+                targets.append(('day', day))
+                targets.extend((level, bucket_bounds(level, day)[0]) for level in LEVELS)
+            targets = self._targets[day] = tuple(targets)
+        return targets
+
+    def _apply(self, customer, day, values, sign):
+        targets = self._targets_for(day)
+        if day is not None:
+            # ('year', year) follows ('all', None) and ('day', day)
+            year = targets[2][1]
+            count = self.years.get(year, 0) + sign
+            if count:
+                self.years[year] = count
+            else:
+                del self.years[year]
+        if sign < 0:
+            values = tuple((field, -value) for field, value in values)
+        cells = self.cells
+        for who in (customer, None):
+            for level, bucket in targets:
+                cell_key = (who, level, bucket)
+                cell = cells.get(cell_key)
+                if cell is None:
+                    cell = cells[cell_key] = [0] * len(FIELDS)
+                for field, value in values:
+                    cell[field] += value
+                if not cell[COUNT]:
+                    # Emptied cells go, which also drops accumulated float drift
+                    del cells[cell_key]
+
+    def add(self, key, inv):
+        """Count an invoice, replacing any previous version with the same key"""
+        # Everything that can fail on a bad invoice happens before any state changes
+        entry = contribution(inv)
+        self._targets_for(entry[1])
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = entry
+        self._apply(*entry, 1)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._apply(*entry, -1)
+
+    def sums(self, customer_name=None, days=None):
+        """Sums for a customer (all when None) over ordinal days [start, end) (all time when None)
+
+        An open end (None) runs to the end of the last year with invoices;
+        both ends are clamped to the representable days.
+        """
+        customer = normalize_name(customer_name) if customer_name else None
+        if days is None:
+            cells = [('all', None)]
+        else:
+            start, end = days
+            start = min(max(start, 1), END_DAY)
+            if end is None:
+                end = _first_of_month(max(self.years) + 1, 1) if self.years else start
+            cells = cover(start, min(end, END_DAY))
+        sums = [0] * len(FIELDS)
+        for level, bucket in cells:
+            cell = self.cells.get((customer, level, bucket))
+            if cell is not None:
+                for field, value in enumerate(cell):
+                    sums[field] += value
+        return dict(zip(FIELDS, sums))
+
+    def aggregate(self, customer_name=None, days=None, status=None, value='total'):
+        """(sum, count) like queryplan.scan(), or None for a combination the cube does not hold"""
+        fields = AGGREGATES.get((status, value))
+        if fields is None:
+            return None
+        sums = self.sums(customer_name, days)
+        return sums[FIELDS[fields[0]]], sums[FIELDS[fields[1]]]
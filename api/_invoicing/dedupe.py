@@ -0,0 +1,284 @@
+"""
+Duplicate Invoice Detection
+Exact duplicates (same customer, number, total and date) come from one hash
+pass. Near-duplicates (the same purchase captured twice with a typo, a new
+number or a slightly different amount) avoid pairwise comparison:
+
+1. blocking: only invoices of the same customer, in the same (log-scaled)
+   amount bucket and date window, are ever compared
+2. MinHash signatures over line-item tokens, banded for LSH, so only
+   invoices sharing a band within a block become candidates
+3. candidates are verified with exact Jaccard similarity and amount tolerance
+
+NumPy, when installed, computes the signatures in bulk; the pure-Python path
+produces the same values.
+"""
+
+import math
+import os
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on deployment
+    np = None
+
+from .columnar import parse_day
+from .indexes import normalize_name
+
+# 16 permutations in 4 bands of 4 rows: pairs above ~0.7 Jaccard almost always collide
+NUM_PERM = 16
+BANDS = 4
+ROWS = NUM_PERM // BANDS
+
+JACCARD_THRESHOLD = float(os.environ.get('DEDUPE_JACCARD', 0.7))
+AMOUNT_TOLERANCE = float(os.environ.get('DEDUPE_AMOUNT_TOLERANCE', 0.02))
+# Re-captures happen close together; the same order months apart is a repeat purchase
+MAX_DAYS_APART = int(os.environ.get('DEDUPE_MAX_DAYS', 30))
+
+# Universal hashing (a * x + b) mod a Mersenne prime; x < 2**32 keeps a * x within int64
+PRIME = (1 << 31) - 1
+_PERMS = [((i * 2654435761 + 97) % (PRIME - 1) + 1, (i * 40503 + 7919) % PRIME) for i in range(NUM_PERM)]
+
+# Bulk signature work is split so the (tokens x permutations) matrix stays small
+SIGNATURE_BATCH = 200000
+
+
+def exact_key(inv):
+    total = inv.get('total')
+    if isinstance(total, (int, float)):
+        total = round(total, 2)
+    date = inv.get('date')
+    return (normalize_name(inv.get('customer')), inv.get('number'), total,
+            date[:10] if isinstance(date, str) else date)
+
+
+def item_tokens(inv):
+    """Line-item signature: each product, and each product with its quantity"""
+    tokens = set()
+    for item in inv.get('items') or ():
+        product = item.get('sku') or normalize_name(item.get('description') or item.get('name'))
+        if product:
+            tokens.add(product)
+            tokens.add(product + '|' + str(item.get('quantity', 1)))
+    return tokens
+
+
+def amount_buckets(total):
+    """The two overlapping log-scale buckets for an amount
+
+    Buckets are 2x the tolerance wide and every invoice sits in two adjacent
+    ones, so any two amounts within tolerance share at least one bucket.
+    """
+    if not isinstance(total, (int, float)) or total <= 0:
+        return ('nonpositive',)
+    bucket = math.floor(math.log(total) / math.log1p(2 * AMOUNT_TOLERANCE))
+    return (bucket, bucket + 1)
+
+
+def day_windows(day):
+    """The two overlapping date windows for an invoice day (same scheme as amount_buckets)"""
+    if day is None:
+        return ('undated',)
+    window = day // (2 * MAX_DAYS_APART + 1)
+    return (window, window + 1)
+
+
+def signature_python(ids):
+    return tuple(min((a * x + b) % PRIME for x in ids) for a, b in _PERMS)
+
+
+def signature_matrix(id_lists):
+    """MinHash signatures as an (invoices x NUM_PERM) int64 array (NumPy path)"""
+    a = np.array([a for a, _ in _PERMS], dtype=np.int64)
+    b = np.array([b for _, b in _PERMS], dtype=np.int64)
+    parts = []
+    start = 0
+    while start < len(id_lists):
+        # Whole lists per batch, about SIGNATURE_BATCH tokens each
+        stop, tokens = start, 0
+        while stop < len(id_lists) and (tokens < SIGNATURE_BATCH or stop == start):
+            tokens += len(id_lists[stop])
+            stop += 1
+        batch = id_lists[start:stop]
+        flat = np.fromiter((x for ids in batch for x in ids), dtype=np.int64, count=tokens)
+        offsets = np.zeros(len(batch), dtype=np.int64)
+        np.cumsum([len(ids) for ids in batch[:-1]], out=offsets[1:])
+        hashed = (flat[:, None] * a + b) % PRIME
+        parts.append(np.minimum.reduceat(hashed, offsets, axis=0))
+        start = stop
+    return np.concatenate(parts) if parts else np.zeros((0, NUM_PERM), dtype=np.int64)
+
+
+def _pairs(group, candidates):
+    for i in range(len(group)):
+        for j in range(i + 1, len(group)):
+            x, y = group[i], group[j]
+            candidates.add((x, y) if x < y else (y, x))
+
+
+def candidates_python(blocks, id_lists):
+    """Pairs sharing an LSH band within a block (dict-based)"""
+    signature = {pos: signature_python(ids) for pos, ids in id_lists.items()}
+    candidates = set()
+    for members in blocks:
+        bands = {}
+        for pos in members:
+            sig = signature[pos]
+            for band in range(BANDS):
+                bands.setdefault((band, sig[band * ROWS:(band + 1) * ROWS]), []).append(pos)
+        for group in bands.values():
+            if len(group) > 1:
+                _pairs(group, candidates)
+    return candidates
+
+
+def candidates_numpy(blocks, id_lists):
+    """Pairs sharing an LSH band within a block: hash (block, band rows) and sort"""
+    positions = list(id_lists)
+    row = {pos: index for index, pos in enumerate(positions)}
+    signatures = signature_matrix([id_lists[pos] for pos in positions])
+    block_ids = np.fromiter((block for block, members in enumerate(blocks) for _ in members), dtype=np.uint64)
+    member_pos = np.fromiter((pos for members in blocks for pos in members), dtype=np.int64)
+    member_rows = np.fromiter((row[pos] for members in blocks for pos in members), dtype=np.int64)
+    band_sigs = signatures[member_rows].astype(np.uint64)
+
+    candidates = set()
+    with np.errstate(over='ignore'):
+        for band in range(BANDS):
+            # 64-bit mix of block id and the band's rows; collisions only add candidates
+            key = block_ids * np.uint64(0x9E3779B97F4A7C15) + np.uint64(band)
+            for r in range(band * ROWS, (band + 1) * ROWS):
+                key = key * np.uint64(0x100000001B3) ^ band_sigs[:, r]
+            order = np.argsort(key, kind='stable')
+            sorted_key = key[order]
+            starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+            sizes = np.diff(np.r_[starts, len(sorted_key)])
+            for start, size in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+                _pairs(member_pos[order[start:start + size]].tolist(), candidates)
+    return candidates
+
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def invoice_ref(inv):
+    return {
+        'id': inv.get('id'),
+        'number': inv.get('number'),
+        'customer': inv.get('customer'),
+        'date': inv.get('date'),
+        'total': inv.get('total')
+    }
+
+
+def find_duplicates(invoices):
+    """Exact and near-duplicate invoice groups, with per-stage timing"""
+    invoices = invoices if isinstance(invoices, list) else list(invoices)
+    timing = {}
+
+    # 1. One pass: exact-duplicate groups, line-item tokens and block membership.
+    # Later copies of an exact duplicate stay out of near-duplicate matching.
+    start = time.perf_counter()
+    groups = {}
+    blocks = {}
+    tokens = {}
+    token_ids = {}
+    for pos, inv in enumerate(invoices):
+        key = exact_key(inv)
+        group = groups.get(key)
+        if group is not None:
+            group.append(pos)
+            continue
+        groups[key] = [pos]
+
+        # Tokens as stable 32-bit ids (SKUs repeat, so each string is hashed once)
+        inv_tokens = set()
+        for token in item_tokens(inv):
+            token_id = token_ids.get(token)
+            if token_id is None:
+                token_id = token_ids[token] = zlib.crc32(token.encode())
+            inv_tokens.add(token_id)
+        if not inv_tokens:
+            continue
+        tokens[pos] = inv_tokens
+        windows = day_windows(parse_day(inv.get('date')))
+        for bucket in amount_buckets(inv.get('total')):
+            for window in windows:
+                blocks.setdefault((key[0], bucket, window), []).append(pos)
+    exact = [positions for positions in groups.values() if len(positions) > 1]
+    timing['scan_ms'] = (time.perf_counter() - start) * 1000
+
+    # 2. MinHash + LSH bands, only for blocks with at least two members
+    start = time.perf_counter()
+    blocks = [members for members in blocks.values() if len(members) > 1]
+    id_lists = {}
+    for members in blocks:
+        for pos in members:
+            if pos not in id_lists:
+                id_lists[pos] = list(tokens[pos])
+    if np is not None:
+        candidates = candidates_numpy(blocks, id_lists)
+    else:
+        candidates = candidates_python(blocks, id_lists)
+    timing['lsh_ms'] = (time.perf_counter() - start) * 1000
+
+    # 3. Verify candidates exactly and cluster them
+    start = time.perf_counter()
+    parent = {}
+    similarity = {}
+    for x, y in candidates:
+        a, b = tokens[x], tokens[y]
+        jaccard = len(a & b) / len(a | b)
+        if jaccard < JACCARD_THRESHOLD:
+            continue
+        total_x, total_y = invoices[x].get('total'), invoices[y].get('total')
+        if isinstance(total_x, (int, float)) and isinstance(total_y, (int, float)):
+            if abs(total_x - total_y) > AMOUNT_TOLERANCE * max(abs(total_x), abs(total_y)):
+                continue
+        day_x, day_y = parse_day(invoices[x].get('date')), parse_day(invoices[y].get('date'))
+        if day_x is not None and day_y is not None and abs(day_x - day_y) > MAX_DAYS_APART:
+            continue
+        for pos in (x, y):
+            parent.setdefault(pos, pos)
+        root_x, root_y = _find(parent, x), _find(parent, y)
+        if root_x != root_y:
+            parent[max(root_x, root_y)] = min(root_x, root_y)
+        similarity[(x, y)] = jaccard
+
+    clusters = {}
+    for pos in parent:
+        clusters.setdefault(_find(parent, pos), []).append(pos)
+    cluster_similarity = {}
+    for (x, y), jaccard in similarity.items():
+        root = _find(parent, x)
+        cluster_similarity[root] = min(cluster_similarity.get(root, 1.0), jaccard)
+    timing['verify_ms'] = (time.perf_counter() - start) * 1000
+
+    return {
+        'exact': [
+            {'count': len(positions), 'invoices': [invoice_ref(invoices[pos]) for pos in positions]}
+            for positions in exact
+        ],
+        'near': [
+            {
+                'count': len(members),
+                'min_similarity': round(cluster_similarity[root], 3),
+                'invoices': [invoice_ref(invoices[pos]) for pos in sorted(members)]
+            }
+            for root, members in sorted(clusters.items())
+        ],
+        'stats': {
+            'invoices': len(invoices),
+            'blocked': len(id_lists),
+            'candidate_pairs': len(candidates),
+            'near_pairs': len(similarity),
+            'engine': 'numpy' if np is not None else 'python',
+            'timing': {stage: round(ms, 1) for stage, ms in timing.items()}
+        }
+    }
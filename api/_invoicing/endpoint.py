@@ -0,0 +1,258 @@
+"""
+Endpoint Framework
+Endpoint logic lives in a Service (transport independent). JSONHandler is
+the thin BaseHTTPRequestHandler adapter Vercel runs per invocation; the
+long-lived server in server.py drives the same Service objects. Both go
+through serve_post() (request metrics, see metrics.py) and execute(), which
+adds the shared response cache and ETags.
+"""
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+import json
+
+from . import metrics
+from .body import is_ndjson, read_json, read_ndjson
+from .cache import content_hash, etag_matches, get_cache
+from .metrics import counted, record_cache, record_invoices, stage
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Profile, X-Profile-Token',
+    'Access-Control-Expose-Headers': 'ETag, X-Cache, Server-Timing, X-Profile-Id'
+}
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class HTTPError(Exception):
+    """Raised by a Service to answer with a non-200 status and a JSON payload"""
+
+    def __init__(self, status, payload):
+        super().__init__(payload.get('error', ''))
+        self.status = status
+        self.payload = payload
+
+
+class NDJSONStream:
+    """Service result streamed back one JSON record per line"""
+
+    content_type = 'application/x-ndjson'
+
+    def __init__(self, records):
+        self.records = records
+
+    def lines(self):
+        for record in self.records:
+            yield json.dumps(record).encode() + b'\n'
+
+
+class TracedStream(NDJSONStream):
+    """An NDJSONStream whose request trace finishes with its last line"""
+
+    def __init__(self, stream, trace):
+        super().__init__(stream.records)
+        self.stream = stream
+        self.content_type = stream.content_type
+        self.trace = trace
+
+    def lines(self):
+        self.trace.attach()
+        size = 0
+        status = 500
+        try:
+            with stage('stream'):
+                for line in self.stream.lines():
+                    size += len(line)
+                    yield line
+            status = 200
+        finally:
+            self.trace.finish(status, size)
+
+
+class Service:
+    """One API endpoint: parse the request body, then handle() the data dict"""
+
+    name = 'service'
+
+    # NDJSON bodies stream their item lines into data[items_key]
+    items_key = 'invoices'
+
+    def parse(self, headers, rfile):
+        content_length = int(headers.get('Content-Length') or 0)
+        if is_ndjson(headers):
+            data, items = read_ndjson(rfile, content_length)
+            self.attach_items(data, counted(items))
+            return data
+        data = read_json(rfile, content_length)
+        items = data.get(self.items_key) if isinstance(data, dict) else None
+        if isinstance(items, list):
+            record_invoices(len(items))
+        return data
+
+    def attach_items(self, data, items):
+        data[self.items_key] = items
+
+    def cache_key(self, data):
+        """Parts identifying a cacheable request, or None to always recompute"""
+        return None
+
+    def handle(self, data):
+        raise NotImplementedError
+
+    def stats(self):
+        """Extra monitoring counters for the GET response"""
+        return {}
+
+
+def is_materialized(data, key):
+    """True when data[key] is a real list (not a streamed NDJSON iterator)"""
+    return isinstance(data.get(key, []), list)
+
+
+def execute(service, data, if_none_match=None):
+    """Run a service through the response cache
+
+    Returns (status, body, headers) where body is bytes or an NDJSONStream.
+    A request whose If-None-Match matches the result's ETag gets 304 and no body.
+    """
+    with stage('cache'):
+        parts = service.cache_key(data)
+    if parts is None:
+        with stage('handle'):
+            result = service.handle(data)
+        if isinstance(result, NDJSONStream):
+            return 200, result, {}
+        with stage('encode'):
+            return 200, json.dumps(result).encode(), {}
+
+    cache = get_cache()
+    with stage('cache'):
+        key = content_hash([service.name, parts])
+        cached = cache.get(key)
+    if cached is not None:
+        record_cache('hit')
+        body, etag = cached
+        headers = {'ETag': etag, 'X-Cache': 'HIT'}
+    else:
+        record_cache('miss')
+        with stage('handle'):
+            result = service.handle(data)
+        with stage('encode'):
+            body = json.dumps(result).encode()
+        etag = cache.put(key, body)
+        headers = {'ETag': etag, 'X-Cache': 'MISS'}
+
+    if etag_matches(if_none_match, etag):
+        return 304, b'', headers
+    return 200, body, headers
+
+
+def serve_post(service, headers, rfile):
+    """parse() and execute() one POST request, traced for metrics (profiled when asked)
+
+    Returns execute()'s (status, body, headers) plus Server-Timing; errors are
+    counted and re-raised. A streamed body finishes its trace on its last line.
+    """
+    trace = metrics.begin(service.name, headers)
+    try:
+        data = service.parse(headers, rfile)
+        status, body, extra = execute(service, data, headers.get('If-None-Match'))
+    except HTTPError as e:
+        trace.finish(e.status)
+        raise
+    except Exception:
+        trace.finish(500)
+        raise
+    extra = dict(extra, **trace.headers())
+    if isinstance(body, NDJSONStream):
+        trace.detach()
+        return status, TracedStream(body, trace), extra
+    trace.finish(status, len(body))
+    return status, body, extra
+
+
+def metrics_text():
+    """Request metrics plus response-cache counters, in the Prometheus text format"""
+    cache = get_cache().stats()
+    return metrics.render([
+        ('api_cache_entries', 'gauge', 'Responses held in the shared cache', [((), cache['entries'])]),
+        ('api_cache_hits_total', 'counter', 'Response cache hits', [((), cache['hits'])]),
+        ('api_cache_misses_total', 'counter', 'Response cache misses', [((), cache['misses'])]),
+        ('api_cache_evictions_total', 'counter', 'Responses evicted for space', [((), cache['evictions'])]),
+        ('api_cache_expirations_total', 'counter', 'Responses expired by TTL', [((), cache['expirations'])])
+    ])
+
+
+def describe(service, query_string):
+    """GET on an endpoint: (status, body, content type) for health JSON, metrics or a profile
+
+    ?format=prometheus gives metrics_text(); ?profile=<id> a stored profile report.
+    """
+    query = parse_qs(query_string)
+    if query.get('format') == ['prometheus']:
+        return 200, metrics_text().encode(), PROMETHEUS_TYPE
+    if 'profile' in query:
+        report = metrics.get_profile(query['profile'][0])
+        if report is None:
+            return 404, json.dumps({'error': 'Unknown or expired profile id'}).encode(), 'application/json'
+        return 200, report.encode(), 'text/plain; charset=utf-8'
+    payload = dict({'status': 'ok', 'service': service.name, 'cache': get_cache().stats()}, **service.stats())
+    return 200, json.dumps(payload).encode(), 'application/json'
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """Vercel entry point; subclasses only set `service`"""
+
+    service = None
+
+    def do_POST(self):
+        try:
+            status, body, headers = serve_post(self.service, self.headers, self.rfile)
+
+            self.send_response(status)
+            if isinstance(body, NDJSONStream):
+                self.send_header('Content-type', body.content_type)
+            elif status != 304:
+                self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Expose-Headers', CORS_HEADERS['Access-Control-Expose-Headers'])
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            if isinstance(body, NDJSONStream):
+                for line in body.lines():
+                    self.wfile.write(line)
+            else:
+                self.wfile.write(body)
+
+        except HTTPError as e:
+            self.send_json(e.status, e.payload)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+    def do_GET(self):
+        """Health and cache counters, Prometheus metrics or a profile report for monitoring"""
+        status, body, content_type = describe(self.service, self.path.partition('?')[2])
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        """Write a JSON response with CORS headers"""
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
+
+    def do_OPTIONS(self):
+        """Handle CORS preflight"""
+        self.send_response(200)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.end_headers()
@@ -0,0 +1,113 @@
+"""
+Invoice Indexes
+Built once per dataset so customer and date filters become lookups:
+- hash index from normalized customer name to invoice positions
+- date-sorted positions (overall and per customer) for bisect range queries
+"""
+
+import heapq
+from bisect import bisect_left
+from itertools import islice
+
+# Upper bound appended to a prefix so startswith() becomes a range query
+PREFIX_END = '\uffff'
+
+
+def normalize_name(name):
+    """Normalize a customer name for lookups"""
+    return (name or '').strip().lower()
+
+
+def invoice_date(inv):
+    return inv.get('date') or ''
+
+
+class DateRun:
+    """Invoice positions ordered by date, newest-last, with a parallel key list for bisect"""
+
+    def __init__(self, invoices, positions):
+        # Ties keep input order when read newest-first, matching sorted(..., reverse=True)
+        ordered = sorted(positions, key=lambda pos: (invoice_date(invoices[pos]), -pos))
+        self.positions = ordered
+        self.dates = [invoice_date(invoices[pos]) for pos in ordered]
+
+    def bounds(self, start=None, end=None):
+        """(lo, hi) slice of positions with start <= date < end (either bound optional)"""
+        lo = bisect_left(self.dates, start) if start is not None else 0
+        hi = bisect_left(self.dates, end, lo) if end is not None else len(self.dates)
+        return lo, hi
+
+    def range(self, start=None, end=None):
+        """Positions with start <= date < end (either bound optional)"""
+        lo, hi = self.bounds(start, end)
+        return self.positions[lo:hi]
+
+    def newest(self, limit, start=None, end=None):
+        """Up to `limit` positions in the range, newest first (only those are copied)"""
+        lo, hi = self.bounds(start, end)
+        return self.positions[max(lo, hi - limit):hi][::-1]
+
+
+class InvoiceIndex:
+    """Customer hash index plus date-sorted runs over one immutable invoice list
+
+    `search` optionally holds the dataset's full-text SearchIndex
+    """
+
+    def __init__(self, invoices, search=None):
+        self.invoices = invoices
+        self.search = search
+        self.by_customer = {}
+        for pos, inv in enumerate(invoices):
+            self.by_customer.setdefault(normalize_name(inv.get('customer')), []).append(pos)
+
+        self.all_dates = DateRun(invoices, range(len(invoices)))
+        self._customer_dates = {}
+
+    def customer_dates(self, customer_name):
+        """Date run for one customer, built on first use"""
+        key = normalize_name(customer_name)
+        run = self._customer_dates.get(key)
+        if run is None:
+            run = DateRun(self.invoices, self.by_customer.get(key, []))
+            self._customer_dates[key] = run
+        return run
+
+    def run_for(self, customer_name=None):
+        return self.customer_dates(customer_name) if customer_name else self.all_dates
+
+    def select(self, customer_name=None, date_range=None, limit=None, status=None):
+        """Invoices for a customer and/or date range, in original ledger order
+
+        With `limit`, only the first `limit` of them (no full sort of the range
+        unless a status filter needs it).
+        """
+        if status is not None:
+            if date_range is None:
+                positions = (self.by_customer.get(normalize_name(customer_name), []) if customer_name
+                             else range(len(self.invoices)))
+            else:
+                positions = sorted(self.run_for(customer_name).range(*date_range))
+            matches = (inv for inv in (self.invoices[pos] for pos in positions) if inv.get('status') == status)
+            return list(islice(matches, limit))
+        if date_range is None:
+            if customer_name:
+                positions = self.by_customer.get(normalize_name(customer_name), [])
+            else:
+                return self.invoices if limit is None else self.invoices[:limit]
+            if limit is not None:
+                positions = positions[:limit]
+        elif limit is not None:
+            positions = heapq.nsmallest(limit, self.run_for(customer_name).range(*date_range))
+        else:
+            positions = sorted(self.run_for(customer_name).range(*date_range))
+        return [self.invoices[pos] for pos in positions]
+
+    def recent(self, limit, customer_name=None):
+        """Newest `limit` invoices, optionally for one customer"""
+        return [self.invoices[pos] for pos in self.run_for(customer_name).newest(limit)]
+
+
+def top_recent(invoices, limit):
+    """Newest `limit` invoices without an index (heap instead of a full sort)"""
+    return heapq.nlargest(limit, invoices, key=invoice_date)
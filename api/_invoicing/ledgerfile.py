@@ -0,0 +1,321 @@
+"""
+Columnar Ledger Snapshots
+A tenant's ledger written to one binary file that a fresh process maps
+instead of re-parsing every invoice from JSON:
+
+    magic | JSON documents | columns (native-endian, 8-byte aligned) | meta | meta length | magic
+
+Columns hold what rag-query filters and sums on (customer and status codes,
+date keys, amounts) plus date-sorted position runs overall and per customer,
+so aggregate, recent and per-customer questions are answered from the
+mapped pages. An invoice's JSON document is only decoded when its row is
+returned. Sums use NumPy over the mapped buffers when installed, plain
+memoryviews otherwise; either way nothing is copied up front.
+"""
+
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from datetime import date
+
+from .cube import AGGREGATES
+from .indexes import invoice_date, normalize_name
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on deployment
+    np = None
+
+MAGIC = b'CCLEDGER1\n'
+# Bytes of the date string kept per row; ISO days compare the same as the full string
+DATE_WIDTH = 10
+FOOTER = struct.Struct('<Q')
+
+
+def _amount(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def date_key(value):
+    """Fixed-width, NUL-padded bytes that sort like the (prefix of the) date string"""
+    return (value or '').encode('utf-8')[:DATE_WIDTH].ljust(DATE_WIDTH, b'\0')
+
+
+def _row(inv, document):
+    return (inv.get('customer'), invoice_date(inv), inv.get('status'), inv.get('total', 0),
+            inv.get('amountPaid', 0), document)
+
+
+def invoice_rows(invoices):
+    """(customer, date, status, total, amount paid, JSON document) rows for write_snapshot()"""
+    for inv in invoices:
+        doc = inv.to_dict() if hasattr(inv, 'to_dict') else inv
+        yield _row(inv, json.dumps(doc))
+
+
+def document_rows(documents):
+    """invoice_rows() for invoices stored as JSON text (columns come from the decoded values)"""
+    for document in documents:
+        yield _row(json.loads(document), document)
+
+
+def write_snapshot(path, version, rows, customers=()):
+    """Write rows (see invoice_rows) in ledger order; replaces `path` atomically"""
+    names, name_codes = [], {}
+    statuses, status_codes = [], {}
+    customer_col, status_col = array('i'), array('i')
+    total_col, paid_col = array('d'), array('d')
+    offsets = array('q', [0])
+    dates = []
+
+    temp = f'{path}.tmp-{os.getpid()}'
+    with open(temp, 'wb') as out:
+        out.write(MAGIC)
+        position = 0
+        for customer, day, status, total, amount_paid, document in rows:
+            name = normalize_name(customer)
+            code = name_codes.get(name)
+            if code is None:
+                code = name_codes[name] = len(names)
+                names.append(name)
+            customer_col.append(code)
+            code = status_codes.get(status)
+            if code is None:
+                code = status_codes[status] = len(statuses)
+                statuses.append(status)
+            status_col.append(code)
+            total_col.append(_amount(total))
+            paid_col.append(_amount(amount_paid))
+            dates.append(day if isinstance(day, str) else '')
+            data = document.encode('utf-8') if isinstance(document, str) else bytes(document)
+            out.write(data)
+            position += len(data)
+            offsets.append(position)
+
+        # Same order as indexes.DateRun: by date, ties newest-last in reverse ledger order
+        all_dates = array('i', sorted(range(len(dates)), key=lambda pos: (dates[pos], -pos)))
+        # A stable regroup keeps that date order inside each customer
+        customer_runs = array('i', sorted(all_dates, key=customer_col.__getitem__))
+        customer_starts = array('i', [0] * (len(names) + 1))
+        for code in customer_col:
+            customer_starts[code + 1] += 1
+        for code in range(len(names)):
+            customer_starts[code + 1] += customer_starts[code]
+        date_keys = b''.join(date_key(day) for day in dates)
+        del dates
+
+        columns = {}
+        end = len(MAGIC) + position
+        for name, data in (('customer', customer_col), ('status', status_col), ('total', total_col),
+                           ('amount_paid', paid_col), ('doc_offsets', offsets), ('all_dates', all_dates),
+                           ('customer_runs', customer_runs), ('customer_starts', customer_starts),
+                           ('date_keys', date_keys)):
+            padding = -end % 8
+            out.write(b'\0' * padding)
+            end += padding
+            raw = data.tobytes() if isinstance(data, array) else data
+            columns[name] = [data.typecode if isinstance(data, array) else 'B', end, len(raw)]
+            out.write(raw)
+            end += len(raw)
+
+        meta = json.dumps({
+            'version': version,
+            'count': len(customer_col),
+            'byteorder': sys.byteorder,
+            'docs': [len(MAGIC), position],
+            'names': names,
+            'statuses': statuses,
+            'customers': list(customers),
+            'columns': columns
+        }).encode('utf-8')
+        out.write(meta)
+        out.write(FOOTER.pack(len(meta)))
+        out.write(MAGIC)
+    os.replace(temp, path)
+
+
+class _RunKeys:
+    """Date keys of a position run, for bisect (keys are read through the run)"""
+
+    def __init__(self, snapshot, run):
+        self.keys = snapshot.date_keys
+        self.run = run
+
+    def __len__(self):
+        return len(self.run)
+
+    def __getitem__(self, i):
+        start = self.run[i] * DATE_WIDTH
+        return self.keys[start:start + DATE_WIDTH].tobytes()
+
+
+class LedgerSnapshot:
+    """Read-only view over a mapped snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        size = len(view)
+        tail = FOOTER.size + len(MAGIC)
+        if size < len(MAGIC) + tail or view[:len(MAGIC)] != MAGIC or view[size - len(MAGIC):] != MAGIC:
+            raise ValueError(f'{path} is not a ledger snapshot')
+        (meta_size,) = FOOTER.unpack(view[size - tail:size - len(MAGIC)])
+        meta = json.loads(bytes(view[size - tail - meta_size:size - tail]))
+        if meta['byteorder'] != sys.byteorder:
+            raise ValueError(f'{path} was written on a {meta["byteorder"]}-endian machine')
+
+        self.path = path
+        self.version = meta['version']
+        self.count = meta['count']
+        self.names = meta['names']
+        self.statuses = meta['statuses']
+        self.customers = meta['customers']
+        self._name_codes = {name: code for code, name in enumerate(self.names)}
+        self._status_codes = {status: code for code, status in enumerate(self.statuses)}
+        start, length = meta['docs']
+        self.docs = view[start:start + length]
+        for name, (typecode, offset, length) in meta['columns'].items():
+            setattr(self, name, view[offset:offset + length].cast(typecode))
+
+    @classmethod
+    def open(cls, path):
+        """Snapshot at path, or None if there is none (or it is unreadable)"""
+        try:
+            return cls(path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def __len__(self):
+        return self.count
+
+    def document(self, pos):
+        """The decoded JSON document of one row"""
+        return json.loads(self.docs[self.doc_offsets[pos]:self.doc_offsets[pos + 1]].tobytes())
+
+    def status_code(self, status):
+        """Code of a status string in the status column (-1 if no row has it)"""
+        return self._status_codes.get(status, -1)
+
+    def run(self, customer_name=None):
+        """Date-ordered positions for a customer (all invoices when None)"""
+        if not customer_name:
+            return self.all_dates
+        code = self._name_codes.get(normalize_name(customer_name))
+        if code is None:
+            return self.customer_runs[0:0]
+        return self.customer_runs[self.customer_starts[code]:self.customer_starts[code + 1]]
+
+    def range(self, run, start=None, end=None):
+        """(lo, hi) bounds of start <= date < end within a run (date strings, either optional)"""
+        # Bounds stay whole: a stored key only stands in for the date string it prefixes
+        keys = _RunKeys(self, run)
+        lo = bisect_left(keys, start.encode('utf-8')) if start is not None else 0
+        hi = bisect_left(keys, end.encode('utf-8'), lo) if end is not None else len(run)
+        return lo, hi
+
+    def aggregate(self, customer_name=None, days=None, status=None, value='total'):
+        """(sum, count) like AggregateCube.aggregate(), read from the columns"""
+        if (status, value) not in AGGREGATES:
+            return None
+        run = self.run(customer_name)
+        lo, hi = 0, len(run)
+        if days is not None:
+            start, end = days
+            lo, hi = self.range(run, date.fromordinal(start).isoformat(),
+                                date.fromordinal(end).isoformat() if end is not None else None)
+        code = self.status_code(status) if status is not None else None
+        if lo >= hi or code == -1:
+            return 0, 0
+        balance = value == 'balance'
+
+        if np is not None:
+            # Zero-copy arrays over the mapped columns; only the selected rows are gathered
+            positions = np.frombuffer(run, dtype=np.int32)[lo:hi]
+            if code is not None:
+                positions = positions[np.frombuffer(self.status, dtype=np.int32)[positions] == code]
+            amounts = np.frombuffer(self.total, dtype=np.float64)[positions]
+            if balance:
+                amounts = amounts - np.frombuffer(self.amount_paid, dtype=np.float64)[positions]
+            return float(amounts.sum()), len(positions)
+
+        totals, paid, statuses = self.total, self.amount_paid, self.status
+        total = 0
+        count = 0
+        for pos in run[lo:hi]:
+            if code is not None and statuses[pos] != code:
+                continue
+            total += totals[pos] - paid[pos] if balance else totals[pos]
+            count += 1
+        return total, count
+
+
+class SnapshotInvoices(Sequence):
+    """Ledger-order invoices of a snapshot, each decoded on first access"""
+
+    def __init__(self, snapshot, decode=None):
+        self.snapshot = snapshot
+        self.decode = decode
+        self._rows = [None] * len(snapshot)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self._rows)))]
+        inv = self._rows[pos]
+        if inv is None:
+            inv = self.snapshot.document(pos if pos >= 0 else pos + len(self._rows))
+            if self.decode is not None:
+                inv = self.decode(inv)
+            self._rows[pos] = inv
+        return inv
+
+
+class SnapshotIndex:
+    """InvoiceIndex over a snapshot's stored runs (same answers, nothing built)
+
+    `search` is resolved on first use, since building it reads every invoice
+    """
+
+    def __init__(self, snapshot, invoices, search=None):
+        self.snapshot = snapshot
+        self.invoices = invoices
+        self._search = search
+
+    @property
+    def search(self):
+        return self._search() if callable(self._search) else self._search
+
+    def select(self, customer_name=None, date_range=None, limit=None, status=None):
+        """Invoices for a customer and/or date range (and status), in original ledger order
+
+        Filters run on the columns, so only the returned rows are decoded.
+        """
+        snapshot = self.snapshot
+        run = snapshot.run(customer_name)
+        if date_range is None and not customer_name and status is None:
+            return self.invoices if limit is None else self.invoices[:limit]
+        lo, hi = snapshot.range(run, *date_range) if date_range is not None else (0, len(run))
+        positions = run[lo:hi]
+        if status is not None:
+            code = snapshot.status_code(status)
+            statuses = snapshot.status
+            positions = [pos for pos in positions if statuses[pos] == code]
+        if limit is not None:
+            positions = heapq.nsmallest(limit, positions)
+        else:
+            positions = sorted(positions)
+        return [self.invoices[pos] for pos in positions]
+
+    def recent(self, limit, customer_name=None):
+        """Newest `limit` invoices, optionally for one customer"""
+        run = self.snapshot.run(customer_name)
+        return [self.invoices[run[i]] for i in range(len(run) - 1, max(len(run) - limit, 0) - 1, -1)]
@@ -0,0 +1,113 @@
+"""
+Customer Name Matcher
+Aho-Corasick automaton over normalized customer names: one pass over the
+query finds every customer mentioned, and the longest mention wins
+"""
+
+import threading
+from collections import OrderedDict, deque
+
+from .indexes import normalize_name
+
+# Matchers for inline customer lists, keyed by the tuple of names
+MATCHER_CACHE_SIZE = 16
+_matcher_cache = OrderedDict()
+_matcher_lock = threading.Lock()
+
+
+def _is_word_char(ch):
+    return ch.isalnum()
+
+
+class CustomerMatcher:
+    """Multi-pattern matcher built once per customer list"""
+
+    def __init__(self, names):
+        self.patterns = []
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        seen = set()
+        for name in names:
+            norm = normalize_name(name)
+            if not norm or norm in seen:
+                continue
+            seen.add(norm)
+            self._add(norm, name)
+        self._build()
+
+    def _add(self, norm, name):
+        state = 0
+        for ch in norm:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append(len(self.patterns))
+        self.patterns.append((norm, name))
+
+    def _build(self):
+        """Breadth-first failure links; each state inherits its fallback's outputs"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                if state == 0:
+                    continue
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find_all(self, text):
+        """All whole-word customer mentions as (start, end, name), in text order"""
+        text = text.lower()
+        goto, fail, output = self.goto, self.fail, self.output
+        matches = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern_id in output[state]:
+                norm, name = self.patterns[pattern_id]
+                start = i - len(norm) + 1
+                end = i + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if end < len(text) and _is_word_char(text[end]):
+                    continue
+                matches.append((start, end, name))
+        matches.sort()
+        return matches
+
+    def longest(self, text):
+        """Name of the longest customer mentioned (earliest on ties), or None"""
+        best = None
+        for start, end, name in self.find_all(text):
+            if best is None or end - start > best[1] - best[0]:
+                best = (start, end, name)
+        return best[2] if best else None
+
+
+def matcher_for(customers):
+    """Cached matcher for an inline customer list"""
+    names = tuple(customer.get('name') or '' for customer in customers)
+    with _matcher_lock:
+        matcher = _matcher_cache.get(names)
+        if matcher is not None:
+            _matcher_cache.move_to_end(names)
+            return matcher
+    matcher = CustomerMatcher(names)
+    with _matcher_lock:
+        _matcher_cache[names] = matcher
+        if len(_matcher_cache) > MATCHER_CACHE_SIZE:
+            _matcher_cache.popitem(last=False)
+    return matcher
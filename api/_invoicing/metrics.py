@@ -0,0 +1,343 @@
+"""
+Request Metrics
+Per-request instrumentation shared by every endpoint: stage timings (body
+read, JSON decode, the handler's own stages, response encode), request and
+response sizes, invoices per request and the response-cache outcome, folded
+into process-wide Prometheus histograms and counters.
+
+    with stage('filter'):
+        ...
+
+stage() is a no-op outside a traced request. render() gives the Prometheus
+text format (GET /metrics on the server, ?format=prometheus on an
+endpoint). A request with X-Profile: cprofile or sample, and X-Profile-Token
+equal to API_PROFILE_TOKEN, is also profiled; its report is kept in memory
+under the X-Profile-Id response header (GET ?profile=<id>).
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import secrets
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.environ.get('API_METRICS', '1') != '0'
+# Profiling is off unless a token is configured (it slows the request down)
+PROFILE_TOKEN = os.environ.get('API_PROFILE_TOKEN', '')
+PROFILE_KEEP = int(os.environ.get('API_PROFILE_KEEP', 16))
+SAMPLE_INTERVAL = float(os.environ.get('API_PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_LINES = 40
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(256 * 4 ** power for power in range(10))
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+FAMILIES = {
+    'api_requests_total': ('counter', 'Requests handled, by service and HTTP status'),
+    'api_request_seconds': ('histogram', 'Time from body read to the last response byte produced'),
+    'api_stage_seconds': ('histogram', 'Time per request stage (handler stages are part of handle)'),
+    'api_request_bytes': ('histogram', 'Request body size'),
+    'api_response_bytes': ('histogram', 'Response body size'),
+    'api_request_invoices': ('histogram', 'Invoices per request (sent or resident)'),
+    'api_cache_requests_total': ('counter', 'Response cache outcome per request (hit, miss, bypass)')
+}
+
+_current = ContextVar('request_trace', default=None)
+
+
+class Histogram:
+    """Counts per upper bound (cumulated when rendered), plus sum and count"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        index = bisect_left(self.bounds, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}' if labels else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Thread-safe counters and histograms keyed by (family, labels)"""
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, family, labels, amount=1):
+        key = (family, labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def observe(self, family, labels, value, bounds=SECONDS_BUCKETS):
+        key = (family, labels)
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = Histogram(bounds)
+            histogram.observe(value)
+
+    def render(self, extra=()):
+        """Prometheus text exposition; extra: (family, type, help, [(labels, value)]) gauges/counters"""
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: item[0])
+            snapshot = [(key, (list(value.counts), value.sum, value.count, value.bounds)
+                         if isinstance(value, Histogram) else value) for key, value in series]
+        lines = []
+        seen = set()
+        for (family, labels), value in snapshot:
+            if family not in seen:
+                seen.add(family)
+                kind, text = FAMILIES[family]
+                lines += [f'# HELP {family} {text}', f'# TYPE {family} {kind}']
+            if not isinstance(value, tuple):
+                lines.append(f'{family}{_labels(labels)} {_number(value)}')
+                continue
+            counts, total, count, bounds = value
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                lines.append(f'{family}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{family}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{family}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{family}_count{_labels(labels)} {count}')
+        for family, kind, text, samples in extra:
+            lines += [f'# HELP {family} {text}', f'# TYPE {family} {kind}']
+            lines += [f'{family}{_labels(labels)} {_number(value)}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class stage:
+    """Time a block as a named stage of the current request (no-op when untraced)"""
+
+    __slots__ = ('name', 'trace', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def record_invoices(count):
+    """Invoices this request works on (resident datasets report their size)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.invoices = count
+
+
+def record_cache(outcome):
+    trace = _current.get()
+    if trace is not None:
+        trace.cache = outcome
+
+
+def counted(items):
+    """Pass a streamed item iterator through, counting items into the current request"""
+    trace = _current.get()
+    for item in items:
+        if trace is not None:
+            trace.invoices = (trace.invoices or 0) + 1
+        yield item
+
+
+class SamplingProfiler:
+    """Samples the request thread's stack every SAMPLE_INTERVAL seconds (low overhead, statistical)"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.thread_id = None
+        self.samples = 0
+        self.own = Counter()
+        self.inclusive = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='api-sampler', daemon=True)
+
+    def resume(self):
+        """Sample the calling thread (a streamed response may move to another thread)"""
+        self.thread_id = threading.get_ident()
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def pause(self):
+        self.thread_id = None
+
+    def stop(self):
+        self.pause()
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[self._where(frame)] += 1
+            seen = set()
+            while frame is not None:
+                where = self._where(frame)
+                if where not in seen:
+                    seen.add(where)
+                    self.inclusive[where] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _where(frame):
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})'
+
+    def report(self):
+        lines = [f'{self.samples} samples every {self.interval * 1000:g} ms', '', 'own     total   function']
+        for where, total in self.inclusive.most_common(PROFILE_LINES):
+            lines.append(f'{self.own[where]:<7} {total:<7} {where}')
+        return '\n'.join(lines) + '\n'
+
+
+class _CProfiler:
+    """cProfile over the request thread, reported by cumulative time"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def resume(self):
+        self.profile.enable()
+
+    def pause(self):
+        self.profile.disable()
+
+    stop = pause
+
+    def report(self):
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return out.getvalue()
+
+
+_profiles = OrderedDict()
+# One profiled request at a time: profilers are process-wide hooks and costly
+_profile_busy = threading.Lock()
+_profiles_lock = threading.Lock()
+
+
+def get_profile(profile_id):
+    """Stored report for a profiled request, or None"""
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def _keep_profile(profile_id, report):
+    with _profiles_lock:
+        _profiles[profile_id] = report
+        while len(_profiles) > PROFILE_KEEP:
+            _profiles.popitem(last=False)
+
+
+class RequestTrace:
+    """Stage timings and counters for one request, recorded into the registry on finish()"""
+
+    def __init__(self, service, request_bytes=0, profile=None):
+        self.service = service
+        self.request_bytes = request_bytes
+        self.invoices = None
+        self.cache = 'bypass'
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.profiler = None
+        self.profile_id = None
+        if profile in ('cprofile', 'sample') and _profile_busy.acquire(blocking=False):
+            self.profile_id = secrets.token_hex(8)
+            self.profiler = _CProfiler() if profile == 'cprofile' else SamplingProfiler()
+        self.attach()
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def headers(self):
+        """Server-Timing for the stages so far, and the profile id when profiled"""
+        headers = {}
+        if self.stages:
+            headers['Server-Timing'] = ', '.join(f'{name};dur={seconds * 1000:.2f}'
+                                                 for name, seconds in self.stages.items())
+        if self.profile_id:
+            headers['X-Profile-Id'] = self.profile_id
+        return headers
+
+    def attach(self):
+        """Make this the current trace of the calling thread (and profile it)"""
+        _current.set(self)
+        if self.profiler is not None:
+            self.profiler.resume()
+
+    def detach(self):
+        """Stop tracing the calling thread; a streamed response attaches again where it runs"""
+        _current.set(None)
+        if self.profiler is not None:
+            self.profiler.pause()
+
+    def finish(self, status, response_bytes=None):
+        self.detach()
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.stop()
+            _keep_profile(self.profile_id, self.profiler.report())
+            self.profiler = None
+            _profile_busy.release()
+        if not METRICS_ENABLED:
+            return
+        service = (('service', self.service),)
+        registry.inc('api_requests_total', service + (('status', str(status)),))
+        registry.inc('api_cache_requests_total', service + (('result', self.cache),))
+        registry.observe('api_request_seconds', service, elapsed)
+        for name, seconds in self.stages.items():
+            registry.observe('api_stage_seconds', service + (('stage', name),), seconds)
+        registry.observe('api_request_bytes', service, self.request_bytes, BYTES_BUCKETS)
+        if response_bytes is not None:
+            registry.observe('api_response_bytes', service, response_bytes, BYTES_BUCKETS)
+        if self.invoices is not None:
+            registry.observe('api_request_invoices', service, self.invoices, COUNT_BUCKETS)
+
+
+def begin(service, headers):
+    """Trace for a request about to be parsed (profiled when its headers ask and are allowed)"""
+    profile = headers.get('X-Profile')
+    if not (PROFILE_TOKEN and secrets.compare_digest(headers.get('X-Profile-Token') or '', PROFILE_TOKEN)):
+        profile = None
+    return RequestTrace(service, int(headers.get('Content-Length') or 0), profile)
+
+
+def render(extra=()):
+    return registry.render(extra)
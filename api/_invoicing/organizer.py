@@ -0,0 +1,308 @@
+"""
+Ledger Validation
+The Data Organizer's rule engine. Every rule runs in one pass over the
+ledger, block by block (each rule sweeps a block while it is hot, which also
+keeps per-rule timing cheap), and issues come out in ledger order.
+
+Three ways to consume it:
+- validate_ledger(): counts, per-rule timing and the first few issues; large
+  ledgers are partitioned across processes and merged exactly
+- iter_issues(): every issue, lazily, for NDJSON streaming
+- write_report(): every issue into a gzipped NDJSON report file
+"""
+
+import gzip
+import json
+import os
+import secrets
+import time
+from itertools import islice
+
+from .indexes import normalize_name
+from .parallel import partitioned
+
+DETAIL_LIMIT = 10
+BLOCK_SIZE = 1024
+REPORT_DIR = os.environ.get('ORGANIZER_REPORT_DIR', '/tmp/cognicore-reports')
+
+# Totals are computed like the invoice editor: items - discount + shipping, + VAT if exclusive
+VAT_RATE = 0.15
+AMOUNT_TOLERANCE = 0.02
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class ValidationContext:
+    """State shared by the rules over one pass"""
+
+    def __init__(self, customers=None):
+        # Normalized customer names; None disables the orphan check
+        self.customers = customers
+        # Invoice number -> (position, invoice id) of its first occurrence
+        self.numbers = {}
+        self.position = 0
+
+
+def check_missing_number(inv, ctx):
+    if not inv.get('number'):
+        return {
+            'type': 'missing_invoice_number',
+            'invoice_id': inv.get('id'),
+            'fix': 'Generated invoice number'
+        }
+
+
+def check_missing_date(inv, ctx):
+    if not inv.get('date'):
+        return {
+            'type': 'missing_date',
+            'invoice_id': inv.get('id'),
+            'fix': 'Set to today'
+        }
+
+
+def check_payment_exceeds_total(inv, ctx):
+    if inv.get('total', 0) < inv.get('amountPaid', 0):
+        return {
+            'type': 'payment_exceeds_total',
+            'invoice': inv.get('number'),
+            'alert': 'Payment amount exceeds invoice total'
+        }
+
+
+def duplicate_issue(number, invoice_id, first_id):
+    return {
+        'type': 'duplicate_invoice_number',
+        'invoice': number,
+        'invoice_id': invoice_id,
+        'first_invoice_id': first_id,
+        'alert': 'Invoice number is already used by another invoice'
+    }
+
+
+def check_duplicate_number(inv, ctx):
+    number = inv.get('number')
+    if not number:
+        return None
+    first = ctx.numbers.get(number)
+    if first is None:
+        ctx.numbers[number] = (ctx.position, inv.get('id'))
+        return None
+    return duplicate_issue(number, inv.get('id'), first[1])
+
+
+def check_negative_total(inv, ctx):
+    total = _number(inv.get('total'))
+    if total is not None and total < 0:
+        return {
+            'type': 'negative_total',
+            'invoice': inv.get('number'),
+            'total': total,
+            'alert': 'Invoice total is negative'
+        }
+
+
+def expected_total(inv):
+    """Total implied by the line items, discount, shipping and VAT option (None if unknown)"""
+    items = inv.get('items')
+    if not items:
+        return None
+    subtotal = 0
+    for item in items:
+        amount = _number(item.get('total'))
+        if amount is None:
+            quantity = _number(item.get('quantity'))
+            price = _number(item.get('unitPrice', item.get('price')))
+            if quantity is None or price is None:
+                return None
+            amount = quantity * price
+        subtotal += amount
+
+    discount = inv.get('discount')
+    if isinstance(discount, dict) and (_number(discount.get('amount')) or 0) > 0:
+        if discount.get('type', 'percentage') == 'percentage':
+            subtotal -= subtotal * discount['amount'] / 100
+        else:
+            subtotal -= min(discount['amount'], subtotal)
+    subtotal += _number(inv.get('shipping')) or 0
+    if inv.get('vatOption') == 'exclude':
+        subtotal += subtotal * VAT_RATE
+    return subtotal
+
+
+def check_line_items(inv, ctx):
+    total = _number(inv.get('total'))
+    if total is None:
+        return None
+    expected = expected_total(inv)
+    if expected is not None and abs(expected - total) > AMOUNT_TOLERANCE:
+        return {
+            'type': 'line_item_mismatch',
+            'invoice': inv.get('number'),
+            'total': total,
+            'line_items_total': round(expected, 2),
+            'alert': 'Line items do not add up to the invoice total'
+        }
+
+
+def check_date_order(inv, ctx):
+    issued = inv.get('date')
+    if not issued or not isinstance(issued, str):
+        return None
+    issued = issued[:10]
+    for field in ('dueDate', 'paidDate'):
+        other = inv.get(field)
+        # ISO dates compare correctly as strings
+        if other and isinstance(other, str) and other[:10] < issued:
+            return {
+                'type': 'date_order',
+                'invoice': inv.get('number'),
+                'field': field,
+                'alert': f'{field} is before the invoice date'
+            }
+
+
+def check_orphan_customer(inv, ctx):
+    if ctx.customers is None:
+        return None
+    if normalize_name(inv.get('customer')) not in ctx.customers:
+        return {
+            'type': 'orphan_customer',
+            'invoice': inv.get('number'),
+            'customer': inv.get('customer'),
+            'alert': 'Customer is not in the customer list'
+        }
+
+
+# Evaluation order is also the order of issues for the same invoice
+RULES = [
+    ('missing_invoice_number', check_missing_number),
+    ('missing_date', check_missing_date),
+    ('payment_exceeds_total', check_payment_exceeds_total),
+    ('duplicate_invoice_number', check_duplicate_number),
+    ('negative_total', check_negative_total),
+    ('line_item_mismatch', check_line_items),
+    ('date_order', check_date_order),
+    ('orphan_customer', check_orphan_customer)
+]
+RULE_ORDER = {name: order for order, (name, _) in enumerate(RULES)}
+
+# Issues the organizer repairs itself rather than flags
+FIXED_RULES = ('missing_invoice_number', 'missing_date')
+
+
+class RuleStats:
+    """Issue count and evaluation time per rule"""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(RULE_ORDER, 0)
+        self.seconds = dict.fromkeys(RULE_ORDER, 0.0)
+
+    def merge(self, other):
+        for name in RULE_ORDER:
+            self.counts[name] += other.counts[name]
+            self.seconds[name] += other.seconds[name]
+
+    @property
+    def issues(self):
+        return sum(self.counts.values())
+
+    @property
+    def fixed(self):
+        return sum(self.counts[name] for name in FIXED_RULES)
+
+    def summary(self):
+        return {
+            name: {'count': self.counts[name], 'ms': round(self.seconds[name] * 1000, 3)}
+            for name in RULE_ORDER
+        }
+
+
+def customer_names(customers):
+    """Normalized name set for the orphan check, or None when no customer list was given"""
+    if not customers:
+        return None
+    return {normalize_name(customer.get('name')) for customer in customers}
+
+
+def scan_blocks(invoices, ctx, stats, offset=0):
+    """Yield (position, issue) for every issue, in ledger order (works on an iterator)"""
+    invoices = iter(invoices)
+    position = offset
+    while True:
+        block = list(islice(invoices, BLOCK_SIZE))
+        if not block:
+            return
+        found = []
+        for order, (name, check) in enumerate(RULES):
+            start = time.perf_counter()
+            count = 0
+            for index, inv in enumerate(block):
+                ctx.position = position + index
+                issue = check(inv, ctx)
+                if issue is not None:
+                    found.append((index, order, issue))
+                    count += 1
+            stats.seconds[name] += time.perf_counter() - start
+            stats.counts[name] += count
+        found.sort(key=lambda entry: entry[:2])
+        for index, _, issue in found:
+            yield position + index, issue
+        position += len(block)
+
+
+def validate_chunk(invoices, offset=0, customers=None):
+    """(RuleStats, first DETAIL_LIMIT (position, issue), first-seen invoice numbers) for one chunk"""
+    ctx = ValidationContext(customers)
+    stats = RuleStats()
+    details = []
+    for position, issue in scan_blocks(invoices, ctx, stats, offset):
+        if len(details) < DETAIL_LIMIT:
+            details.append((position, issue))
+    return stats, details, ctx.numbers
+
+
+def validate_ledger(invoices, customers=None):
+    """(RuleStats, first DETAIL_LIMIT issues) for the ledger, partitioned when large"""
+    stats = RuleStats()
+    details = []
+    seen = {}
+    for chunk_stats, chunk_details, numbers in partitioned(
+            validate_chunk, invoices, args=(customer_names(customers),)):
+        stats.merge(chunk_stats)
+        # A chunk only sees its own duplicates: point them at the ledger's first occurrence,
+        # and find repeats of earlier chunks' numbers here
+        for position, issue in chunk_details:
+            first = seen.get(issue.get('invoice')) if issue['type'] == 'duplicate_invoice_number' else None
+            if first is not None:
+                issue = dict(issue, first_invoice_id=first[1])
+            details.append((position, issue))
+        for number, (position, invoice_id) in numbers.items():
+            first = seen.get(number)
+            if first is None:
+                seen[number] = (position, invoice_id)
+                continue
+            stats.counts['duplicate_invoice_number'] += 1
+            details.append((position, duplicate_issue(number, invoice_id, first[1])))
+    details.sort(key=lambda entry: (entry[0], RULE_ORDER[entry[1]['type']]))
+    return stats, [issue for _, issue in details[:DETAIL_LIMIT]]
+
+
+def iter_issues(invoices, customers=None, stats=None):
+    """Every issue in ledger order; stats (a RuleStats) fills in as the pass proceeds"""
+    ctx = ValidationContext(customer_names(customers))
+    for position, issue in scan_blocks(invoices, ctx, stats if stats is not None else RuleStats()):
+        yield dict(issue, row=position)
+
+
+def write_report(invoices, customers=None, directory=REPORT_DIR):
+    """Write every issue as gzipped NDJSON; returns (path, RuleStats)"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"validation-{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}.ndjson.gz")
+    stats = RuleStats()
+    with gzip.open(path, 'wt', encoding='utf-8') as report:
+        for issue in iter_issues(invoices, customers, stats):
+            report.write(json.dumps(issue, separators=(',', ':')) + '\n')
+    return path, stats
@@ -0,0 +1,99 @@
+"""
+Partitioned Execution
+Splits a large invoice list into chunks, runs a chunk function on a process
+pool and hands back the partial results in chunk order for the caller to
+merge. Each chunk is pickled out to a worker and only the partial results
+(counts, sums, short lists) come back.
+
+Pools are started once per worker count and reused. Workers come from a
+forkserver (or spawn) rather than forking the caller, so a request thread
+of the threaded server never forks a process holding other threads' locks,
+and concurrent requests share the pool instead of queueing for it.
+
+Small inputs, streamed (non-list) inputs and platforms without the
+semaphores a pool needs (e.g. AWS Lambda) run serially.
+"""
+
+import atexit
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+WORKERS = int(os.environ.get('PARALLEL_WORKERS', 0)) or (os.cpu_count() or 1)
+CHUNK_SIZE = int(os.environ.get('PARALLEL_CHUNK_SIZE', 50000))
+MIN_ITEMS = int(os.environ.get('PARALLEL_MIN_ITEMS', 100000))
+
+# Chunk functions live here; forkserver workers import them once, up front
+PRELOAD = ['_invoicing.organizer', '_invoicing.search']
+
+# Worker count -> running pool; the lock only guards starting and dropping pools
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' in methods:
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(PRELOAD)
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=_context())
+        return pool
+
+
+def _drop_pool(workers, pool):
+    """Forget a broken pool so the next call starts a fresh one"""
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def partitioned(func, items, args=(), workers=None, chunk_size=None, min_items=None):
+    """[func(chunk, offset, *args) for each chunk of items], computed on a process pool
+
+    func must be a module-level function (it is pickled by reference).
+    Falls back to a single func(items, 0, *args) call when partitioning
+    would not pay off or is not available.
+    """
+    workers = workers or WORKERS
+    chunk_size = chunk_size or CHUNK_SIZE
+    min_items = MIN_ITEMS if min_items is None else min_items
+    if workers <= 1 or not isinstance(items, list) or len(items) < max(min_items, 2):
+        return [func(items, 0, *args)]
+
+    # At least one chunk per worker, so small-but-eligible inputs still spread out
+    chunk_size = min(chunk_size, math.ceil(len(items) / workers))
+    bounds = [(start, min(start + chunk_size, len(items)))
+              for start in range(0, len(items), chunk_size)]
+
+    pool = None
+    try:
+        pool = _pool(workers)
+        futures = [pool.submit(func, items[start:stop], start, *args) for start, stop in bounds]
+        return [future.result() for future in futures]
+    except (OSError, ImportError, NotImplementedError, BrokenProcessPool):
+        # No usable pool here, or a worker died (e.g. killed for memory): redo in-process
+        # and let the next call start a fresh pool
+        if pool is not None:
+            _drop_pool(workers, pool)
+    return [func(items, 0, *args)]
@@ -0,0 +1,173 @@
+"""
+Customer Reliability Profiles
+Per-customer payment behaviour (counts, on-time ratio, average days late and
+an exponentially weighted reliability that favours recent invoices), kept up
+to date invoice by invoice so follow-up tuning is a dictionary lookup instead
+of a scan over the customer's history.
+"""
+
+import os
+
+from .columnar import parse_day
+from .indexes import normalize_name
+
+# Days after which an invoice counts half as much towards recent reliability
+HALF_LIFE_DAYS = float(os.environ.get('PROFILE_HALF_LIFE_DAYS', 90))
+
+# Removing a settled invoice this much heavier than everything left recomputes the
+# weighted sums from the per-day counts instead of trusting a cancelled difference
+CANCELLATION_RATIO = 2.0 ** 20
+
+
+def contribution(inv):
+    """What one invoice adds to its customer's profile"""
+    status = inv.get('status')
+    paid = status == 'paid'
+    overdue = status == 'overdue'
+    days_late = None
+    if paid:
+        paid_on = parse_day(inv.get('paidDate'))
+        due = parse_day(inv.get('dueDate'))
+        if paid_on is not None and due is not None:
+            days_late = max(0, paid_on - due)
+
+    # Settled outcomes (paid with known timing, or overdue) feed recent reliability
+    day = None
+    if days_late is not None or overdue:
+        day = parse_day(inv.get('dueDate')) or parse_day(inv.get('date'))
+    return (normalize_name(inv.get('customer')), inv.get('customer'), paid, overdue,
+            days_late, day, days_late == 0)
+
+
+class CustomerProfile:
+    """Running totals for one customer
+
+    Recent reliability weighs each settled invoice by 2 ** ((day - reference) /
+    half-life), where `reference` is the newest settled day seen, so weights
+    never exceed 1 and nothing overflows whatever the dates. Exact counts per
+    day back the float sums: they are rescaled when a newer day arrives and
+    rebuilt when a removal would leave only rounding error.
+    """
+
+    __slots__ = ('name', 'invoices', 'paid', 'overdue', 'timed', 'on_time',
+                 'days_late', 'settled', 'reference', 'weight', 'good')
+
+    def __init__(self, name):
+        self.name = name
+        self.invoices = 0
+        self.paid = 0
+        self.overdue = 0
+        self.timed = 0
+        self.on_time = 0
+        self.days_late = 0
+        # day -> (settled invoices, settled on time)
+        self.settled = {}
+        self.reference = None
+        self.weight = 0.0
+        self.good = 0.0
+
+    def apply(self, contrib, sign=1):
+        _, _, paid, overdue, days_late, day, on_time = contrib
+        self.invoices += sign
+        self.paid += sign * paid
+        self.overdue += sign * overdue
+        if days_late is not None:
+            self.timed += sign
+            self.on_time += sign * (days_late == 0)
+            self.days_late += sign * days_late
+        if day is not None:
+            self._settle(day, on_time, sign)
+
+    def _settle(self, day, on_time, sign):
+        count, good = self.settled.get(day, (0, 0))
+        count += sign
+        good += sign * on_time
+        if count:
+            self.settled[day] = (count, good)
+        else:
+            self.settled.pop(day, None)
+
+        if sign > 0 and (self.reference is None or day > self.reference):
+            # Re-anchor on the newest day; older weights only shrink
+            scale = 2.0 ** ((self.reference - day) / HALF_LIFE_DAYS) if self.reference is not None else 0.0
+            self.weight *= scale
+            self.good *= scale
+            self.reference = day
+        weight = 2.0 ** ((day - self.reference) / HALF_LIFE_DAYS)
+        self.weight += sign * weight
+        self.good += sign * weight * on_time
+        if sign < 0 and (not self.settled or weight > max(self.weight, 0.0) * CANCELLATION_RATIO):
+            self._recompute()
+
+    def _recompute(self):
+        """Weighted sums from the per-day counts, anchored on the newest remaining day"""
+        self.reference = max(self.settled) if self.settled else None
+        self.weight = 0.0
+        self.good = 0.0
+        for day, (count, good) in self.settled.items():
+            weight = 2.0 ** ((day - self.reference) / HALF_LIFE_DAYS)
+            self.weight += count * weight
+            self.good += good * weight
+
+    def summary(self):
+        return {
+            'customer': self.name,
+            'invoices': self.invoices,
+            'paid': self.paid,
+            'overdue': self.overdue,
+            'payment_reliability': self.paid / self.invoices if self.invoices else 0.5,
+            'on_time_ratio': round(self.on_time / self.timed, 4) if self.timed else None,
+            'avg_days_late': round(self.days_late / self.timed, 1) if self.timed else 0,
+            'recent_reliability': round(self.good / self.weight, 4) if self.weight > 0 else None
+        }
+
+
+def history_profile(invoices, name=None):
+    """One profile over a whole history list (single pass, works on an iterator)"""
+    profile = CustomerProfile(name)
+    for inv in invoices:
+        profile.apply(contribution(inv))
+    return profile.summary()
+
+
+class ProfileBook:
+    """Customer profiles keyed by normalized name, updated per invoice add/replace/remove"""
+
+    def __init__(self):
+        self.profiles = {}
+        self._contributions = {}
+
+    @classmethod
+    def from_invoices(cls, invoices, key=None):
+        book = cls()
+        for pos, inv in enumerate(invoices):
+            book.add(key(inv) if key else pos, inv)
+        return book
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def add(self, key, inv):
+        """Count an invoice, replacing any previous version with the same key"""
+        if key in self._contributions:
+            self.remove(key)
+        contrib = contribution(inv)
+        profile = self.profiles.get(contrib[0])
+        if profile is None:
+            profile = self.profiles[contrib[0]] = CustomerProfile(contrib[1])
+        profile.apply(contrib)
+        self._contributions[key] = contrib
+
+    def remove(self, key):
+        contrib = self._contributions.pop(key, None)
+        if contrib is None:
+            return
+        profile = self.profiles[contrib[0]]
+        profile.apply(contrib, -1)
+        if not profile.invoices:
+            del self.profiles[contrib[0]]
+
+    def get(self, customer_name):
+        """Profile summary for a customer, or None if they have no invoices"""
+        profile = self.profiles.get(normalize_name(customer_name))
+        return profile.summary() if profile is not None else None
@@ -0,0 +1,237 @@
+"""
+Query Plans
+Compiles a rag-query question once into a plan (intent, timeframe, status
+filter, aggregation, result limit) and caches it by normalized text. Plans
+execute as one fused pass that filters by customer, date range and status
+while summing and keeping the rows the answer shows.
+
+The customer is resolved per request (it depends on the customer list) and
+the date range per day (it is relative to today), so neither is cached.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from .indexes import PREFIX_END, normalize_name
+
+PLAN_CACHE_SIZE = int(os.environ.get('QUERY_PLAN_CACHE_SIZE', 1024))
+
+# Checked in order; the first intent with a keyword in the question wins
+INTENT_KEYWORDS = [
+    ('aging', ('aging', 'ageing', 'receivable', 'past due')),
+    ('total_spending', ('total', 'spending', 'spent')),
+    ('overdue', ('overdue', 'late', 'outstanding')),
+    ('recent', ('last', 'recent')),
+    ('average', ('average', 'avg')),
+    ('paid', ('paid',))
+]
+
+# Intent -> (status filter, summed value, rows kept for the answer, filtered by timeframe)
+AGGREGATIONS = {
+    'total_spending': (None, 'total', 10, True),
+    'overdue': ('overdue', 'balance', None, False),
+    'average': (None, 'total', 0, True),
+    'paid': ('paid', 'total', 10, False)
+}
+
+NUMBER_PATTERN = re.compile(r'(\d+)')
+# Open windows beyond the fixed ones: "last 45 days", "last 6 weeks", "since 2025-01-01"
+WINDOW_PATTERN = re.compile(r'\blast (\d+) (day|week|month)s?\b')
+SINCE_PATTERN = re.compile(r'\bsince (\d{4}-\d{2}-\d{2})\b')
+WINDOW_DAYS = {'day': 1, 'week': 7, 'month': 30}
+# Days-past-due ranges turn an overdue question into an aging one: "60-90 days", "over 90 days", "90+ days"
+PAST_DUE_RANGE = re.compile(r'(\d+)\s*(?:-|\u2013|to)\s*(\d+)\s*days?')
+PAST_DUE_OVER = re.compile(r'(?:over|more than|older than)\s*(\d+)\s*days?|(\d+)\s*\+\s*days?')
+
+
+def normalize_query(query):
+    return ' '.join((query or '').lower().split())
+
+
+def range_key(text):
+    """Which relative date range the question asks for (None for all time)"""
+    if 'today' in text:
+        return 'today'
+    if 'this week' in text or 'last week' in text:
+        return 'week'
+    if 'this month' in text or 'last month' in text:
+        return 'month'
+    if 'quarter' in text or 'last 3 months' in text:
+        return 'quarter'
+    if 'year' in text or 'last 12 months' in text:
+        return 'year'
+    match = WINDOW_PATTERN.search(text)
+    if match:
+        return ('days', int(match.group(1)) * WINDOW_DAYS[match.group(2)], match.group(0))
+    match = SINCE_PATTERN.search(text)
+    if match:
+        try:
+            return ('since', date.fromisoformat(match.group(1)).isoformat())
+        except ValueError:
+            return None
+    return None
+
+
+def past_due_range(text):
+    """(min, max) days past due asked for (max None = open-ended), or None"""
+    match = PAST_DUE_RANGE.search(text)
+    if match:
+        low, high = sorted((int(match.group(1)), int(match.group(2))))
+        return low, high
+    match = PAST_DUE_OVER.search(text)
+    if match:
+        return int(match.group(1) or match.group(2)) + 1, None
+    return None
+
+
+def window_label(key):
+    """Timeframe wording for an open window range key"""
+    if key[0] == 'since':
+        return f'since {key[1]}'
+    return key[2]
+
+
+def timeframe_label(text):
+    """Timeframe wording used in answers"""
+    if 'today' in text:
+        return 'today'
+    for label in ('this week', 'last week', 'this month', 'last month'):
+        if label in text:
+            return label
+    if 'quarter' in text:
+        return 'last quarter'
+    if 'year' in text:
+        return 'this year'
+    return 'all time'
+
+
+def date_range(key, today):
+    """[start, end) date-string range for a range key relative to `today` (end None = open)"""
+    if key == 'today':
+        day = today.isoformat()
+        return day, day + PREFIX_END
+    if key == 'week':
+        return (today - timedelta(days=7)).isoformat(), None
+    if key == 'month':
+        month = today.isoformat()[:7]
+        return month, month + PREFIX_END
+    if key == 'quarter':
+        return (today - timedelta(days=90)).isoformat(), None
+    if key == 'year':
+        year = today.isoformat()[:4]
+        return year, year + PREFIX_END
+    if isinstance(key, tuple):
+        if key[0] == 'since':
+            return key[1], None
+        return (today - timedelta(days=key[1])).isoformat(), None
+    return None
+
+
+def day_range(key, today):
+    """The same range as date_range() in ordinal days, [start, end) (end None = open)"""
+    if key is None:
+        return None
+    if key in ('month', 'year'):
+        first = today.replace(day=1) if key == 'month' else today.replace(month=1, day=1)
+        if key == 'year':
+            stop = first.replace(year=first.year + 1)
+        else:
+            stop = (first + timedelta(days=32)).replace(day=1)
+        return first.toordinal(), stop.toordinal()
+    if key == 'today':
+        return today.toordinal(), today.toordinal() + 1
+    start = date.fromisoformat(date_range(key, today)[0])
+    return start.toordinal(), None
+
+
+class QueryPlan:
+    """A compiled question; immutable and shared between requests"""
+
+    __slots__ = ('text', 'intent', 'range_key', 'timeframe', 'limit',
+                 'status', 'value', 'keep', 'uses_timeframe', 'past_due')
+
+    def __init__(self, text):
+        self.text = text
+        self.intent = 'general_search'
+        for intent, keywords in INTENT_KEYWORDS:
+            if any(keyword in text for keyword in keywords):
+                self.intent = intent
+                break
+        self.past_due = None
+        if self.intent in ('aging', 'overdue'):
+            # Overdue by due date rather than by the status flag
+            self.past_due = past_due_range(text)
+            if self.past_due is not None:
+                self.intent = 'aging'
+        self.range_key = range_key(text)
+        self.timeframe = (window_label(self.range_key) if isinstance(self.range_key, tuple)
+                          else timeframe_label(text))
+
+        # "last 5 invoices" -> 5
+        match = NUMBER_PATTERN.search(text)
+        self.limit = int(match.group(1)) if match else 5
+
+        self.status, self.value, self.keep, self.uses_timeframe = AGGREGATIONS.get(
+            self.intent, (None, 'total', None, False))
+
+    def date_range(self, today):
+        return date_range(self.range_key, today) if self.uses_timeframe else None
+
+    def day_range(self, today):
+        return day_range(self.range_key, today) if self.uses_timeframe else None
+
+
+_plan_cache = OrderedDict()
+_plan_lock = threading.Lock()
+
+
+def compile_query(query):
+    """Cached plan for a question (keyed by its normalized text)"""
+    text = normalize_query(query)
+    with _plan_lock:
+        plan = _plan_cache.get(text)
+        if plan is not None:
+            _plan_cache.move_to_end(text)
+            return plan
+    plan = QueryPlan(text)
+    with _plan_lock:
+        _plan_cache[text] = plan
+        if len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def _amount(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def scan(invoices, customer_name=None, date_range=None, status=None, value='total', keep=None):
+    """Fused filter + aggregate: (sum of value, count, first `keep` matches (all if None))
+
+    Non-numeric totals and payments count as 0, as in the aggregate cube.
+    """
+    name = normalize_name(customer_name) if customer_name else None
+    start, end = date_range if date_range is not None else (None, None)
+    balance = value == 'balance'
+    total = 0
+    count = 0
+    kept = []
+    for inv in invoices:
+        # Cheapest, most selective checks first; normalize_name inlined for the hot loop
+        if status is not None and inv.get('status') != status:
+            continue
+        if name is not None and (inv.get('customer') or '').strip().lower() != name:
+            continue
+        if start is not None:
+            day = inv.get('date') or ''
+            if day < start or (end is not None and day >= end):
+                continue
+        amount = _amount(inv.get('total', 0))
+        total += amount - _amount(inv.get('amountPaid', 0)) if balance else amount
+        count += 1
+        if keep is None or len(kept) < keep:
+            kept.append(inv)
+    return total, count, kept
@@ -0,0 +1,189 @@
+"""
+Compact Invoice Records
+Resident invoices as __slots__ records decoded once from JSON, instead of
+one dict per invoice and per line item. Repeated strings (customer, status,
+dates, SKUs) are interned so millions of invoices share a few thousand
+string objects, and amounts are exact integer cents.
+
+Records are read-only Mappings: get('total', 0), ['status'], `in` and
+iteration behave like the decoded dict, so every module keeps working on
+either form. Anything that does not fit a slot (unknown keys, sub-cent
+amounts, non-list items) is kept as-is in `extra`, so to_dict() gives back
+the original document (keys in field order rather than JSON order).
+"""
+
+import sys
+from collections.abc import Mapping
+
+# Field kinds: stored as-is, interned string, integer cents, line items
+PLAIN, SHARED, AMOUNT, ITEMS = range(4)
+
+
+class _Absent:
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<absent>'
+
+
+ABSENT = _Absent()
+
+
+def to_cents(value):
+    """Exact integer cents for a JSON number, or None if it is not a whole number of cents"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, int):
+        return value * 100
+    try:
+        cents = round(value * 100)
+    except (OverflowError, ValueError):
+        return None
+    return cents if cents / 100 == value else None
+
+
+def _shared(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class CompactRecord(Mapping):
+    """Read-only mapping over slots; subclasses list FIELDS as (json key, slot, kind)"""
+
+    __slots__ = ('extra', 'int_amounts')
+    FIELDS = ()
+    _LOOKUP = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # json key -> (slot, kind, bit marking amounts that were JSON integers)
+        cls._LOOKUP = {key: (slot, kind, 1 << position)
+                       for position, (key, slot, kind) in enumerate(cls.FIELDS)}
+
+    @classmethod
+    def decode(cls, doc):
+        """Record from a decoded JSON object (the object itself is not kept)"""
+        record = cls.__new__(cls)
+        int_amounts = 0
+        matched = 0
+        extra = None
+        for position, (key, slot, kind) in enumerate(cls.FIELDS):
+            value = doc.get(key, ABSENT)
+            if value is not ABSENT:
+                matched += 1
+                if kind == SHARED:
+                    value = _shared(value)
+                elif kind == AMOUNT:
+                    cents = to_cents(value)
+                    if cents is None:
+                        extra = extra or {}
+                        extra[key] = value
+                        value = ABSENT
+                    else:
+                        if isinstance(value, int):
+                            int_amounts |= 1 << position
+                        value = cents
+                elif kind == ITEMS:
+                    if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+                        value = [LineItem.decode(item) for item in value]
+                    else:
+                        extra = extra or {}
+                        extra[key] = value
+                        value = ABSENT
+            setattr(record, slot, value)
+        if matched < len(doc):
+            extra = extra or {}
+            for key, value in doc.items():
+                if key not in cls._LOOKUP:
+                    extra[key] = value
+        record.extra = extra
+        record.int_amounts = int_amounts
+        return record
+
+    def get(self, key, default=None):
+        field = self._LOOKUP.get(key)
+        if field is not None:
+            slot, kind, bit = field
+            value = getattr(self, slot)
+            if value is not ABSENT:
+                if kind == AMOUNT:
+                    return value // 100 if self.int_amounts & bit else value / 100
+                return value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, ABSENT)
+        if value is ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, ABSENT) is not ABSENT
+
+    def __iter__(self):
+        for key, slot, _ in self.FIELDS:
+            if getattr(self, slot) is not ABSENT:
+                yield key
+        if self.extra is not None:
+            for key in self.extra:
+                if key not in self._LOOKUP or getattr(self, self._LOOKUP[key][0]) is ABSENT:
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """The equivalent plain dict (line items included), e.g. for json.dumps"""
+        doc = {}
+        for key in self:
+            value = self[key]
+            if isinstance(value, list) and value and isinstance(value[0], CompactRecord):
+                value = [item.to_dict() for item in value]
+            doc[key] = value
+        return doc
+
+    def __reduce__(self):
+        return (self.__class__.decode, (self.to_dict(),))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()!r})'
+
+
+class LineItem(CompactRecord):
+    """One invoice line; product strings are interned across the ledger"""
+
+    __slots__ = ('sku', 'name', 'description', 'quantity', 'price_cents', 'total_cents')
+    FIELDS = (
+        ('sku', 'sku', SHARED),
+        ('name', 'name', SHARED),
+        ('description', 'description', SHARED),
+        ('quantity', 'quantity', PLAIN),
+        ('price', 'price_cents', AMOUNT),
+        ('total', 'total_cents', AMOUNT)
+    )
+
+
+class InvoiceRecord(CompactRecord):
+    """One invoice; the hot fields are plain attributes (amounts in cents, ABSENT if missing)"""
+
+    __slots__ = ('id', 'number', 'customer', 'customer_id', 'date', 'due_date', 'paid_date',
+                 'status', 'total_cents', 'amount_paid_cents', 'line_items')
+    FIELDS = (
+        ('id', 'id', PLAIN),
+        ('number', 'number', PLAIN),
+        ('customer', 'customer', SHARED),
+        ('customerId', 'customer_id', SHARED),
+        ('date', 'date', SHARED),
+        ('dueDate', 'due_date', SHARED),
+        ('paidDate', 'paid_date', SHARED),
+        ('status', 'status', SHARED),
+        ('total', 'total_cents', AMOUNT),
+        ('amountPaid', 'amount_paid_cents', AMOUNT),
+        ('items', 'line_items', ITEMS)
+    )
+
+
+def decode_invoices(docs):
+    """Records for a batch of decoded JSON invoices (records pass through unchanged)"""
+    return [doc if isinstance(doc, InvoiceRecord) else InvoiceRecord.decode(doc) for doc in docs]
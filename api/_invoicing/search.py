@@ -0,0 +1,204 @@
+"""
+Full-Text Invoice Search
+Inverted index (term -> {invoice key: term frequency}) maintained
+incrementally as invoices are added or replaced, ranked with BM25
+"""
+
+import heapq
+import math
+import re
+from collections.abc import Mapping
+
+from .indexes import normalize_name
+from .parallel import partitioned
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[.-][a-z0-9]+)*')
+
+# Query words that carry no signal for invoice lookups
+STOPWORDS = frozenset([
+    'a', 'an', 'and', 'all', 'any', 'by', 'find', 'for', 'from', 'in', 'invoice',
+    'invoices', 'me', 'my', 'of', 'on', 'show', 'the', 'to', 'with'
+])
+
+# Standard BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def query_terms(query):
+    """Distinct, non-stopword query tokens in query order"""
+    return [term for term in dict.fromkeys(tokenize(query)) if term not in STOPWORDS]
+
+
+def invoice_terms(value):
+    """Tokens for every string/number value in an invoice (keys are not indexed)"""
+    if isinstance(value, (dict, Mapping)):
+        terms = []
+        for item in value.values():
+            terms.extend(invoice_terms(item))
+        return terms
+    if isinstance(value, (list, tuple)):
+        terms = []
+        for item in value:
+            terms.extend(invoice_terms(item))
+        return terms
+    if value is None or isinstance(value, bool):
+        return []
+    return tokenize(str(value))
+
+
+class SearchIndex:
+    """BM25 inverted index over invoices keyed by a stable invoice key"""
+
+    def __init__(self):
+        self.postings = {}
+        self.docs = {}
+        self.doc_len = {}
+        self.doc_seq = {}
+        self.total_len = 0
+        self._next_seq = 0
+
+    @classmethod
+    def from_invoices(cls, invoices, key=None):
+        index = cls()
+        for pos, inv in enumerate(invoices):
+            index.add(key(inv) if key else pos, inv)
+        return index
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, key, inv):
+        """Index an invoice, replacing any previous version with the same key"""
+        # A replaced invoice keeps its place in the ledger, so it keeps its tie order too
+        seq = self.doc_seq.get(key)
+        if key in self.docs:
+            self.remove(key)
+
+        terms = invoice_terms(inv)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[key] = tf
+
+        self.docs[key] = inv
+        self.doc_len[key] = len(terms)
+        if seq is None:
+            seq = self._next_seq
+            self._next_seq += 1
+        self.doc_seq[key] = seq
+        self.total_len += len(terms)
+
+    def remove(self, key):
+        inv = self.docs.pop(key, None)
+        if inv is None:
+            return
+        for term in set(invoice_terms(inv)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(key)
+        self.doc_seq.pop(key, None)
+
+    def search(self, query, limit=10, predicate=None):
+        """Top `limit` invoices for a free-text query as (score, invoice) pairs"""
+        terms = query_terms(query)
+        if not terms or not self.docs:
+            return []
+
+        n = len(self.docs)
+        avg_len = self.total_len / n if n else 0
+        scores = {}
+        allowed = {}
+        for term in terms:
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for key, tf in posting.items():
+                if predicate is not None:
+                    ok = allowed.get(key)
+                    if ok is None:
+                        ok = allowed[key] = bool(predicate(self.docs[key]))
+                    if not ok:
+                        continue
+                norm = K1 * (1 - B + B * self.doc_len[key] / avg_len) if avg_len else K1
+                scores[key] = scores.get(key, 0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        # Ties go to the invoice indexed first, like the old stable sort
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -self.doc_seq[item[0]]))
+        return [(round(score, 4), self.docs[key]) for key, score in top]
+
+
+def term_stats(invoices, offset, terms, customer=None):
+    """BM25 inputs for one chunk of a ledger that has no resident index
+
+    Returns (docs, total length, {term: document frequency}, candidates) where
+    candidates are (position, length, {term: tf}) for documents that contain
+    a query term and belong to `customer` (a normalized name) when given.
+    """
+    wanted = set(terms)
+    doc_count = 0
+    total_len = 0
+    df = dict.fromkeys(terms, 0)
+    candidates = []
+    for pos, inv in enumerate(invoices, offset):
+        doc_terms = invoice_terms(inv)
+        doc_count += 1
+        total_len += len(doc_terms)
+        counts = {}
+        for term in doc_terms:
+            if term in wanted:
+                counts[term] = counts.get(term, 0) + 1
+        if not counts:
+            continue
+        for term in counts:
+            df[term] += 1
+        if customer is None or normalize_name(inv.get('customer')) == customer:
+            candidates.append((pos, len(doc_terms), counts))
+    return doc_count, total_len, df, candidates
+
+
+def search_invoices(invoices, query, limit=10, customer_name=None):
+    """One-off BM25 search over an invoice list without building an index
+
+    Ranks exactly like SearchIndex.from_invoices(invoices).search() with a
+    customer predicate, but only counts the query's terms.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    customer = normalize_name(customer_name) if customer_name else None
+    parts = partitioned(term_stats, invoices, args=(terms, customer))
+
+    n = sum(part[0] for part in parts)
+    if not n:
+        return []
+    avg_len = sum(part[1] for part in parts) / n
+    df = dict.fromkeys(terms, 0)
+    for part in parts:
+        for term, count in part[2].items():
+            df[term] += count
+
+    idf = {term: math.log(1 + (n - count + 0.5) / (count + 0.5)) for term, count in df.items() if count}
+    scores = []
+    for part in parts:
+        for pos, length, counts in part[3]:
+            norm = K1 * (1 - B + B * length / avg_len) if avg_len else K1
+            score = 0
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    score += idf[term] * tf * (K1 + 1) / (tf + norm)
+            scores.append((score, -pos))
+
+    top = heapq.nlargest(limit, scores)
+    return [(round(score, 4), invoices[-neg_pos]) for score, neg_pos in top]
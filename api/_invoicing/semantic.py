@@ -0,0 +1,606 @@
+"""
+Semantic Invoice Search
+Embeds a short text summary of each invoice (customer, status, line items,
+notes) and answers nearest-neighbour queries by cosine similarity.
+
+- Embeddings come from a local sentence-transformers model when SEMANTIC_MODEL
+  points at one on disk (CPU only, nothing is downloaded); otherwise a signed
+  hashing vectorizer over words and character trigrams, which needs no model
+- Vectors live in a memory-mapped float32 file next to the tenant's SQLite
+  store, so a large index is paged in by the OS instead of held on the heap,
+  and a restart reuses it rather than embedding the ledger again
+- Small indexes are scanned exactly; larger ones use an IVF index (spherical
+  k-means lists, probing the closest few), maintained incrementally on ingest
+  and retrained in the background once enough has changed; searches scan
+  exactly until the first lists are ready
+
+NumPy is required; without it open_index() returns None and callers fall
+back to keyword search.
+"""
+
+import json
+import math
+import os
+import threading
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on deployment
+    np = None
+
+from .search import tokenize
+
+MODEL_PATH = os.environ.get('SEMANTIC_MODEL', '')
+HASH_DIM = int(os.environ.get('SEMANTIC_DIM', 256))
+NPROBE = int(os.environ.get('SEMANTIC_NPROBE', 32))
+# Below this many vectors an exact scan is as fast as probing lists
+IVF_MIN = int(os.environ.get('SEMANTIC_IVF_MIN', 20000))
+
+SUMMARY_FIELDS = ('customer', 'status', 'reference', 'notes')
+EMBED_BATCH = 8192
+# Rows per matrix product when assigning vectors to lists
+ASSIGN_BATCH = 65536
+KMEANS_ITERATIONS = 8
+# Word -> hashed features cache bound (customer names make the vocabulary open-ended)
+FEATURE_CACHE_SIZE = 200000
+INDEX_FILES = ('meta.json', 'keys.json', 'keys.log', 'centroids.npy', 'assign.npy', 'offsets.npy', 'vectors.f32')
+
+
+def invoice_summary(inv):
+    """The text an invoice is embedded from"""
+    parts = [str(inv[field]) for field in SUMMARY_FIELDS if inv.get(field)]
+    for item in inv.get('items') or ():
+        name = item.get('name') or item.get('description')
+        if name:
+            parts.append(str(name))
+    return ' '.join(parts)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return matrix
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words (weight 1) and their character trigrams (weight 0.5)
+
+    Trigrams let "wetsuits" land near "wetsuit" and survive typos. crc32 keeps
+    the hashing stable across processes, so persisted vectors stay valid.
+    """
+
+    def __init__(self, dim=HASH_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+        self._features = {}
+
+    def features(self, word):
+        """(columns, weights) for one word"""
+        cached = self._features.get(word)
+        if cached is not None:
+            return cached
+        padded = f'<{word}>'
+        grams = [('w:' + word, 1.0)] + [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+        merged = {}
+        for gram, weight in grams:
+            h = zlib.crc32(gram.encode())
+            column = h % self.dim
+            merged[column] = merged.get(column, 0.0) + (weight if h & 0x80000000 else -weight)
+        if len(self._features) >= FEATURE_CACHE_SIZE:
+            self._features.clear()
+        cached = self._features[word] = (list(merged), list(merged.values()))
+        return cached
+
+    def embed(self, texts):
+        """Unit-length (len(texts), dim) float32 rows; empty texts embed to zeros"""
+        texts = list(texts)
+        rows, columns, weights = [], [], []
+        for row, text in enumerate(texts):
+            counts = {}
+            for word in tokenize(text):
+                counts[word] = counts.get(word, 0) + 1
+            for word, tf in counts.items():
+                word_columns, word_weights = self.features(word)
+                rows.extend([row] * len(word_columns))
+                columns.extend(word_columns)
+                if tf == 1:
+                    weights.extend(word_weights)
+                else:
+                    # Sublinear term frequency
+                    scale = 1 + math.log(tf)
+                    weights.extend(weight * scale for weight in word_weights)
+        flat = np.bincount(np.array(rows, dtype=np.int64) * self.dim + np.array(columns, dtype=np.int64),
+                           weights=weights, minlength=len(texts) * self.dim)
+        return normalize_rows(flat.reshape(len(texts), self.dim).astype(np.float32))
+
+
+class ModelEmbedder:
+    """A sentence-transformers model loaded from a local path and run on CPU"""
+
+    def __init__(self, path):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(path, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = 'model-' + os.path.basename(os.path.normpath(path))
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=64, convert_to_numpy=True,
+                                    normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Process-wide embedder: the local model if configured and loadable, else hashing"""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            if MODEL_PATH:
+                try:
+                    _embedder = ModelEmbedder(MODEL_PATH)
+                except (ImportError, OSError, ValueError):
+                    _embedder = None
+            if _embedder is None:
+                _embedder = HashingEmbedder()
+        return _embedder
+
+
+class VectorIndex:
+    """Invoice embeddings keyed by a stable invoice key, searched exactly or through IVF lists
+
+    Rows are append-only slots: replacing an invoice writes a new slot and
+    retires the old one. Training regroups the live rows list by list, so a
+    probe reads contiguous rows, and drops retired ones. With a directory the
+    rows are a memory-mapped file.
+    """
+
+    def __init__(self, embedder=None, directory=None, ivf=True):
+        self.embedder = embedder or get_embedder()
+        self.dim = self.embedder.dim
+        self.directory = directory
+        self.ivf = ivf
+        self.keys = []
+        self.slots = {}
+        self.docs = {}
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        # IVF state: centroids, slot -> list, list row ranges, and slots added since training
+        self.centroids = None
+        self.assign = None
+        self.offsets = None
+        self._pending = []
+        self._changed = 0
+        self.trained_size = 0
+        # Slot key changes since the last save, as (slot, key) with None for a retired slot.
+        # keys.json is only rewritten once regrouped (or outgrown by keys.log, which holds the rest)
+        self._key_changes = []
+        self._logged = 0
+        self._keys_saved = False
+        self._lock = threading.Lock()
+        # One training run at a time; the running background one, if any
+        self._train_lock = threading.Lock()
+        self._training = None
+
+    @classmethod
+    def from_invoices(cls, invoices, key=None, directory=None, embedder=None, ivf=True):
+        index = cls(embedder, directory, ivf)
+        if directory:
+            index._reset_directory()
+        invoices = invoices if isinstance(invoices, list) else list(invoices)
+        index._reserve(len(invoices))
+        for start in range(0, len(invoices), EMBED_BATCH):
+            batch = invoices[start:start + EMBED_BATCH]
+            keys = [key(inv) if key else pos for pos, inv in enumerate(batch, start)]
+            index._append(keys, batch, index.embedder.embed(invoice_summary(inv) for inv in batch))
+        with index._lock:
+            index._maybe_train()
+        return index
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _reset_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in INDEX_FILES:
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def _stage_rows(self, capacity, rows=None, name='vectors.f32.tmp'):
+        """A zeroed (capacity, dim) row array holding `rows` first; with a directory, written to file `name`"""
+        if self.directory:
+            vectors = np.memmap(self._path(name), dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+        else:
+            vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        if rows is not None:
+            for start in range(0, len(rows), ASSIGN_BATCH):
+                block = rows[start:start + ASSIGN_BATCH]
+                vectors[start:start + len(block)] = block
+        if not self.directory:
+            return vectors
+        vectors.flush()
+        del vectors
+        return name
+
+    def _install_rows(self, staged, capacity):
+        """Make staged rows the index's rows (moving a staged file into place)"""
+        if not self.directory:
+            return staged
+        os.replace(self._path(staged), self._path('vectors.f32'))
+        return np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def _open_rows(self, capacity, rows=None):
+        """A zeroed (capacity, dim) row array, holding `rows` first (a new file with a directory)"""
+        return self._install_rows(self._stage_rows(capacity, rows), capacity)
+
+    def _reserve(self, extra):
+        """Grow row capacity (doubling) to fit `extra` more slots"""
+        size = len(self.keys)
+        capacity = len(self.vectors)
+        if size + extra <= capacity:
+            return
+        capacity = max(size + extra, capacity * 2, 1024)
+        if self.directory and isinstance(self.vectors, np.memmap):
+            # Extend the file in place; existing rows stay where they are
+            self.vectors.flush()
+            self.vectors = None
+            with open(self._path('vectors.f32'), 'r+b') as handle:
+                handle.truncate(capacity * self.dim * 4)
+            self.vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r+',
+                                     shape=(capacity, self.dim))
+        else:
+            self.vectors = self._open_rows(capacity, self.vectors[:size])
+        live = np.zeros(capacity, dtype=bool)
+        live[:size] = self.live[:size]
+        self.live = live
+        if self.assign is not None:
+            assign = np.full(capacity, -1, dtype=np.int32)
+            assign[:size] = self.assign[:size]
+            self.assign = assign
+
+    def _append(self, keys, invoices, vectors):
+        self._reserve(len(keys))
+        start = len(self.keys)
+        stop = start + len(keys)
+        self.vectors[start:stop] = vectors
+        self.live[start:stop] = True
+        for slot, (key, inv) in enumerate(zip(keys, invoices), start):
+            old = self.slots.get(key)
+            if old is not None:
+                self._retire(old)
+            self.keys.append(key)
+            self.slots[key] = slot
+            self.docs[key] = inv
+            self._key_changes.append((slot, key))
+        if self.assign is not None:
+            self.assign[start:stop] = self._nearest_lists(vectors)
+            self._pending.extend(range(start, stop))
+        self._changed += len(keys)
+
+    def _retire(self, slot):
+        self.live[slot] = False
+        self.keys[slot] = None
+        self._key_changes.append((slot, None))
+        self._changed += 1
+
+    def add(self, key, inv):
+        """Embed an invoice, replacing any previous version with the same key"""
+        vector = self.embedder.embed([invoice_summary(inv)])
+        with self._lock:
+            self._append([key], [inv], vector)
+            self._maybe_train()
+
+    def remove(self, key):
+        with self._lock:
+            slot = self.slots.pop(key, None)
+            if slot is None:
+                return
+            self.docs.pop(key, None)
+            self._retire(slot)
+            self._maybe_train()
+
+    def _nearest_lists(self, vectors, slots=None, centroids=None):
+        """Closest centroid for each row (or for the rows at `slots`)"""
+        centroids = self.centroids if centroids is None else centroids
+        count = len(vectors) if slots is None else len(slots)
+        lists = np.empty(count, dtype=np.int32)
+        for start in range(0, count, ASSIGN_BATCH):
+            if slots is None:
+                block = np.asarray(vectors[start:start + ASSIGN_BATCH])
+            else:
+                block = vectors[slots[start:start + ASSIGN_BATCH]]
+            lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return lists
+
+    def _needs_training(self):
+        live = len(self.slots)
+        if not self.ivf or live < IVF_MIN:
+            return False
+        return self.centroids is None or live > 2 * self.trained_size or self._changed * 4 > live
+
+    def _maybe_train(self):
+        """Start (re)building IVF lists in the background once big enough and grown or churned
+
+        Called with the lock held. Until training finishes, searches use the
+        lists they have, or an exact scan when there are none yet.
+        """
+        if not self.ivf or len(self.slots) < IVF_MIN:
+            self.centroids = self.assign = self.offsets = None
+            self._pending = []
+            return
+        if self._training is None and self._needs_training():
+            self._training = threading.Thread(target=self._train_in_background, name='ivf-train', daemon=True)
+            self._training.start()
+
+    def _train_in_background(self):
+        try:
+            self.train()
+        finally:
+            with self._lock:
+                self._training = None
+
+    def wait_for_training(self, timeout=None):
+        """Block until a background training run (if any) has finished"""
+        training = self._training
+        if training is not None:
+            training.join(timeout)
+
+    def train(self, seed=0):
+        """Spherical k-means over a sample, then regroup the live rows by closest centroid
+
+        The lock is only held to snapshot the rows and to swap in the result;
+        rows added or removed in between are carried over when swapping.
+        """
+        with self._train_lock:
+            with self._lock:
+                if not self._needs_training():
+                    return
+                size = len(self.keys)
+                live_slots = np.flatnonzero(self.live[:size])
+                keys = self.keys[:size]
+                vectors = self.vectors
+                capacity = len(vectors)
+                changed = self._changed
+
+            # Rows below `size` are never rewritten while this runs, so they are read unlocked
+            rng = np.random.default_rng(seed)
+            lists = min(4096, max(16, int(math.sqrt(len(live_slots)))))
+            sample = vectors[np.sort(rng.choice(live_slots, min(len(live_slots), lists * 40), replace=False))]
+            centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+            for _ in range(KMEANS_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.flatnonzero(~sums.any(axis=1))
+                # Empty lists restart from random sample vectors
+                sums[empty] = sample[rng.choice(len(sample), len(empty))]
+                centroids = normalize_rows(sums)
+
+            assign = self._nearest_lists(vectors, live_slots, centroids)
+            order = np.argsort(assign, kind='stable')
+            counts = np.bincount(assign, minlength=lists)
+            moved = live_slots[order]
+            staged = self._stage_rows(capacity, _Rows(vectors, moved), 'vectors.f32.train')
+            moved_keys = [keys[slot] for slot in moved.tolist()]
+            slots = {key: slot for slot, key in enumerate(moved_keys)}
+
+            with self._lock:
+                self._swap_lists(size, moved, moved_keys, slots, staged, capacity, centroids, counts, changed)
+
+    def _swap_lists(self, size, moved, keys, slots, staged, capacity, centroids, counts, changed):
+        """Install trained lists, retiring rows removed and re-adding rows appended since the snapshot"""
+        if not self.ivf or len(self.slots) < IVF_MIN:
+            if self.directory:
+                os.remove(self._path(staged))
+            return
+        listed = len(moved)
+        still_live = self.live[moved]
+        for slot in np.flatnonzero(~still_live).tolist():
+            slots.pop(keys[slot], None)
+            keys[slot] = None
+        appended = [slot for slot in range(size, len(self.keys)) if self.live[slot]]
+        appended_rows = np.asarray(self.vectors[appended]) if appended else None
+        appended_keys = [self.keys[slot] for slot in appended]
+
+        self.vectors = self._install_rows(staged, capacity)
+        self.keys = keys
+        self.slots = slots
+        self.live = np.zeros(capacity, dtype=bool)
+        self.live[:listed] = still_live
+        self.centroids = centroids
+        self.assign = np.full(capacity, -1, dtype=np.int32)
+        self.assign[:listed] = np.repeat(np.arange(len(centroids), dtype=np.int32), counts)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._pending = []
+        self.trained_size = listed
+        self._changed -= changed
+        self._keys_saved = False
+        if appended:
+            changed = self._changed
+            self._append(appended_keys, [self.docs[key] for key in appended_keys], appended_rows)
+            self._changed = changed
+
+    def _score(self, query, nprobe):
+        """(slots, scores, exhaustive) for live rows: all of them, or the closest `nprobe` lists
+
+        Rows added since training are all scored while there are few of them,
+        so fresh invoices are found before their lists are rebuilt.
+        """
+        size = len(self.keys)
+        if self.centroids is None:
+            slots = np.flatnonzero(self.live[:size])
+            return slots, (np.asarray(self.vectors[:size]) @ query)[slots], True
+        probe = np.sort(np.argsort(-(self.centroids @ query), kind='stable')[:nprobe])
+        slot_parts, score_parts = [], []
+        for lid in probe.tolist():
+            start, stop = int(self.offsets[lid]), int(self.offsets[lid + 1])
+            slot_parts.append(np.arange(start, stop))
+            score_parts.append(np.asarray(self.vectors[start:stop]) @ query)
+        if self._pending:
+            pending = np.array(self._pending, dtype=np.int64)
+            if len(pending) > IVF_MIN:
+                pending = pending[np.isin(self.assign[pending], probe)]
+            slot_parts.append(pending)
+            score_parts.append(self.vectors[pending] @ query)
+        slots = np.concatenate(slot_parts)
+        scores = np.concatenate(score_parts)
+        keep = self.live[slots]
+        return slots[keep], scores[keep], nprobe >= len(self.centroids)
+
+    def search(self, query, limit=10, predicate=None, nprobe=None):
+        """Top `limit` invoices for a free-text query as (cosine score, invoice) pairs
+
+        With a predicate, more lists are probed until enough invoices pass it.
+        """
+        vector = self.embedder.embed([query])[0]
+        if not vector.any():
+            return []
+        with self._lock:
+            self._maybe_train()
+            nprobe = nprobe or NPROBE
+            while True:
+                slots, scores, exhaustive = self._score(vector, nprobe)
+                # Slots are ascending, so ties keep row order
+                ranked = np.argsort(-scores, kind='stable')
+                results = []
+                for rank in ranked.tolist():
+                    inv = self.docs[self.keys[slots[rank]]]
+                    if predicate is None or predicate(inv):
+                        results.append((round(float(scores[rank]), 4), inv))
+                        if len(results) == limit:
+                            break
+                if len(results) == limit or exhaustive:
+                    return results
+                nprobe *= 4
+
+    def save(self, version):
+        """Persist rows, keys and lists for `version` (no-op without a directory)"""
+        if not self.directory:
+            return
+        with self._lock:
+            meta_path = self._path('meta.json')
+            if os.path.exists(meta_path):
+                # Invalid while the other files are rewritten
+                os.remove(meta_path)
+            if isinstance(self.vectors, np.memmap):
+                self.vectors.flush()
+            self._save_keys()
+            if self.centroids is not None:
+                np.save(self._path('centroids.npy'), self.centroids)
+                np.save(self._path('assign.npy'), self.assign[:len(self.keys)])
+                np.save(self._path('offsets.npy'), self.offsets)
+            else:
+                for name in ('centroids.npy', 'assign.npy', 'offsets.npy'):
+                    if os.path.exists(self._path(name)):
+                        os.remove(self._path(name))
+            meta = {
+                'version': version,
+                'embedder': self.embedder.name,
+                'dim': self.dim,
+                'capacity': len(self.vectors),
+                'size': len(self.keys),
+                'trained_size': self.trained_size,
+                'changed': self._changed
+            }
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as handle:
+                json.dump(meta, handle)
+            os.replace(meta_path + '.tmp', meta_path)
+
+    def _save_keys(self):
+        """Append this save's key changes to keys.log, or rewrite keys.json when the slots moved"""
+        if not self._keys_saved or self._logged + len(self._key_changes) > len(self.keys):
+            with open(self._path('keys.json'), 'w', encoding='utf-8') as handle:
+                json.dump(self.keys, handle, separators=(',', ':'))
+            if os.path.exists(self._path('keys.log')):
+                os.remove(self._path('keys.log'))
+            self._logged = 0
+            self._keys_saved = True
+        elif self._key_changes:
+            with open(self._path('keys.log'), 'a', encoding='utf-8') as handle:
+                handle.write(json.dumps(self._key_changes, separators=(',', ':')) + '\n')
+            self._logged += len(self._key_changes)
+        self._key_changes = []
+
+    @classmethod
+    def load(cls, directory, version, invoices, key, embedder=None):
+        """The persisted index if it was saved for `version` with this embedder, else None"""
+        embedder = embedder or get_embedder()
+        try:
+            with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as handle:
+                meta = json.load(handle)
+            if meta['version'] != version or meta['embedder'] != embedder.name or meta['dim'] != embedder.dim:
+                return None
+            with open(os.path.join(directory, 'keys.json'), encoding='utf-8') as handle:
+                keys = json.load(handle)
+            logged = 0
+            if os.path.exists(os.path.join(directory, 'keys.log')):
+                with open(os.path.join(directory, 'keys.log'), encoding='utf-8') as handle:
+                    for line in handle:
+                        for slot, slot_key in json.loads(line):
+                            if slot == len(keys):
+                                keys.append(slot_key)
+                            else:
+                                keys[slot] = slot_key
+                            logged += 1
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return None
+
+        docs = {key(inv): inv for inv in invoices}
+        live = [slot for slot, k in enumerate(keys) if k is not None]
+        if len(keys) != meta['size'] or len(live) != len(docs) or any(keys[slot] not in docs for slot in live):
+            return None
+
+        index = cls(embedder, directory)
+        index.vectors = np.memmap(index._path('vectors.f32'), dtype=np.float32, mode='r+',
+                                  shape=(meta['capacity'], index.dim))
+        index.keys = keys
+        index.slots = {keys[slot]: slot for slot in live}
+        index.docs = docs
+        index.live = np.zeros(meta['capacity'], dtype=bool)
+        index.live[live] = True
+        if os.path.exists(index._path('centroids.npy')):
+            index.centroids = np.load(index._path('centroids.npy'))
+            index.offsets = np.load(index._path('offsets.npy'))
+            index.assign = np.full(meta['capacity'], -1, dtype=np.int32)
+            index.assign[:len(keys)] = np.load(index._path('assign.npy'))
+            index.trained_size = meta['trained_size']
+            index._pending = list(range(int(index.offsets[-1]), len(keys)))
+        index._changed = meta['changed']
+        index._logged = logged
+        index._keys_saved = True
+        return index
+
+
+class _Rows:
+    """Rows of an array in a given slot order, read a batch at a time"""
+
+    def __init__(self, vectors, slots):
+        self.vectors = vectors
+        self.slots = slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, part):
+        return self.vectors[self.slots[part]]
+
+
+def open_index(invoices, key=None, directory=None, version=None):
+    """A tenant's vector index: reused from disk when current, else built (None without NumPy)"""
+    if np is None:
+        return None
+    if directory and version is not None:
+        index = VectorIndex.load(directory, version, invoices, key)
+        if index is not None:
+            return index
+    index = VectorIndex.from_invoices(invoices, key=key, directory=directory)
+    if directory and version is not None:
+        index.save(version)
+    return index
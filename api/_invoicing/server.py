@@ -0,0 +1,396 @@
+"""
+Long-Lived API Server
+Serves crew-analyze, dspy-optimize and rag-query from one process for the
+self-hosted deployment: HTTP/1.1 keep-alive, a thread pool for the CPU work,
+and one Service object per endpoint (with its caches and resident stores)
+shared across requests. GET /metrics serves the request metrics in the
+Prometheus text format.
+
+    cd api && python -m _invoicing.server --port 8000
+
+`app` is a plain ASGI application, so `uvicorn _invoicing.server:app` works
+as well when uvicorn is installed.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from email.message import Message
+from http import HTTPStatus
+
+from .cache import get_cache
+from .endpoint import CORS_HEADERS, PROMETHEUS_TYPE, HTTPError, NDJSONStream, describe, metrics_text, serve_post
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = {
+    '/api/crew-analyze': 'crew-analyze.py',
+    '/api/dspy-optimize': 'dspy-optimize.py',
+    '/api/rag-query': 'rag-query.py'
+}
+
+KEEPALIVE_TIMEOUT = 15
+READ_CHUNK = 64 * 1024
+STREAM_QUEUE_SIZE = 64
+# Seconds a producer waits for queue space before re-checking that the client is still there
+STREAM_PUT_TIMEOUT = 1.0
+MAX_BODY_BYTES = int(os.environ.get('API_MAX_BODY_BYTES', 256 * 1024 * 1024))
+
+
+def load_services():
+    """Import each endpoint file (names contain dashes) and take its Service"""
+    services = {}
+    for route, filename in ENDPOINTS.items():
+        name = '_endpoint_' + filename[:-3].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(name, os.path.join(API_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        services[route] = module.handler.service
+    return services
+
+
+def too_large():
+    return HTTPError(413, {'error': 'Request body too large', 'max_bytes': MAX_BODY_BYTES})
+
+
+class BodyReader:
+    """Blocking file-like view of an ASGI request body, for use from worker threads
+
+    Raises 413 once more than MAX_BODY_BYTES arrive (bodies without a Content-Length)
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._done = False
+        self._received = 0
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._done = True
+            return
+        chunk = message.get('body', b'')
+        self._received += len(chunk)
+        if self._received > MAX_BODY_BYTES:
+            self._done = True
+            raise too_large()
+        self._buffer += chunk
+        if not message.get('more_body', False):
+            self._done = True
+
+    def _take(self, size):
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+    def read(self, size=-1):
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        return self._take(len(self._buffer) if size < 0 else size)
+
+    def readline(self, limit=-1):
+        while (not self._done and b'\n' not in self._buffer
+               and (limit < 0 or len(self._buffer) < limit)):
+            self._fill()
+        newline = self._buffer.find(b'\n')
+        end = newline + 1 if newline >= 0 else len(self._buffer)
+        if limit >= 0:
+            end = min(end, limit)
+        return self._take(end)
+
+
+def _headers(scope):
+    """Case-insensitive header mapping like BaseHTTPRequestHandler.headers"""
+    headers = Message()
+    for name, value in scope.get('headers', []):
+        headers[name.decode('latin-1')] = value.decode('latin-1')
+    return headers
+
+
+class APIApp:
+    """ASGI application routing the Python endpoints to shared Service objects"""
+
+    def __init__(self, services=None, workers=None):
+        self.services = services if services is not None else load_services()
+        workers = workers or int(os.environ.get('API_WORKERS', 0)) or min(32, (os.cpu_count() or 1) + 4)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path'].rstrip('/') or '/'
+        method = scope['method']
+
+        if method == 'OPTIONS':
+            await self._send(send, 200, b'', headers=CORS_HEADERS)
+            return
+        if path == '/health':
+            await self._send_json(send, 200, {
+                'status': 'ok',
+                'endpoints': sorted(self.services),
+                'cache': get_cache().stats()
+            })
+            return
+        if path == '/metrics':
+            await self._send(send, 200, metrics_text().encode(), content_type=PROMETHEUS_TYPE)
+            return
+
+        service = self.services.get(path)
+        if service is None:
+            await self._send_json(send, 404, {'error': 'Not found'})
+            return
+        if method == 'GET':
+            status, body, content_type = describe(service, scope.get('query_string', b'').decode('latin-1'))
+            await self._send(send, status, body, content_type=content_type)
+            return
+        if method != 'POST':
+            await self._send_json(send, 405, {'error': 'Method not allowed'})
+            return
+
+        loop = asyncio.get_running_loop()
+        headers = _headers(scope)
+        try:
+            declared = int(headers.get('Content-Length') or 0)
+        except ValueError:
+            await self._send_json(send, 400, {'error': 'Invalid Content-Length'})
+            return
+        if declared > MAX_BODY_BYTES:
+            error = too_large()
+            await self._send_json(send, error.status, error.payload)
+            return
+        rfile = BodyReader(receive, loop)
+
+        def work():
+            return serve_post(service, headers, rfile)
+
+        try:
+            status, body, extra_headers = await loop.run_in_executor(self.executor, work)
+        except HTTPError as e:
+            await self._send_json(send, e.status, e.payload)
+            return
+        except Exception as e:
+            await self._send_json(send, 500, {'error': str(e)})
+            return
+
+        if isinstance(body, NDJSONStream):
+            await self._stream(send, loop, body, extra_headers)
+        else:
+            await self._send(send, status, body, headers=extra_headers,
+                             content_type='application/json' if status != 304 else None)
+
+    async def _stream(self, send, loop, stream, headers=None):
+        """Produce NDJSON lines on a worker thread and forward them as they are ready"""
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', stream.content_type.encode()),
+                        (b'access-control-allow-origin', b'*'),
+                        (b'access-control-expose-headers',
+                         CORS_HEADERS['Access-Control-Expose-Headers'].encode())]
+                       + [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+        })
+        lines = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        # Set when the consumer stops (client gone, send failed), so the producer gives up
+        cancelled = threading.Event()
+
+        def put(line):
+            """Queue a line for the event loop; False once the response was abandoned"""
+            while not cancelled.is_set():
+                future = asyncio.run_coroutine_threadsafe(lines.put(line), loop)
+                try:
+                    future.result(STREAM_PUT_TIMEOUT)
+                    return True
+                except FutureTimeout:
+                    if not future.cancel():
+                        return True
+            return False
+
+        def produce():
+            produced = stream.lines()
+            try:
+                for line in produced:
+                    if not put(line):
+                        return
+            except Exception as e:
+                put(json.dumps({'error': str(e)}).encode() + b'\n')
+            finally:
+                produced.close()
+                put(None)
+
+        producer = loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                line = await lines.get()
+                if line is None:
+                    break
+                await send({'type': 'http.response.body', 'body': line, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            cancelled.set()
+            await producer
+
+    async def _send_json(self, send, status, payload):
+        await self._send(send, status, json.dumps(payload).encode(), content_type='application/json')
+
+    async def _send(self, send, status, body, content_type=None, headers=None):
+        raw_headers = [(b'content-length', str(len(body)).encode()),
+                       (b'access-control-allow-origin', b'*'),
+                       (b'access-control-expose-headers', CORS_HEADERS['Access-Control-Expose-Headers'].encode())]
+        if content_type:
+            raw_headers.append((b'content-type', content_type.encode()))
+        for name, value in (headers or {}).items():
+            if name.lower() not in ('access-control-allow-origin', 'access-control-expose-headers'):
+                raw_headers.append((name.lower().encode(), value.encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def serve_connection(app, reader, writer):
+    """Minimal HTTP/1.1 front end for an ASGI app (Content-Length bodies, keep-alive)"""
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            header_map = dict(headers)
+
+            connection = header_map.get(b'connection', b'').lower()
+            keep_alive = connection != b'close' if version == 'HTTP/1.1' else connection == b'keep-alive'
+            remaining = int(header_map.get(b'content-length', b'0') or 0)
+            if remaining > MAX_BODY_BYTES:
+                # Answered with 413 without reading the body, so the connection cannot be reused
+                keep_alive = False
+            elif header_map.get(b'expect', b'').lower() == b'100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+            async def receive():
+                nonlocal remaining
+                if remaining <= 0:
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                chunk = await reader.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    remaining = 0
+                    return {'type': 'http.disconnect'}
+                remaining -= len(chunk)
+                return {'type': 'http.request', 'body': chunk, 'more_body': remaining > 0}
+
+            response = {'chunked': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                    out_headers = list(message.get('headers', []))
+                    if not any(name == b'content-length' for name, _ in out_headers):
+                        response['chunked'] = True
+                        out_headers.append((b'transfer-encoding', b'chunked'))
+                    out_headers.append((b'connection', b'keep-alive' if keep_alive else b'close'))
+                    head = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}'.encode()]
+                    head += [name + b': ' + value for name, value in out_headers]
+                    writer.write(b'\r\n'.join(head) + b'\r\n\r\n')
+                elif message['type'] == 'http.response.body':
+                    body = message.get('body', b'')
+                    if response['chunked']:
+                        if body:
+                            writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+                        if not message.get('more_body', False):
+                            writer.write(b'0\r\n\r\n')
+                    else:
+                        writer.write(body)
+                    await writer.drain()
+
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': version.split('/')[-1],
+                'method': method.upper(),
+                'path': path,
+                'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'),
+                'headers': headers,
+                'server': writer.get_extra_info('sockname'),
+                'client': writer.get_extra_info('peername')
+            }
+            await app(scope, receive, send)
+
+            # Discard any body the endpoint did not read so the next request parses cleanly
+            while keep_alive and remaining > 0:
+                chunk = await reader.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, app):
+    server = await asyncio.start_server(lambda r, w: serve_connection(app, r, w), host, port)
+    print(f'Python API listening on http://{host}:{port} ({", ".join(sorted(app.services))})')
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CogniCore Python API server')
+    parser.add_argument('--host', default=os.environ.get('API_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('API_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=None, help='CPU worker threads')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, APIApp(workers=args.workers)))
+    except KeyboardInterrupt:
+        pass
+
+
+_app = None
+
+
+def __getattr__(name):
+    """Build `app` on first access, so importing this module stays cheap"""
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = APIApp()
+        return _app
+    raise AttributeError(name)
+
+
+if __name__ == '__main__':
+    main()
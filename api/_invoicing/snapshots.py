@@ -0,0 +1,163 @@
+"""
+Incremental Insight Snapshots
+Running totals (count, revenue, paid count, revenue per customer) kept
+server-side so clients can send only added/updated/deleted invoices since
+their last snapshot id; each delta is applied in O(delta log n)
+"""
+
+import heapq
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from itertools import count
+
+from .concentration import ConcentrationTracker
+from .store import invoice_key
+
+SNAPSHOT_LIMIT = int(os.environ.get('INSIGHT_SNAPSHOT_LIMIT', 64))
+
+
+def invoice_total(inv):
+    """Total counted as revenue: numbers only (null, strings and booleans count as 0)"""
+    total = inv.get('total', 0)
+    return total if isinstance(total, (int, float)) and not isinstance(total, bool) else 0
+
+
+class InsightSnapshot:
+    """Aggregate state for one client's ledger"""
+
+    def __init__(self):
+        self.rows = {}
+        self.invoice_count = 0
+        self.total_revenue = 0
+        self.paid_count = 0
+        self.customer_revenue = {}
+        # A customer stays (even at zero revenue) while any of their invoices does
+        self.customer_invoices = {}
+        # Max-heap of (-revenue, first-seen order, customer). Stale entries are skipped
+        # lazily and the heap is rebuilt once they outnumber the live ones; the order
+        # breaks ties like max() over the revenue dict (and never compares names)
+        self._top = []
+        self._seen = {}
+        self._sequence = count()
+        self._anonymous = 0
+
+    def _credit(self, customer, amount, invoices):
+        remaining = self.customer_invoices.get(customer, 0) + invoices
+        revenue = self.customer_revenue.get(customer, 0) + amount
+        if not remaining:
+            self.customer_invoices.pop(customer, None)
+            self.customer_revenue.pop(customer, None)
+            self._seen.pop(customer, None)
+        else:
+            if customer not in self.customer_revenue:
+                self._seen[customer] = next(self._sequence)
+            self.customer_invoices[customer] = remaining
+            self.customer_revenue[customer] = revenue
+            heapq.heappush(self._top, (-revenue, self._seen[customer], customer))
+        if len(self._top) > 2 * len(self.customer_revenue) + 16:
+            self._top = [(-revenue, self._seen[customer], customer)
+                         for customer, revenue in self.customer_revenue.items()]
+            heapq.heapify(self._top)
+
+    def _remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        customer, amount, paid = row
+        self.invoice_count -= 1
+        self.total_revenue -= amount
+        self.paid_count -= paid
+        self._credit(customer, -amount, -1)
+
+    def _add(self, inv):
+        key = invoice_key(inv)
+        if key is None:
+            # Invoices without an id can be counted but never updated
+            key = f'#anonymous-{self._anonymous}'
+            self._anonymous += 1
+        self._remove(key)
+
+        customer = inv.get('customer', 'Unknown')
+        amount = invoice_total(inv)
+        paid = 1 if inv.get('status') == 'paid' else 0
+        self.rows[key] = (customer, amount, paid)
+        self.invoice_count += 1
+        self.total_revenue += amount
+        self.paid_count += paid
+        self._credit(customer, amount, 1)
+
+    def apply(self, added=(), updated=(), deleted=()):
+        for inv in added:
+            self._add(inv)
+        for inv in updated:
+            self._add(inv)
+        for key in deleted:
+            self._remove(str(key))
+
+    def top_customer(self):
+        """(customer, revenue) with the highest revenue, or None"""
+        while self._top:
+            revenue, order, customer = self._top[0]
+            if self.customer_revenue.get(customer) == -revenue and self._seen.get(customer) == order:
+                return customer, -revenue
+            heapq.heappop(self._top)
+        return None
+
+    def summary(self, top_n=None):
+        """Aggregate figures; with top_n also full concentration metrics (O(customers))"""
+        summary = {
+            'invoice_count': self.invoice_count,
+            'total_revenue': self.total_revenue,
+            'paid_count': self.paid_count,
+            'top_customer': self.top_customer()
+        }
+        if top_n:
+            tracker = ConcentrationTracker(top_n=top_n)
+            for customer, revenue in self.customer_revenue.items():
+                tracker.add(customer, revenue)
+            summary['concentration'] = tracker.result()
+        return summary
+
+
+class SnapshotRegistry:
+    """LRU of live snapshots; every delta moves a snapshot to a fresh id"""
+
+    def __init__(self, limit=SNAPSHOT_LIMIT):
+        self.limit = limit
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, snapshot):
+        snapshot_id = secrets.token_hex(12)
+        self._snapshots[snapshot_id] = snapshot
+        while len(self._snapshots) > self.limit:
+            self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def create(self, invoices, top_n=None):
+        """New snapshot from a full invoice list -> (snapshot id, summary)"""
+        snapshot = InsightSnapshot()
+        snapshot.apply(added=invoices)
+        with self._lock:
+            return self._store(snapshot), snapshot.summary(top_n)
+
+    def advance(self, snapshot_id, added=(), updated=(), deleted=(), top_n=None):
+        """Apply a delta -> (new snapshot id, summary), or (None, None) if the id is unknown"""
+        with self._lock:
+            snapshot = self._snapshots.pop(snapshot_id, None)
+            if snapshot is None:
+                return None, None
+            snapshot.apply(added, updated, deleted)
+            return self._store(snapshot), snapshot.summary(top_n)
+
+
+_default_registry = None
+
+
+def get_snapshots():
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = SnapshotRegistry()
+    return _default_registry
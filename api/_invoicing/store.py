@@ -0,0 +1,443 @@
+"""
+Tenant Invoice Store
+Keeps each tenant's invoices and customers resident on the server (one SQLite
+file per tenant) so queries only need to carry the question and a tenant id
+
+export() also writes a columnar snapshot (see ledgerfile.py) that a fresh
+process maps instead of parsing the whole ledger
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .aging import ReceivablesLedger
+from .cooccurrence import CooccurrenceIndex
+from .cube import AggregateCube
+from .indexes import InvoiceIndex
+from .ledgerfile import LedgerSnapshot, SnapshotIndex, SnapshotInvoices, document_rows, write_snapshot
+from .matcher import CustomerMatcher
+from .profiles import ProfileBook
+from .records import InvoiceRecord, decode_invoices
+from .search import SearchIndex
+from .semantic import open_index
+
+DEFAULT_STORE_DIR = os.environ.get('INVOICE_STORE_DIR', '/tmp/cognicore-invoice-store')
+# 'compact' keeps resident invoices as __slots__ records (see records.py), 'dict' as decoded JSON
+RESIDENT_RECORDS = os.environ.get('INVOICE_RECORDS', 'compact')
+
+TENANT_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id TEXT PRIMARY KEY,
+    customer TEXT,
+    date TEXT,
+    status TEXT,
+    total REAL,
+    amount_paid REAL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_customer ON invoices (customer);
+CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (date);
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def invoice_key(inv):
+    """Stable identity for an invoice (id, falling back to invoice number)"""
+    key = inv.get('id') or inv.get('number')
+    return str(key) if key is not None else None
+
+
+def customer_key(customer):
+    """Stable identity for a customer (id, falling back to name)"""
+    key = customer.get('id') or customer.get('name')
+    return str(key) if key is not None else None
+
+
+def resident(invoices):
+    """Invoices in the resident form chosen by INVOICE_RECORDS"""
+    if RESIDENT_RECORDS == 'compact':
+        return decode_invoices(invoices)
+    return list(invoices)
+
+
+def resident_decoder():
+    """Per-document decode matching resident() (None keeps the decoded JSON)"""
+    return InvoiceRecord.decode if RESIDENT_RECORDS == 'compact' else None
+
+
+class ReadWriteLock:
+    """Any number of readers or one writer (readers first, so a reader never waits on itself)"""
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    def acquire_read(self):
+        with self._changed:
+            while self._writing:
+                self._changed.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._changed:
+            self._readers -= 1
+            if not self._readers:
+                self._changed.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._changed:
+            while self._writing or self._readers:
+                self._changed.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._writing = False
+                self._changed.notify_all()
+
+
+class Dataset:
+    """In-memory snapshot of one tenant's data at a given version
+
+    Requests read it under InvoiceStore.reading(); apply() changes the
+    incremental indexes in place, so it waits for those readers first and
+    retires this object for good.
+    """
+
+    def __init__(self, tenant, version, invoices, customers, search=None, profiles=None,
+                 cooccurrence=None, vectors=None, vector_dir=None, cube=None, receivables=None,
+                 snapshot=None):
+        self.tenant = tenant
+        self.version = version
+        self.invoices = invoices
+        self.customers = customers
+        self._index = None
+        self._matcher = None
+        self._search = search
+        self._profiles = profiles
+        self._cooccurrence = cooccurrence
+        self._vectors = vectors
+        self._cube = cube
+        self._receivables = receivables
+        # Where the semantic index keeps its memory-mapped vectors (None keeps them in memory)
+        self.vector_dir = vector_dir
+        # Mapped columnar snapshot this version was opened from (invoices decode lazily from it)
+        self.snapshot = snapshot
+        self.lock = ReadWriteLock()
+        # Set once apply() has moved the incremental indexes to the next version
+        self.retired = False
+
+    @property
+    def search(self):
+        """Full-text index, carried forward incrementally across versions"""
+        if self._search is None:
+            self._search = SearchIndex.from_invoices(self.invoices, key=invoice_key)
+        return self._search
+
+    @property
+    def profiles(self):
+        """Customer reliability profiles, carried forward incrementally across versions"""
+        if self._profiles is None:
+            self._profiles = ProfileBook.from_invoices(self.invoices, key=invoice_key)
+        return self._profiles
+
+    @property
+    def cooccurrence(self):
+        """SKU co-occurrence counts, carried forward incrementally across versions"""
+        if self._cooccurrence is None:
+            self._cooccurrence = CooccurrenceIndex.from_invoices(self.invoices, key=invoice_key)
+        return self._cooccurrence
+
+    @property
+    def cube(self):
+        """(customer, day..year) aggregate sums, carried forward incrementally across versions"""
+        if self._cube is None:
+            self._cube = AggregateCube.from_invoices(self.invoices, key=invoice_key)
+        return self._cube
+
+    @property
+    def aggregates(self):
+        """Answers cube-style aggregate questions: the cube once built, else the snapshot columns"""
+        if self._cube is None and self.snapshot is not None:
+            return self.snapshot
+        return self.cube
+
+    @property
+    def receivables(self):
+        """Open invoices sorted by due date for aging, carried forward incrementally across versions"""
+        if self._receivables is None:
+            self._receivables = ReceivablesLedger.from_invoices(self.invoices, key=invoice_key)
+        return self._receivables
+
+    @property
+    def vectors(self):
+        """Semantic vector index (None without NumPy), reused from disk when it matches this version"""
+        if self._vectors is None:
+            self._vectors = open_index(self.invoices, key=invoice_key, directory=self.vector_dir,
+                                       version=self.version)
+        return self._vectors
+
+    @property
+    def index(self):
+        """Customer/date index, built on first use and reused until the version changes"""
+        if self._index is None:
+            if self.snapshot is not None:
+                # Stored runs; the full-text index is only built if a search needs it
+                self._index = SnapshotIndex(self.snapshot, self.invoices, search=lambda: self.search)
+            else:
+                self._index = InvoiceIndex(self.invoices, search=self.search)
+        return self._index
+
+    @property
+    def matcher(self):
+        """Customer-name automaton for this version's customer list"""
+        if self._matcher is None:
+            self._matcher = CustomerMatcher(customer.get('name') for customer in self.customers)
+        return self._matcher
+
+    def apply(self, version, invoices=(), customers=(), deleted=()):
+        """Next version of this dataset with a delta applied (incremental indexes updated in place)"""
+        # Readers of this version finish first; later ones move on to the successor
+        with self.lock.writing():
+            self.retired = True
+            by_key = {invoice_key(inv): inv for inv in self.invoices}
+            incremental = [part for part in (self._search, self._profiles, self._cooccurrence,
+                                           self._vectors, self._cube, self._receivables)
+                           if part is not None]
+            for inv in resident(invoices):
+                key = invoice_key(inv)
+                if key is None:
+                    continue
+                by_key[key] = inv
+                for part in incremental:
+                    part.add(key, inv)
+            for key in deleted:
+                by_key.pop(str(key), None)
+                for part in incremental:
+                    part.remove(str(key))
+
+            by_customer = {customer_key(c): c for c in self.customers}
+            for customer in customers:
+                key = customer_key(customer)
+                if key is not None:
+                    by_customer[key] = customer
+
+            # This object is retired, so its incremental structures can move to the successor
+            search, self._search = self._search, None
+            profiles, self._profiles = self._profiles, None
+            cooccurrence, self._cooccurrence = self._cooccurrence, None
+            vectors, self._vectors = self._vectors, None
+            cube, self._cube = self._cube, None
+            receivables, self._receivables = self._receivables, None
+            if vectors is not None:
+                vectors.save(version)
+            return Dataset(self.tenant, version, list(by_key.values()), list(by_customer.values()),
+                           search=search, profiles=profiles, cooccurrence=cooccurrence,
+                           vectors=vectors, vector_dir=self.vector_dir, cube=cube,
+                           receivables=receivables)
+
+
+class InvoiceStore:
+    """Per-tenant SQLite store with a resident in-memory cache of the latest version"""
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        self._datasets = {}
+        self._lock = threading.Lock()
+        # Database files this process has already created the tables in
+        self._ready = set()
+
+    def _path(self, tenant):
+        if not TENANT_PATTERN.match(tenant or ''):
+            raise ValueError('Invalid tenant id')
+        return os.path.join(self.root, f'{tenant}.sqlite3')
+
+    def _connect(self, tenant):
+        path = self._path(tenant)
+        os.makedirs(self.root, exist_ok=True)
+        ready = path in self._ready and os.path.exists(path)
+        conn = sqlite3.connect(path)
+        if not ready:
+            conn.executescript(SCHEMA)
+            self._ready.add(path)
+        return conn
+
+    def _snapshot_path(self, tenant):
+        return os.path.join(self.root, f'{tenant}.ledger')
+
+    def _read_version(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def upsert(self, tenant, invoices=(), customers=(), deleted=()):
+        """Insert or replace invoices/customers, drop deleted invoice ids, bump the version"""
+        invoices = list(invoices)
+        with self._lock:
+            conn = self._connect(tenant)
+            try:
+                with conn:
+                    inv_rows = []
+                    for inv in invoices:
+                        key = invoice_key(inv)
+                        if key is None:
+                            continue
+                        inv_rows.append((
+                            key,
+                            inv.get('customer'),
+                            inv.get('date'),
+                            inv.get('status'),
+                            inv.get('total', 0),
+                            inv.get('amountPaid', 0),
+                            json.dumps(inv)
+                        ))
+                    # Upsert (not REPLACE) keeps rowid, so ledger order matches the resident copy
+                    conn.executemany(
+                        'INSERT INTO invoices VALUES (?, ?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT(id) DO UPDATE SET customer = excluded.customer, '
+                        'date = excluded.date, status = excluded.status, total = excluded.total, '
+                        'amount_paid = excluded.amount_paid, doc = excluded.doc', inv_rows)
+
+                    cust_rows = []
+                    for customer in customers:
+                        key = customer_key(customer)
+                        if key is None:
+                            continue
+                        cust_rows.append((key, customer.get('name'), json.dumps(customer)))
+                    conn.executemany(
+                        'INSERT INTO customers VALUES (?, ?, ?) '
+                        'ON CONFLICT(id) DO UPDATE SET name = excluded.name, doc = excluded.doc',
+                        cust_rows)
+
+                    conn.executemany(
+                        'DELETE FROM invoices WHERE id = ?', [(str(key),) for key in deleted])
+
+                    version = self._read_version(conn) + 1
+                    conn.execute(
+                        "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(version),))
+            finally:
+                conn.close()
+
+            # Roll the resident copy forward instead of reloading the whole ledger
+            cached = self._datasets.pop(tenant, None)
+            if cached is not None and cached.version == version - 1:
+                self._datasets[tenant] = cached.apply(version, invoices, customers, deleted)
+            return {
+                'tenant': tenant,
+                'version': version,
+                'invoices_upserted': len(inv_rows),
+                'customers_upserted': len(cust_rows),
+                'invoices_deleted': len(deleted)
+            }
+
+    def version(self, tenant):
+        """Current persisted version for a tenant (0 if nothing ingested)"""
+        if not os.path.exists(self._path(tenant)):
+            return 0
+        conn = self._connect(tenant)
+        try:
+            return self._read_version(conn)
+        finally:
+            conn.close()
+
+    def export(self, tenant):
+        """Write the tenant's columnar snapshot at its current version (from the stored JSON text)"""
+        path = self._snapshot_path(tenant)
+        with self._lock:
+            conn = self._connect(tenant)
+            try:
+                version = self._read_version(conn)
+                customers = [json.loads(row[0]) for row in
+                             conn.execute('SELECT doc FROM customers ORDER BY rowid')]
+                # Not the SQL columns: their affinity turns e.g. a "100.50" total into a number
+                documents = conn.execute('SELECT doc FROM invoices ORDER BY rowid')
+                write_snapshot(path, version, document_rows(row[0] for row in documents), customers)
+            finally:
+                conn.close()
+        return {
+            'tenant': tenant,
+            'version': version,
+            'snapshot_bytes': os.path.getsize(path)
+        }
+
+    @contextmanager
+    def reading(self, tenant):
+        """The tenant's current Dataset, held so an ingest can't change it while in use
+
+        Don't call back into the store inside the block: an ingest waiting for
+        this reader holds the store lock.
+        """
+        while True:
+            dataset = self.load(tenant)
+            dataset.lock.acquire_read()
+            if not dataset.retired:
+                break
+            # An ingest moved on while we waited; read its version instead
+            dataset.lock.release_read()
+        try:
+            yield dataset
+        finally:
+            dataset.lock.release_read()
+
+    def load(self, tenant):
+        """Return the resident Dataset for a tenant, reloading only if the version moved"""
+        version = self.version(tenant)
+        cached = self._datasets.get(tenant)
+        if cached is not None and cached.version == version:
+            return cached
+
+        with self._lock:
+            cached = self._datasets.get(tenant)
+            if cached is not None and cached.version == version:
+                return cached
+
+            snapshot = LedgerSnapshot.open(self._snapshot_path(tenant)) if version else None
+            if snapshot is not None and snapshot.version == version:
+                dataset = Dataset(tenant, version, SnapshotInvoices(snapshot, resident_decoder()),
+                                  snapshot.customers, snapshot=snapshot,
+                                  vector_dir=os.path.join(self.root, f'{tenant}.vectors'))
+                self._datasets[tenant] = dataset
+                return dataset
+
+            invoices, customers = [], []
+            if version:
+                conn = self._connect(tenant)
+                try:
+                    invoices = resident(json.loads(row[0]) for row in
+                                        conn.execute('SELECT doc FROM invoices ORDER BY rowid'))
+                    customers = [json.loads(row[0]) for row in
+                                 conn.execute('SELECT doc FROM customers ORDER BY rowid')]
+                finally:
+                    conn.close()
+
+            dataset = Dataset(tenant, version, invoices, customers,
+                              vector_dir=os.path.join(self.root, f'{tenant}.vectors'))
+            self._datasets[tenant] = dataset
+            return dataset
+
+
+_default_store = None
+
+
+def get_store():
+    """Process-wide store shared by warm invocations"""
+    global _default_store
+    if _default_store is None:
+        _default_store = InvoiceStore()
+    return _default_store
@@ -0,0 +1,172 @@
+"""
+Follow-up Template Engine
+Follow-up copy for the Collection Specialist (crew-analyze) and the
+follow-up optimizer (dspy-optimize) lives here once, keyed by template set,
+tone and locale. Templates are compiled on first use, cached for the life of
+the process, rendered singly or in batches, and timed per template.
+"""
+
+import os
+import threading
+import time
+from string import Formatter
+
+DEFAULT_LOCALE = 'en-ZA'
+DEFAULT_BRAND = os.environ.get('FOLLOWUP_BRAND', 'Aweh Be Lekker')
+
+# {template_set: {locale: {tone: (text, defaults)}}}
+FOLLOWUP_TEMPLATES = {
+    'collector': {
+        'en-ZA': {
+            'friendly': ("""Hi {customer_name}! 👋
+
+Hope you're doing well! Just a friendly reminder that invoice {invoice_number} (R{amount:.2f}) was due on {due_date}.
+
+We know things get busy - would you be able to settle this soon? Let us know if you need any help!
+
+Thanks so much,
+{brand} Team""", {'customer_name': 'there', 'due_date': 'Unknown'}),
+            'professional': ("""Dear {customer_name},
+
+This is a reminder that invoice {invoice_number} for R{amount:.2f} is overdue (due date: {due_date}).
+
+Please arrange payment at your earliest convenience. If you have any questions or need to discuss payment terms, please don't hesitate to contact us.
+
+Best regards,
+{brand}""", {'customer_name': 'Customer', 'due_date': 'Unknown'})
+        }
+    },
+    'optimizer': {
+        'en-ZA': {
+            'friendly': ("""Hey {customer_name}! 👋
+
+Quick reminder about invoice {invoice_number} for R{amount:,.2f}. 
+
+I know you're probably swamped - just wanted to check if everything's okay with this one?
+
+Let me know if you need anything!
+
+Cheers 🙌""", {'customer_name': 'Customer'}),
+            'professional': ("""Dear {customer_name},
+
+This is a reminder that invoice {invoice_number} for R{amount:,.2f} is now {days_overdue} days overdue.
+
+Please arrange payment at your earliest convenience. If you have any questions or concerns, please don't hesitate to contact us.
+
+We appreciate your prompt attention to this matter.
+
+Best regards""", {'customer_name': 'Customer', 'days_overdue': 0}),
+            'firm': ("""Dear {customer_name},
+
+URGENT: Invoice {invoice_number} for R{amount:,.2f} is now {days_overdue} days overdue.
+
+Immediate payment is required to avoid further action. Please contact us immediately if there are any issues preventing payment.
+
+Payment must be received within 48 hours.
+
+Regards""", {'customer_name': 'Customer', 'days_overdue': 0})
+        }
+    }
+}
+
+
+class CompiledTemplate:
+    """A parsed and validated template with its default values"""
+
+    def __init__(self, key, text, defaults=None):
+        self.key = key
+        self.text = text
+        self.defaults = dict(defaults or {})
+        # Parse once: the field names are known up front and bad syntax fails here
+        self.fields = frozenset(
+            field.split('.')[0].split('[')[0]
+            for _, field, _, _ in Formatter().parse(text) if field
+        )
+        self._format = text.format_map
+
+    def render(self, values):
+        merged = dict(self.defaults)
+        for name in self.fields:
+            value = values.get(name)
+            if value is not None:
+                merged[name] = value
+        missing = self.fields - merged.keys()
+        if missing:
+            raise ValueError(f"Template {self.key} is missing {', '.join(sorted(missing))}")
+        return self._format(merged)
+
+
+class TemplateEngine:
+    """Compiled-template cache with per-template render timing"""
+
+    def __init__(self, templates=FOLLOWUP_TEMPLATES, brand=DEFAULT_BRAND):
+        self.templates = templates
+        self.brand = brand
+        self._compiled = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_set, tone, locale=DEFAULT_LOCALE):
+        """Compiled template, falling back to the default locale"""
+        key = (template_set, tone, locale)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            locales = self.templates[template_set]
+            text, defaults = locales.get(locale, locales[DEFAULT_LOCALE])[tone]
+            compiled = CompiledTemplate('/'.join(key), text, defaults)
+            self._compiled[key] = compiled
+        return compiled
+
+    def render(self, template_set, tone, values, locale=DEFAULT_LOCALE):
+        template = self.get(template_set, tone, locale)
+        start = time.perf_counter()
+        text = template.render(dict(values, brand=values.get('brand') or self.brand))
+        self._record(template.key, time.perf_counter() - start, 1)
+        return text
+
+    def render_batch(self, jobs, locale=DEFAULT_LOCALE):
+        """Render (template_set, tone, values) jobs; returns (texts, timing for this batch)"""
+        texts = []
+        batch = {}
+        for template_set, tone, values in jobs:
+            template = self.get(template_set, tone, locale)
+            start = time.perf_counter()
+            texts.append(template.render(dict(values, brand=values.get('brand') or self.brand)))
+            elapsed = time.perf_counter() - start
+            count, total = batch.get(template.key, (0, 0.0))
+            batch[template.key] = (count + 1, total + elapsed)
+        for key, (count, total) in batch.items():
+            self._record(key, total, count)
+        return texts, self._format_timing(batch)
+
+    def _record(self, key, seconds, count):
+        with self._lock:
+            renders, total = self._stats.get(key, (0, 0.0))
+            self._stats[key] = (renders + count, total + seconds)
+
+    def timing(self):
+        """Cumulative render counts and time per template since the process started"""
+        with self._lock:
+            return self._format_timing(dict(self._stats))
+
+    @staticmethod
+    def _format_timing(stats):
+        return [
+            {
+                'template': key,
+                'renders': count,
+                'total_ms': round(total * 1000, 3),
+                'avg_us': round(total / count * 1e6, 2) if count else 0
+            }
+            for key, (count, total) in sorted(stats.items())
+        ]
+
+
+_default_engine = None
+
+
+def get_engine():
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = TemplateEngine()
+    return _default_engine
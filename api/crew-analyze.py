@@ -4,72 +4,162 @@ Provides 3 specialized AI agents:
 1. Invoice Analyst - Analyzes payment patterns
 2. Collection Specialist - Drafts personalized follow-ups
 3. Data Organizer - Cleans and organizes invoice data
+
+The analyst, collector and organizer also take {"mode": "batch", "invoices":
+[...], "customers": [...]} to sweep the whole ledger at once, streamed back as
+NDJSON; the organizer can instead write a report file ({"report": "file"}),
+or group duplicate and near-duplicate invoices ({"mode": "dedupe"}).
+The collector accepts {"tenant": ...} instead of invoices to work from the
+ledger ingested via /api/rag-query; it then needs {"customer": {"name": ...}}
+unless {"mode": "batch"} drafts for the whole ledger.
+
+Analyst insights include receivables aging by due date as of {"as_of":
+"YYYY-MM-DD"} (default today); {"mode": "aging"} returns the full aging
+report, overall and per customer, for inline invoices or a tenant
 """
 
-from http.server import BaseHTTPRequestHandler
-import json
 import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _invoicing.aging import AgingTally, ReceivablesLedger
+from _invoicing.columnar import grouped_payment_metrics, payment_metrics
+from _invoicing.dedupe import find_duplicates
+from _invoicing.endpoint import HTTPError, JSONHandler, NDJSONStream, Service, is_materialized
+from _invoicing.indexes import normalize_name
+from _invoicing.organizer import RuleStats, iter_issues, validate_ledger, write_report
+from _invoicing.store import get_store
+from _invoicing.templates import get_engine
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
+class CrewAnalyzer(Service):
+    name = 'crew-analyze'
+    
+    def cache_key(self, data):
+        """Analyst results are cached by agent, engine, aging date and the full normalized payload"""
+        if data.get('agent', 'analyst') != 'analyst' or data.get('mode') in ('batch', 'aging'):
+            return None
+        if not is_materialized(data, 'invoices'):
+            return None
+        # Aging is relative to as_of (today by default), so answers never outlive the day
+        return ['analyst', data.get('engine', 'python'), data.get('as_of') or date.today().isoformat(),
+                data.get('invoices', []), data.get('customer', {})]
+    
+    def stats(self):
+        """Render counts and timing per follow-up template"""
+        return {'templates': get_engine().timing()}
+    
+    def handle(self, data):
+        """Dispatch to the requested agent"""
+        agent_type = data.get('agent', 'analyst')
+        invoice_data = data.get('invoices', [])
+        customer_data = data.get('customer', {})
+        engine = data.get('engine', 'python')
+        as_of = self.parse_as_of(data.get('as_of'))
+        
+        # Use Together AI (free tier) instead of expensive CrewAI dependencies
+        # This keeps it 100% FREE
+        
+        if agent_type == 'analyst' and data.get('mode') == 'batch':
+            # Whole-ledger risk sweep, one NDJSON line per customer
+            return NDJSONStream(self.analyze_all_customers(invoice_data, data.get('customers', []), as_of))
+        elif agent_type == 'analyst' and data.get('mode') == 'aging':
+            if data.get('tenant') and 'invoices' not in data:
+                # Due-date structure is resident and kept current by rag-query ingests
+                with get_store().reading(data['tenant']) as dataset:
+                    return self.aging_report(dataset.receivables, as_of)
+            return self.aging_report(ReceivablesLedger.from_invoices(invoice_data), as_of)
+        elif agent_type == 'analyst':
+            return self.analyze_payment_patterns(invoice_data, customer_data, engine, as_of)
+        elif agent_type == 'collector' and data.get('tenant') and 'invoices' not in data:
+            # Ledger and customer profiles are resident from a rag-query ingest
+            return self.draft_tenant_followups(data['tenant'], customer_data, data.get('mode'))
+        elif agent_type == 'collector' and data.get('mode') == 'batch':
+            # Collection run over the whole ledger, one NDJSON line per follow-up
+            return NDJSONStream(self.draft_all_followups(invoice_data, data.get('customers', [])))
+        elif agent_type == 'collector':
+            return self.draft_followup(invoice_data, customer_data)
+        elif agent_type == 'organizer' and data.get('mode') == 'dedupe':
+            return self.find_duplicate_invoices(invoice_data)
+        elif agent_type == 'organizer' and data.get('mode') == 'batch':
+            # Full validation report, one NDJSON line per issue
+            return NDJSONStream(self.organize_all_issues(invoice_data, data.get('customers')))
+        elif agent_type == 'organizer':
+            return self.organize_data(invoice_data, data.get('customers'), data.get('report'))
+        else:
+            return {'error': 'Unknown agent type'}
+    
+    def parse_as_of(self, value):
+        """Reference date for aging (today when not given)"""
+        if not value:
+            return date.today()
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(body) if body else {}
-            
-            agent_type = data.get('agent', 'analyst')
-            invoice_data = data.get('invoices', [])
-            customer_data = data.get('customer', {})
-            
-            # Use Together AI (free tier) instead of expensive CrewAI dependencies
-            # This keeps it 100% FREE
-            
-            if agent_type == 'analyst':
-                result = self.analyze_payment_patterns(invoice_data, customer_data)
-            elif agent_type == 'collector':
-                result = self.draft_followup(invoice_data, customer_data)
-            elif agent_type == 'organizer':
-                result = self.organize_data(invoice_data)
-            else:
-                result = {'error': 'Unknown agent type'}
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
-            
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': str(e)}).encode())
-    
-    def analyze_payment_patterns(self, invoices, customer):
+            return date.fromisoformat(str(value)[:10])
+        except ValueError:
+            raise HTTPError(400, {'error': 'as_of must be an ISO date (YYYY-MM-DD)'})
+    
+    def analyze_payment_patterns(self, invoices, customer, engine='python', as_of=None):
         """Invoice Analyst Agent - Analyzes payment behavior"""
-        if not invoices:
+        # One pass (or vectorized with engine='numpy') for every count and sum below;
+        # aging is tallied on the way through, so streamed invoices are read once
+        aging = AgingTally(as_of)
+        metrics = payment_metrics(aging.track(invoices), engine)
+        if not metrics['total_invoices']:
             return {
                 'agent': 'Invoice Analyst',
                 'status': 'no_data',
                 'insights': []
             }
         
-        total_invoices = len(invoices)
-        paid_invoices = [inv for inv in invoices if inv.get('status') == 'paid']
-        overdue_invoices = [inv for inv in invoices if inv.get('status') == 'overdue']
+        return {
+            'agent': 'Invoice Analyst',
+            'customer': customer.get('name', 'Unknown'),
+            'insights': self.build_insights(metrics, aging.report()),
+            'timestamp': 'now'
+        }
+    
+    def analyze_all_customers(self, invoices, customers, as_of=None):
+        """Invoice Analyst Agent (batch) - per-customer insights from one group-by pass"""
+        # Listed customers first (in the order given), then any others seen on invoices
+        names = {}
+        for customer in customers:
+            names.setdefault(normalize_name(customer.get('name')), customer.get('name'))
         
-        total_revenue = sum(inv.get('total', 0) for inv in invoices)
-        total_paid = sum(inv.get('amountPaid', 0) for inv in invoices)
-        outstanding = total_revenue - total_paid
+        def customer_key(inv):
+            key = normalize_name(inv.get('customer'))
+            if key not in names:
+                names[key] = inv.get('customer') or 'Unknown'
+            return key
         
-        # Calculate average payment time
-        payment_times = []
-        for inv in paid_invoices:
-            if inv.get('date') and inv.get('paidDate'):
-                # Simplified - in production would calculate actual days
-                payment_times.append(7)  # Placeholder
+        aging = AgingTally(as_of)
+        by_customer = grouped_payment_metrics(aging.track(invoices), key=customer_key)
         
-        avg_payment_time = sum(payment_times) / len(payment_times) if payment_times else 0
+        for key, name in names.items():
+            metrics = by_customer.get(key)
+            if metrics is None:
+                yield {'agent': 'Invoice Analyst', 'customer': name, 'status': 'no_data', 'insights': []}
+                continue
+            yield {
+                'agent': 'Invoice Analyst',
+                'customer': name,
+                'insights': self.build_insights(metrics, aging.report(key)),
+                'timestamp': 'now'
+            }
+        
+        yield {'agent': 'Invoice Analyst', 'status': 'completed', 'customers': len(names)}
+    
+    def build_insights(self, metrics, aging=None):
+        """Payment behaviour, financial summary, risk alert and aging insights"""
+        total_invoices = metrics['total_invoices']
+        paid_count = metrics['paid_count']
+        overdue_count = metrics['overdue_count']
+        
+        total_revenue = metrics['total_revenue']
+        total_paid = metrics['total_paid']
+        outstanding = total_revenue - total_paid
+        
+        # Average days from invoice date to paidDate
+        avg_payment_time = metrics['avg_payment_days']
         
         insights = [
             {
@@ -77,9 +167,9 @@ class handler(BaseHTTPRequestHandler):
                 'title': 'Payment Pattern Analysis',
                 'data': {
                     'total_invoices': total_invoices,
-                    'paid_count': len(paid_invoices),
-                    'overdue_count': len(overdue_invoices),
-                    'payment_rate': round((len(paid_invoices) / total_invoices * 100), 1) if total_invoices > 0 else 0,
+                    'paid_count': paid_count,
+                    'overdue_count': overdue_count,
+                    'payment_rate': round((paid_count / total_invoices * 100), 1) if total_invoices > 0 else 0,
                     'avg_payment_days': round(avg_payment_time, 1)
                 }
             },
@@ -96,28 +186,53 @@ class handler(BaseHTTPRequestHandler):
         ]
         
         # Risk assessment
-        if len(overdue_invoices) > 0:
-            risk_level = 'high' if len(overdue_invoices) > 2 else 'medium'
+        if overdue_count > 0:
+            risk_level = 'high' if overdue_count > 2 else 'medium'
             insights.append({
                 'type': 'risk_alert',
                 'title': 'Collection Risk',
                 'data': {
                     'risk_level': risk_level,
-                    'overdue_amount': sum(inv.get('total', 0) - inv.get('amountPaid', 0) for inv in overdue_invoices),
+                    'overdue_amount': metrics['overdue_amount'],
                     'recommendation': 'Immediate follow-up required' if risk_level == 'high' else 'Monitor closely'
                 }
             })
         
+        # Receivables by days past due (from due dates, not the overdue flag)
+        if aging and aging['open_invoices']:
+            insights.append({
+                'type': 'receivables_aging',
+                'title': 'Receivables Aging',
+                'data': aging
+            })
+        
+        return insights
+    
+    def aging_report(self, ledger, as_of=None):
+        """Invoice Analyst Agent (aging) - overall aging plus customers ranked by past-due balance"""
+        customers = [
+            dict(customer=name, **ledger.report(as_of, key))
+            for key, name in ledger.customer_names().items()
+        ]
+        # Equal balances by name, so the resident and inline ledgers rank alike
+        customers.sort(key=lambda report: (-report['past_due_balance'], report['customer']))
         return {
             'agent': 'Invoice Analyst',
-            'customer': customer.get('name', 'Unknown'),
-            'insights': insights,
-            'timestamp': 'now'
+            'aging': ledger.report(as_of),
+            'customers': customers,
+            'status': 'completed'
         }
     
-    def draft_followup(self, invoices, customer):
+    def draft_followup(self, invoices, customer, profile=None):
         """Collection Specialist Agent - Drafts personalized follow-ups"""
-        overdue = [inv for inv in invoices if inv.get('status') == 'overdue']
+        overdue = []
+        invoice_count = 0
+        for inv in invoices:
+            invoice_count += 1
+            if inv.get('status') == 'overdue':
+                overdue.append(inv)
+        if profile is not None:
+            invoice_count = profile['invoices']
         
         if not overdue:
             return {
@@ -126,42 +241,12 @@ class handler(BaseHTTPRequestHandler):
                 'followups': []
             }
         
-        followups = []
-        for inv in overdue:
-            invoice_num = inv.get('number', 'Unknown')
-            amount = inv.get('total', 0) - inv.get('amountPaid', 0)
-            due_date = inv.get('dueDate', 'Unknown')
-            
-            # Generate personalized message based on customer history
-            is_frequent = len(invoices) > 5
-            tone = 'friendly' if is_frequent else 'professional'
-            
-            if tone == 'friendly':
-                message = f"""Hi {customer.get('name', 'there')}! 👋
-
-Hope you're doing well! Just a friendly reminder that invoice {invoice_num} (R{amount:.2f}) was due on {due_date}.
-
-We know things get busy - would you be able to settle this soon? Let us know if you need any help!
-
-Thanks so much,
-Aweh Be Lekker Team"""
-            else:
-                message = f"""Dear {customer.get('name', 'Customer')},
-
-This is a reminder that invoice {invoice_num} for R{amount:.2f} is overdue (due date: {due_date}).
-
-Please arrange payment at your earliest convenience. If you have any questions or need to discuss payment terms, please don't hesitate to contact us.
-
-Best regards,
-Aweh Be Lekker"""
-            
-            followups.append({
-                'invoice': invoice_num,
-                'amount': amount,
-                'tone': tone,
-                'message': message,
-                'channels': ['email', 'whatsapp']
-            })
+        # Generate personalized message based on customer history
+        is_frequent = invoice_count > 5
+        tone = 'friendly' if is_frequent else 'professional'
+        followups, _ = self.render_followups(
+            (inv, customer.get('name'), tone) for inv in overdue
+        )
         
         return {
             'agent': 'Collection Specialist',
@@ -170,49 +255,131 @@ Aweh Be Lekker"""
             'count': len(followups)
         }
     
-    def organize_data(self, invoices):
-        """Data Organizer Agent - Cleans and structures data"""
-        issues_found = []
-        fixed_count = 0
-        
+    def draft_all_followups(self, invoices, customers):
+        """Collection Specialist Agent (batch) - every overdue follow-up in the ledger"""
+        counts, overdue = self.collect_overdue(invoices)
+        yield from self.stream_followups(counts, overdue, customers)
+    
+    def collect_overdue(self, invoices, profiles=None):
+        """(invoice count per customer key, [(customer key, overdue invoice)])"""
+        # Tone depends on each customer's invoice count: read it from the profiles
+        # when they are resident, otherwise count while collecting overdue invoices
+        counts = {}
+        overdue = []
         for inv in invoices:
-            # Check for missing data
-            if not inv.get('number'):
-                issues_found.append({
-                    'type': 'missing_invoice_number',
-                    'invoice_id': inv.get('id'),
-                    'fix': 'Generated invoice number'
-                })
-                fixed_count += 1
-            
-            if not inv.get('date'):
-                issues_found.append({
-                    'type': 'missing_date',
-                    'invoice_id': inv.get('id'),
-                    'fix': 'Set to today'
-                })
-                fixed_count += 1
-            
-            # Check for data inconsistencies
-            if inv.get('total', 0) < inv.get('amountPaid', 0):
-                issues_found.append({
-                    'type': 'payment_exceeds_total',
-                    'invoice': inv.get('number'),
-                    'alert': 'Payment amount exceeds invoice total'
-                })
+            key = normalize_name(inv.get('customer'))
+            if profiles is None:
+                counts[key] = counts.get(key, 0) + 1
+            if inv.get('status') == 'overdue':
+                overdue.append((key, inv))
+        if profiles is not None:
+            counts = {key: profile.invoices for key, profile in profiles.profiles.items()}
+        return counts, overdue
+    
+    def stream_followups(self, counts, overdue, customers):
+        """Render collected overdue invoices, one follow-up at a time, then a summary"""
+        names = {normalize_name(c.get('name')): c.get('name') for c in customers}
+        jobs = []
+        for key, inv in overdue:
+            tone = 'friendly' if counts[key] > 5 else 'professional'
+            jobs.append((inv, names.get(key) or inv.get('customer'), tone))
+        
+        followups, timing = self.render_followups(jobs)
+        for (_, name, _), followup in zip(jobs, followups):
+            followup['customer'] = name or 'Unknown'
+            yield followup
+        
+        yield {
+            'agent': 'Collection Specialist',
+            'status': 'completed',
+            'count': len(followups),
+            'timing': timing
+        }
+    
+    def draft_tenant_followups(self, tenant, customer, mode=None):
+        """Collection Specialist Agent against a tenant's resident ledger"""
+        name = customer.get('name') if isinstance(customer, dict) else None
+        if mode != 'batch' and not (isinstance(name, str) and name.strip()):
+            # Without a name the index would hand back the whole ledger as one customer's
+            raise HTTPError(400, {'error': 'customer.name is required (or use mode "batch")'})
+        with get_store().reading(tenant) as dataset:
+            if mode != 'batch':
+                return self.draft_followup(dataset.index.select(name), customer,
+                                           profile=dataset.profiles.get(name))
+            # The stream is rendered after the ledger is released, so collect under it
+            counts, overdue = self.collect_overdue(dataset.invoices, dataset.profiles)
+            customers = list(dataset.customers)
+        return NDJSONStream(self.stream_followups(counts, overdue, customers))
+    
+    def render_followups(self, jobs):
+        """Render (invoice, customer name, tone) jobs as one template batch"""
+        rows = []
+        render_jobs = []
+        for inv, name, tone in jobs:
+            invoice_num = inv.get('number', 'Unknown')
+            amount = inv.get('total', 0) - inv.get('amountPaid', 0)
+            rows.append((invoice_num, amount, tone))
+            render_jobs.append(('collector', tone, {
+                'customer_name': name,
+                'invoice_number': invoice_num,
+                'amount': amount,
+                'due_date': inv.get('dueDate')
+            }))
         
+        messages, timing = get_engine().render_batch(render_jobs)
+        followups = [
+            {
+                'invoice': invoice_num,
+                'amount': amount,
+                'tone': tone,
+                'message': message,
+                'channels': ['email', 'whatsapp']
+            }
+            for (invoice_num, amount, tone), message in zip(rows, messages)
+        ]
+        return followups, timing
+    
+    def organize_data(self, invoices, customers=None, report=None):
+        """Data Organizer Agent - Cleans and structures data"""
+        if report == 'file':
+            # Full audit: every issue goes to a compact report file instead of the response
+            path, stats = write_report(invoices, customers)
+            return self.organizer_summary(stats, report=path)
+        
+        # Large ledgers are split across worker processes (see _invoicing.parallel)
+        stats, details = validate_ledger(invoices, customers)
+        return self.organizer_summary(stats, details=details)
+    
+    def organize_all_issues(self, invoices, customers=None):
+        """Data Organizer Agent (batch) - every issue in the ledger, then the per-rule summary"""
+        stats = RuleStats()
+        for issue in iter_issues(invoices, customers, stats):
+            yield issue
+        yield self.organizer_summary(stats)
+    
+    def find_duplicate_invoices(self, invoices):
+        """Data Organizer Agent (dedupe) - exact and near-duplicate invoice groups"""
+        result = find_duplicates(invoices)
         return {
             'agent': 'Data Organizer',
-            'issues_found': len(issues_found),
-            'issues_fixed': fixed_count,
-            'details': issues_found[:10],  # Return first 10
+            'exact_duplicates': result['exact'],
+            'near_duplicates': result['near'],
+            'stats': result['stats'],
             'status': 'completed'
         }
     
-    def do_OPTIONS(self):
-        """Handle CORS preflight"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    def organizer_summary(self, stats, **extra):
+        """Issue totals and per-rule counts and timing"""
+        summary = {
+            'agent': 'Data Organizer',
+            'issues_found': stats.issues,
+            'issues_fixed': stats.fixed
+        }
+        summary.update(extra)
+        summary['rules'] = stats.summary()
+        summary['status'] = 'completed'
+        return summary
+
+
+class handler(JSONHandler):
+    service = CrewAnalyzer()
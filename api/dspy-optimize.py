@@ -2,41 +2,67 @@
 DSPy Prompt Optimization Module
 Self-optimizing AI prompts that learn from successful interactions
 Replaces manual prompt engineering
+
+Follow-ups for a tenant ingested via /api/rag-query can send
+{"context": {"tenant": ..., "customer": ..., "invoice": ...}} and skip the
+history list; the customer's resident reliability profile is used instead.
+Recommendations likewise score "bought together" candidates from the tenant's
+(or a sent "history" list's) SKU co-occurrence counts
 """
 
-from http.server import BaseHTTPRequestHandler
-import json
+import os
+import sys
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(body) if body else {}
-            
-            task = data.get('task', 'recommend')
-            context = data.get('context', {})
-            
-            if task == 'recommend':
-                result = self.optimize_recommendation(context)
-            elif task == 'followup':
-                result = self.optimize_followup(context)
-            elif task == 'insights':
-                result = self.optimize_insights(context)
-            else:
-                result = {'error': 'Unknown task'}
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
-            
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': str(e)}).encode())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _invoicing.concentration import ConcentrationTracker, parse_top_n
+from _invoicing.cooccurrence import CooccurrenceIndex
+from _invoicing.endpoint import HTTPError, JSONHandler, Service, is_materialized
+from _invoicing.profiles import history_profile
+from _invoicing.snapshots import get_snapshots, invoice_total
+from _invoicing.store import get_store
+from _invoicing.templates import get_engine
+
+# Which context list an NDJSON body streams, per task
+STREAMED_CONTEXT_KEY = {
+    'insights': 'invoices',
+    'followup': 'history',
+    'recommend': 'history'
+}
+
+class DSPyOptimizer(Service):
+    name = 'dspy-optimize'
+    
+    def cache_key(self, data):
+        """Insights are cached by the normalized context"""
+        context = data.get('context', {})
+        if data.get('task', 'recommend') != 'insights' or not is_materialized(context, 'invoices'):
+            return None
+        if 'snapshot' in context or context.get('incremental'):
+            return None
+        return ['insights', context]
+    
+    def stats(self):
+        """Render counts and timing per follow-up template"""
+        return {'templates': get_engine().timing()}
+    
+    def attach_items(self, data, items):
+        """NDJSON lines stream into the task's context list"""
+        context = data.setdefault('context', {})
+        context[STREAMED_CONTEXT_KEY.get(data.get('task', 'recommend'), 'invoices')] = items
+    
+    def handle(self, data):
+        """Dispatch to the requested optimization task"""
+        task = data.get('task', 'recommend')
+        context = data.get('context', {})
+        
+        if task == 'recommend':
+            return self.optimize_recommendation(context)
+        elif task == 'followup':
+            return self.optimize_followup(context)
+        elif task == 'insights':
+            return self.optimize_insights(context)
+        else:
+            return {'error': 'Unknown task'}
     
     def optimize_recommendation(self, context):
         """Optimize product recommendations based on patterns"""
@@ -53,23 +79,42 @@ class handler(BaseHTTPRequestHandler):
             }
         
         # Analyze current basket
-        current_skus = [item.get('sku') for item in current_items]
-        current_categories = set()
+        current_skus = {item.get('sku') for item in current_items}
         current_total = sum(item.get('total', 0) for item in current_items)
+        limit = context.get('limit', 3)
         
-        # Simple pattern matching (in production, would use ML)
-        recommendations = []
+        # Co-occurrence from past invoices: the tenant's resident index, or one
+        # built from the history sent with the request
+        recommendations = None
+        min_support = context.get('min_support', 1)
+        if context.get('tenant') and 'history' not in context:
+            with get_store().reading(context['tenant']) as dataset:
+                recommendations = self.cooccurrence_recommendations(
+                    dataset.cooccurrence, current_skus, products, limit, min_support)
+        elif 'history' in context:
+            recommendations = self.cooccurrence_recommendations(
+                CooccurrenceIndex.from_invoices(context['history']), current_skus, products, limit, min_support)
         
-        # Rule 1: Complementary products
-        for product in products[:5]:
-            if product.get('sku') not in current_skus:
-                recommendations.append({
-                    'product': product.get('name'),
-                    'sku': product.get('sku'),
-                    'price': product.get('price'),
-                    'reason': 'Frequently bought together',
-                    'confidence': 0.85
-                })
+        if recommendations is not None:
+            optimization = 'cooccurrence'
+            confidence = (round(sum(rec['confidence'] for rec in recommendations) / len(recommendations), 2)
+                          if recommendations else 0)
+        else:
+            # Simple pattern matching when there is no purchase history
+            recommendations = []
+            optimization = 'pattern_based'
+            confidence = 0.82
+            
+            # Rule 1: Complementary products
+            for product in products[:5]:
+                if product.get('sku') not in current_skus:
+                    recommendations.append({
+                        'product': product.get('name'),
+                        'sku': product.get('sku'),
+                        'price': product.get('price'),
+                        'reason': 'Frequently bought together',
+                        'confidence': 0.85
+                    })
         
         # Rule 2: Upsell higher-tier products
         if current_total < 1000:
@@ -83,22 +128,62 @@ class handler(BaseHTTPRequestHandler):
         
         return {
             'task': 'recommend',
-            'optimization': 'pattern_based',
-            'recommendations': recommendations[:3],
-            'confidence': 0.82
+            'optimization': optimization,
+            'recommendations': recommendations[:limit],
+            'confidence': confidence
         }
     
+    def cooccurrence_recommendations(self, cooccurrence, current_skus, products, limit, min_support):
+        """Top-k products bought with the basket, with their rule's confidence and lift"""
+        top = cooccurrence.recommend(current_skus, limit, min_support)
+        
+        # Prefer the request's catalog (current name/price); stop once every pick is found
+        wanted = {sku for sku, *_ in top}
+        catalog = {}
+        for product in products:
+            if product.get('sku') in wanted:
+                catalog[product['sku']] = product
+                if len(catalog) == len(wanted):
+                    break
+        
+        recommendations = []
+        for sku, confidence, lift, support, antecedent in top:
+            product = catalog.get(sku)
+            if product is not None:
+                name, price = product.get('name'), product.get('price')
+            else:
+                name, price = cooccurrence.products.get(sku, (None, None))
+            because = cooccurrence.products.get(antecedent, (None, None))[0] or antecedent
+            recommendations.append({
+                'product': name,
+                'sku': sku,
+                'price': price,
+                'reason': f'Frequently bought together with {because}',
+                'confidence': round(confidence, 2),
+                'lift': round(lift, 2),
+                'support': support
+            })
+        return recommendations
+    
     def optimize_followup(self, context):
         """Optimize follow-up message tone and timing"""
         customer = context.get('customer', {})
         invoice = context.get('invoice', {})
-        history = context.get('history', [])
+        tenant = context.get('tenant')
         
-        # Analyze customer behavior
-        total_invoices = len(history)
-        paid_on_time = len([inv for inv in history if inv.get('status') == 'paid'])
+        # Analyze customer behavior: a resident tenant profile is an O(1) lookup,
+        # otherwise profile the history sent with the request in one pass
+        if tenant and 'history' not in context:
+            with get_store().reading(tenant) as dataset:
+                profile = dataset.profiles.get(customer.get('name'))
+        else:
+            profile = history_profile(context.get('history', []), customer.get('name'))
+        if profile is None:
+            profile = history_profile([], customer.get('name'))
         
-        payment_reliability = paid_on_time / total_invoices if total_invoices > 0 else 0.5
+        total_invoices = profile['invoices']
+        paid_on_time = profile['paid']
+        payment_reliability = profile['payment_reliability']
         
         # Determine optimal tone
         if payment_reliability > 0.8:
@@ -130,15 +215,78 @@ class handler(BaseHTTPRequestHandler):
             'metadata': {
                 'payment_reliability': round(payment_reliability, 2),
                 'total_invoices': total_invoices,
-                'paid_on_time': paid_on_time
+                'paid_on_time': paid_on_time,
+                'on_time_ratio': profile['on_time_ratio'],
+                'avg_days_late': profile['avg_days_late'],
+                'recent_reliability': profile['recent_reliability']
             }
         }
     
     def optimize_insights(self, context):
         """Optimize insight generation based on data patterns"""
+        if 'snapshot' in context or context.get('incremental'):
+            return self.optimize_insights_incremental(context)
+        
         invoices = context.get('invoices', [])
         
-        if not invoices:
+        # Single pass over the invoices for every figure below
+        invoice_count = 0
+        total_revenue = 0
+        paid_count = 0
+        concentration = ConcentrationTracker(top_n=self.parse_top_n(context))
+        for inv in invoices:
+            invoice_count += 1
+            amount = invoice_total(inv)
+            total_revenue += amount
+            if inv.get('status') == 'paid':
+                paid_count += 1
+            concentration.add(inv.get('customer', 'Unknown'), amount)
+        
+        leaders = concentration.top(1)
+        result = self.build_insights(invoice_count, total_revenue, paid_count, leaders[0] if leaders else None)
+        if invoice_count:
+            result['concentration'] = concentration.result()
+        return result
+    
+    def parse_top_n(self, context):
+        """Requested top_n for concentration metrics (400 unless an integer in range)"""
+        try:
+            return parse_top_n(context.get('top_n'))
+        except ValueError as e:
+            raise HTTPError(400, {'error': str(e)})
+    
+    def optimize_insights_incremental(self, context):
+        """Insights from server-side running totals; the client sends only what changed"""
+        snapshots = get_snapshots()
+        # Concentration metrics cost O(customers), so delta calls only compute them on request
+        top_n = self.parse_top_n(context) if context.get('concentration') else None
+        if 'snapshot' in context:
+            snapshot_id, summary = snapshots.advance(
+                context['snapshot'],
+                added=context.get('added', []),
+                updated=context.get('updated', []),
+                deleted=context.get('deleted', []),
+                top_n=top_n
+            )
+            if snapshot_id is None:
+                # Evicted or from another instance: the client must resend the full ledger
+                raise HTTPError(409, {
+                    'error': 'Unknown or expired snapshot',
+                    'snapshot': context['snapshot']
+                })
+        else:
+            snapshot_id, summary = snapshots.create(context.get('invoices', []), top_n=top_n)
+        
+        result = self.build_insights(summary['invoice_count'], summary['total_revenue'],
+                                     summary['paid_count'], summary['top_customer'])
+        if 'concentration' in summary:
+            result['concentration'] = summary['concentration']
+        result['snapshot'] = snapshot_id
+        return result
+    
+    def build_insights(self, invoice_count, total_revenue, paid_count, top_customer):
+        """Revenue, collection and concentration insights from aggregate figures"""
+        if not invoice_count:
             return {
                 'task': 'insights',
                 'insights': [],
@@ -148,8 +296,7 @@ class handler(BaseHTTPRequestHandler):
         insights = []
         
         # Revenue trend analysis
-        total_revenue = sum(inv.get('total', 0) for inv in invoices)
-        avg_invoice = total_revenue / len(invoices)
+        avg_invoice = total_revenue / invoice_count
         
         if avg_invoice > 1000:
             insights.append({
@@ -162,8 +309,7 @@ class handler(BaseHTTPRequestHandler):
             })
         
         # Collection efficiency
-        paid_invoices = [inv for inv in invoices if inv.get('status') == 'paid']
-        collection_rate = len(paid_invoices) / len(invoices) * 100
+        collection_rate = paid_count / invoice_count * 100
         
         if collection_rate < 70:
             insights.append({
@@ -185,13 +331,7 @@ class handler(BaseHTTPRequestHandler):
             })
         
         # Customer concentration risk
-        customer_counts = {}
-        for inv in invoices:
-            customer = inv.get('customer', 'Unknown')
-            customer_counts[customer] = customer_counts.get(customer, 0) + inv.get('total', 0)
-        
-        if customer_counts:
-            top_customer = max(customer_counts.items(), key=lambda x: x[1])
+        if top_customer and total_revenue > 0:
             concentration = top_customer[1] / total_revenue * 100
             
             if concentration > 40:
@@ -213,43 +353,14 @@ class handler(BaseHTTPRequestHandler):
     
     def generate_followup_template(self, tone, customer_name, invoice_number, amount, days_overdue):
         """Generate optimized follow-up message"""
-        if tone == 'friendly':
-            return f"""Hey {customer_name}! 👋
-
-Quick reminder about invoice {invoice_number} for R{amount:,.2f}. 
-
-I know you're probably swamped - just wanted to check if everything's okay with this one?
-
-Let me know if you need anything!
-
-Cheers 🙌"""
-        
-        elif tone == 'professional':
-            return f"""Dear {customer_name},
-
-This is a reminder that invoice {invoice_number} for R{amount:,.2f} is now {days_overdue} days overdue.
-
-Please arrange payment at your earliest convenience. If you have any questions or concerns, please don't hesitate to contact us.
-
-We appreciate your prompt attention to this matter.
-
-Best regards"""
-        
-        else:  # firm
-            return f"""Dear {customer_name},
-
-URGENT: Invoice {invoice_number} for R{amount:,.2f} is now {days_overdue} days overdue.
-
-Immediate payment is required to avoid further action. Please contact us immediately if there are any issues preventing payment.
-
-Payment must be received within 48 hours.
+        if tone not in ('friendly', 'professional'):
+            tone = 'firm'
+        return get_engine().render('optimizer', tone, {
+            'customer_name': customer_name,
+            'invoice_number': invoice_number,
+            'amount': amount,
+            'days_overdue': days_overdue
+        })
 
-Regards"""
-    
-    def do_OPTIONS(self):
-        """Handle CORS preflight"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+class handler(JSONHandler):
+    service = DSPyOptimizer()
@@ -2,115 +2,228 @@
 RAGFlow Knowledge Base - Natural Language Invoice Queries
 Enables queries like: "Show me Beach Bums' total spending last quarter"
 Uses semantic search over invoice data
+
+Send {"action": "ingest", "tenant": ...} once to keep a tenant's ledger
+server-side; later queries only need {"tenant": ..., "query": ...}
+{"action": "snapshot", "tenant": ...} writes a columnar snapshot that cold
+starts map instead of re-reading the ledger
+
+Add "mode": "semantic" to rank invoices by embedding similarity instead of
+keywords (local embeddings and vector index, see _invoicing/semantic.py)
 """
 
-from http.server import BaseHTTPRequestHandler
-import json
-import re
-from datetime import datetime, timedelta
+import os
+import sys
+from contextlib import ExitStack
+from datetime import date
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(body) if body else {}
-            
-            query = data.get('query', '')
-            invoices = data.get('invoices', [])
-            customers = data.get('customers', [])
-            
-            result = self.process_query(query, invoices, customers)
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
-            
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': str(e)}).encode())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _invoicing.aging import ReceivablesLedger, due_day
+from _invoicing.endpoint import HTTPError, JSONHandler, Service, is_materialized
+from _invoicing.indexes import normalize_name, top_recent
+from _invoicing.matcher import matcher_for
+from _invoicing.metrics import record_invoices, stage
+from _invoicing.queryplan import compile_query, normalize_query, scan
+from _invoicing.search import search_invoices
+from _invoicing.semantic import VectorIndex, np
+from _invoicing.store import get_store
+
+class RAGQuery(Service):
+    name = 'rag-query'
     
-    def process_query(self, query, invoices, customers):
+    def cache_key(self, data):
+        """Answers are cached by dataset version (or inline payload) and normalized query"""
+        if data.get('action', 'query') in ('ingest', 'snapshot') or not is_materialized(data, 'invoices'):
+            return None
+        
+        # Timeframes are relative to today, so answers never outlive the day
+        query = normalize_query(data.get('query', ''))
+        tenant = data.get('tenant')
+        if tenant and 'invoices' not in data:
+            return ['tenant', tenant, get_store().version(tenant), data.get('version'), query,
+                    data.get('mode'), date.today().isoformat()]
+        return ['inline', query, data.get('mode'), data.get('invoices', []), data.get('customers', []),
+                date.today().isoformat()]
+    
+    def handle(self, data):
+        """Ingest tenant data, or answer a query against resident or inline data"""
+        action = data.get('action', 'query')
+        tenant = data.get('tenant')
+        
+        if action == 'ingest':
+            # Upsert invoices/customers into the tenant's resident store
+            return get_store().upsert(
+                tenant,
+                invoices=data.get('invoices', []),
+                customers=data.get('customers', []),
+                deleted=data.get('deleted', [])
+            )
+        
+        if action == 'snapshot':
+            # Columnar copy of the current version for the next cold start
+            return get_store().export(tenant)
+        
+        if tenant and 'invoices' not in data:
+            # Query against server-side data; the client only sends query + tenant
+            # Held for the whole query: an ingest updates the resident indexes in place
+            with ExitStack() as held:
+                with stage('load'):
+                    dataset = held.enter_context(get_store().reading(tenant))
+                record_invoices(len(dataset.invoices))
+                expected = data.get('version')
+                if expected is not None and int(expected) != dataset.version:
+                    raise HTTPError(409, {
+                        'error': 'Dataset version mismatch',
+                        'tenant': tenant,
+                        'version': dataset.version
+                    })
+                mode = data.get('mode')
+                aging = compile_query(data.get('query', '')).intent == 'aging'
+                result = self.process_query(data.get('query', ''), dataset.invoices, dataset.customers,
+                                            index=dataset.index, matcher=dataset.matcher, mode=mode,
+                                            vectors=dataset.vectors if mode == 'semantic' else None,
+                                            cube=dataset.aggregates,
+                                            receivables=dataset.receivables if aging else None)
+                result['dataset_version'] = dataset.version
+                return result
+        
+        query = data.get('query', '')
+        invoices = list(data.get('invoices', []))
+        customers = data.get('customers', [])
+        
+        return self.process_query(query, invoices, customers, mode=data.get('mode'))
+    
+    def process_query(self, query, invoices, customers, index=None, matcher=None, mode=None, vectors=None,
+                      cube=None, receivables=None):
         """Process natural language query and return relevant invoice data"""
-        query_lower = query.lower()
+        # Intent, timeframe and aggregation are compiled once per distinct question
+        with stage('plan'):
+            plan = compile_query(query)
+        
+        # Extract customer name (longest mention found in one pass over the query)
+        with stage('customer'):
+            if matcher is None:
+                matcher = matcher_for(customers)
+            customer_name = matcher.longest(plan.text)
         
-        # Extract customer name
-        customer_name = None
-        for customer in customers:
-            if customer.get('name', '').lower() in query_lower:
-                customer_name = customer.get('name')
-                break
+        if mode == 'semantic':
+            with stage('search'):
+                return self.semantic_search(plan.text, customer_name, invoices, index, vectors)
+        if plan.intent == 'aging':
+            with stage('aging'):
+                return self.query_aging(plan, customer_name, invoices, receivables)
+        if plan.intent == 'recent':
+            with stage('sort'):
+                return self.query_recent(plan, customer_name, invoices, index)
+        if plan.intent == 'general_search':
+            with stage('search'):
+                return self.general_search(plan.text, customer_name, invoices, index)
         
-        # Determine query type
-        if 'total' in query_lower or 'spending' in query_lower or 'spent' in query_lower:
-            return self.query_total_spending(query_lower, customer_name, invoices)
-        elif 'overdue' in query_lower or 'late' in query_lower or 'outstanding' in query_lower:
-            return self.query_overdue(query_lower, customer_name, invoices)
-        elif 'last' in query_lower or 'recent' in query_lower:
-            return self.query_recent(query_lower, customer_name, invoices)
-        elif 'average' in query_lower or 'avg' in query_lower:
-            return self.query_average(query_lower, customer_name, invoices)
-        elif 'paid' in query_lower:
-            return self.query_paid(query_lower, customer_name, invoices)
+        with stage('filter'):
+            total, count, matched = self.execute_plan(plan, customer_name, invoices, index, cube)
+        if plan.intent == 'total_spending':
+            return self.query_total_spending(plan, customer_name, total, count, matched)
+        elif plan.intent == 'overdue':
+            return self.query_overdue(plan, customer_name, total, count, matched)
+        elif plan.intent == 'average':
+            return self.query_average(plan, customer_name, total, count)
         else:
-            return self.general_search(query_lower, customer_name, invoices)
+            return self.query_paid(plan, customer_name, total, count, matched)
+    
+    def execute_plan(self, plan, customer_name, invoices, index=None, cube=None):
+        """One fused filter + aggregate pass: (sum, count, invoices kept for the answer)"""
+        today = date.today()
+        date_range = plan.date_range(today)
+        if cube is not None and index is not None and plan.keep is not None:
+            aggregate = cube.aggregate(customer_name, plan.day_range(today), plan.status, plan.value)
+            if aggregate is not None:
+                # Sums come from pre-aggregated buckets; only the rows the answer lists are read
+                kept = index.select(customer_name, date_range, limit=plan.keep, status=plan.status)
+                return aggregate + (kept,)
+        if index is not None:
+            # The index narrows by customer, date and status; the pass only sums
+            return scan(index.select(customer_name, date_range, status=plan.status),
+                        value=plan.value, keep=plan.keep)
+        return scan(invoices, customer_name, date_range, plan.status, plan.value, plan.keep)
     
-    def query_total_spending(self, query, customer_name, invoices):
+    def query_total_spending(self, plan, customer_name, total, count, matched):
         """Calculate total spending"""
-        filtered = self.filter_by_customer(invoices, customer_name) if customer_name else invoices
-        filtered = self.filter_by_timeframe(filtered, query)
-        
-        total = sum(inv.get('total', 0) for inv in filtered)
-        count = len(filtered)
-        
-        timeframe = self.extract_timeframe(query)
         customer_text = f" by {customer_name}" if customer_name else ""
         
         return {
             'query_type': 'total_spending',
-            'answer': f"Total spending{customer_text} {timeframe}: R {total:,.2f}",
+            'answer': f"Total spending{customer_text} {plan.timeframe}: R {total:,.2f}",
             'data': {
                 'total_amount': round(total, 2),
                 'invoice_count': count,
                 'customer': customer_name,
-                'timeframe': timeframe,
-                'invoices': [self.summarize_invoice(inv) for inv in filtered[:10]]
+                'timeframe': plan.timeframe,
+                'invoices': [self.summarize_invoice(inv) for inv in matched]
             }
         }
     
-    def query_overdue(self, query, customer_name, invoices):
+    def query_overdue(self, plan, customer_name, total_overdue, count, overdue):
         """Find overdue invoices"""
-        filtered = self.filter_by_customer(invoices, customer_name) if customer_name else invoices
-        overdue = [inv for inv in filtered if inv.get('status') == 'overdue']
-        
-        total_overdue = sum(inv.get('total', 0) - inv.get('amountPaid', 0) for inv in overdue)
-        
         customer_text = f" for {customer_name}" if customer_name else ""
         
         return {
             'query_type': 'overdue',
-            'answer': f"Found {len(overdue)} overdue invoice(s){customer_text} totaling R {total_overdue:,.2f}",
+            'answer': f"Found {count} overdue invoice(s){customer_text} totaling R {total_overdue:,.2f}",
             'data': {
-                'overdue_count': len(overdue),
+                'overdue_count': count,
                 'overdue_amount': round(total_overdue, 2),
                 'customer': customer_name,
                 'invoices': [self.summarize_invoice(inv) for inv in overdue]
             }
         }
     
-    def query_recent(self, query, customer_name, invoices):
-        """Get recent invoices"""
-        filtered = self.filter_by_customer(invoices, customer_name) if customer_name else invoices
+    def query_aging(self, plan, customer_name, invoices, receivables=None):
+        """Receivables aging by due date, or the invoices in one days-past-due range"""
+        if receivables is None:
+            receivables = ReceivablesLedger.from_invoices(invoices)
+        today = date.today()
+        customer_text = f" for {customer_name}" if customer_name else ""
         
-        # Extract number if specified (e.g., "last 5 invoices")
-        match = re.search(r'(\d+)', query)
-        limit = int(match.group(1)) if match else 5
+        if plan.past_due is None:
+            report = receivables.report(today, customer_name)
+            return {
+                'query_type': 'aging',
+                'answer': (f"Open receivables{customer_text}: R {report['open_balance']:,.2f} in "
+                           f"{report['open_invoices']} invoice(s), R {report['past_due_balance']:,.2f} past due"),
+                'data': dict(report, customer=customer_name)
+            }
         
-        recent = sorted(filtered, key=lambda x: x.get('date', ''), reverse=True)[:limit]
+        low, high = plan.past_due
+        label = f"{low}-{high} days" if high is not None else f"over {low - 1} days"
+        count, balance, oldest = receivables.select(low, high, today, customer_name, limit=10)
+        
+        return {
+            'query_type': 'aging',
+            'answer': f"Found {count} invoice(s) {label} past due{customer_text} totaling R {balance:,.2f}",
+            'data': {
+                'count': count,
+                'balance': round(balance, 2),
+                'customer': customer_name,
+                'days_past_due': {'min': low, 'max': high},
+                'as_of': today.isoformat(),
+                'invoices': [
+                    dict(self.summarize_invoice(inv), due_date=inv.get('dueDate'),
+                         days_past_due=today.toordinal() - due_day(inv))
+                    for inv in oldest
+                ]
+            }
+        }
+    
+    def query_recent(self, plan, customer_name, invoices, index=None):
+        """Get recent invoices"""
+        # The plan carries the number if specified (e.g., "last 5 invoices")
+        limit = plan.limit
+        
+        if index is not None:
+            recent = index.recent(limit, customer_name)
+        else:
+            filtered = scan(invoices, customer_name)[2] if customer_name else invoices
+            recent = top_recent(filtered, limit)
         
         customer_text = f" for {customer_name}" if customer_name else ""
         
@@ -124,75 +237,58 @@ class handler(BaseHTTPRequestHandler):
             }
         }
     
-    def query_average(self, query, customer_name, invoices):
+    def query_average(self, plan, customer_name, total, count):
         """Calculate average invoice amount"""
-        filtered = self.filter_by_customer(invoices, customer_name) if customer_name else invoices
-        filtered = self.filter_by_timeframe(filtered, query)
-        
-        if not filtered:
+        if not count:
             return {
                 'query_type': 'average',
                 'answer': 'No invoices found for this query',
                 'data': {'average': 0, 'count': 0}
             }
         
-        avg = sum(inv.get('total', 0) for inv in filtered) / len(filtered)
+        avg = total / count
         
         customer_text = f" for {customer_name}" if customer_name else ""
-        timeframe = self.extract_timeframe(query)
         
         return {
             'query_type': 'average',
-            'answer': f"Average invoice amount{customer_text} {timeframe}: R {avg:,.2f}",
+            'answer': f"Average invoice amount{customer_text} {plan.timeframe}: R {avg:,.2f}",
             'data': {
                 'average': round(avg, 2),
-                'count': len(filtered),
+                'count': count,
                 'customer': customer_name,
-                'timeframe': timeframe
+                'timeframe': plan.timeframe
             }
         }
     
-    def query_paid(self, query, customer_name, invoices):
+    def query_paid(self, plan, customer_name, total_paid, count, paid):
         """Find paid invoices"""
-        filtered = self.filter_by_customer(invoices, customer_name) if customer_name else invoices
-        paid = [inv for inv in filtered if inv.get('status') == 'paid']
-        
-        total_paid = sum(inv.get('total', 0) for inv in paid)
-        
         customer_text = f" by {customer_name}" if customer_name else ""
         
         return {
             'query_type': 'paid',
-            'answer': f"Found {len(paid)} paid invoice(s){customer_text} totaling R {total_paid:,.2f}",
+            'answer': f"Found {count} paid invoice(s){customer_text} totaling R {total_paid:,.2f}",
             'data': {
-                'paid_count': len(paid),
+                'paid_count': count,
                 'paid_amount': round(total_paid, 2),
                 'customer': customer_name,
-                'invoices': [self.summarize_invoice(inv) for inv in paid[:10]]
+                'invoices': [self.summarize_invoice(inv) for inv in paid]
             }
         }
     
-    def general_search(self, query, customer_name, invoices):
+    def general_search(self, query, customer_name, invoices, index=None):
         """General search across all invoice data"""
-        filtered = self.filter_by_customer(invoices, customer_name) if customer_name else invoices
-        
-        # Simple keyword matching
-        results = []
-        for inv in filtered:
-            score = 0
-            inv_text = json.dumps(inv).lower()
-            
-            # Score based on keyword matches
-            keywords = query.split()
-            for keyword in keywords:
-                if keyword in inv_text:
-                    score += 1
-            
-            if score > 0:
-                results.append((score, inv))
-        
-        results.sort(reverse=True, key=lambda x: x[0])
-        top_results = [inv for score, inv in results[:10]]
+        # BM25 ranking, restricted to the customer if one was named
+        if index is not None and index.search is not None:
+            predicate = None
+            if customer_name:
+                name = normalize_name(customer_name)
+                predicate = lambda inv: normalize_name(inv.get('customer')) == name
+            results = index.search.search(query, limit=10, predicate=predicate)
+        else:
+            # No resident index: score in one pass, partitioned across processes when large
+            results = search_invoices(invoices, query, limit=10, customer_name=customer_name)
+        top_results = [inv for score, inv in results]
         
         return {
             'query_type': 'general_search',
@@ -203,55 +299,32 @@ class handler(BaseHTTPRequestHandler):
             }
         }
     
-    def filter_by_customer(self, invoices, customer_name):
-        """Filter invoices by customer"""
-        if not customer_name:
-            return invoices
-        return [inv for inv in invoices if inv.get('customer', '').lower() == customer_name.lower()]
-    
-    def filter_by_timeframe(self, invoices, query):
-        """Filter invoices by timeframe mentioned in query"""
-        if 'today' in query:
-            today = datetime.now().strftime('%Y-%m-%d')
-            return [inv for inv in invoices if inv.get('date', '').startswith(today)]
-        
-        if 'this week' in query or 'last week' in query:
-            days = 7
-            cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-            return [inv for inv in invoices if inv.get('date', '') >= cutoff]
-        
-        if 'this month' in query or 'last month' in query:
-            month = datetime.now().strftime('%Y-%m')
-            return [inv for inv in invoices if inv.get('date', '').startswith(month)]
+    def semantic_search(self, query, customer_name, invoices, index=None, vectors=None):
+        """Invoices closest in meaning to the query, restricted to the customer if one was named"""
+        if np is None:
+            # No NumPy for vectors: keyword ranking instead
+            result = self.general_search(query, customer_name, invoices, index)
+            result['data']['engine'] = 'bm25'
+            return result
         
-        if 'quarter' in query or 'last 3 months' in query:
-            days = 90
-            cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-            return [inv for inv in invoices if inv.get('date', '') >= cutoff]
+        predicate = None
+        if customer_name:
+            name = normalize_name(customer_name)
+            predicate = lambda inv: normalize_name(inv.get('customer')) == name
+        if vectors is None:
+            # Inline payloads are embedded per request and scanned exactly
+            vectors = VectorIndex.from_invoices(invoices, ivf=False)
+        results = vectors.search(query, limit=10, predicate=predicate)
         
-        if 'year' in query or 'last 12 months' in query:
-            year = datetime.now().strftime('%Y')
-            return [inv for inv in invoices if inv.get('date', '').startswith(year)]
-        
-        return invoices
-    
-    def extract_timeframe(self, query):
-        """Extract timeframe description from query"""
-        if 'today' in query:
-            return 'today'
-        if 'this week' in query:
-            return 'this week'
-        if 'last week' in query:
-            return 'last week'
-        if 'this month' in query:
-            return 'this month'
-        if 'last month' in query:
-            return 'last month'
-        if 'quarter' in query:
-            return 'last quarter'
-        if 'year' in query:
-            return 'this year'
-        return 'all time'
+        return {
+            'query_type': 'semantic_search',
+            'answer': f"Found {len(results)} invoice(s) similar to your query",
+            'data': {
+                'count': len(results),
+                'engine': vectors.embedder.name,
+                'invoices': [dict(self.summarize_invoice(inv), score=score) for score, inv in results]
+            }
+        }
     
     def summarize_invoice(self, inv):
         """Create summary of invoice for response"""
@@ -264,11 +337,7 @@ class handler(BaseHTTPRequestHandler):
             'amount_paid': round(inv.get('amountPaid', 0), 2),
             'balance': round(inv.get('total', 0) - inv.get('amountPaid', 0), 2)
         }
-    
-    def do_OPTIONS(self):
-        """Handle CORS preflight"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+
+
+class handler(JSONHandler):
+    service = RAGQuery()
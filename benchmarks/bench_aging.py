@@ -0,0 +1,74 @@
+"""
+Benchmark: receivables aging from the due-date index
+
+    python benchmarks/bench_aging.py [--invoices 1000000] [--repeat 20]
+
+Reports the one-off ledger build, an incremental batch of payments, and
+aging report / past-due range latency from the sorted due-date lists versus
+a one-pass tally over every invoice.
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing.aging import AgingTally, ReceivablesLedger
+from _invoicing.store import invoice_key
+from synthetic import make_customers, make_invoices
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='receivables aging benchmark')
+    parser.add_argument('--invoices', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1000, help='invoices paid per incremental update')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    customers = make_customers(max(10, args.invoices // 50))
+    invoices = make_invoices(args.invoices, customers)
+    today = date.today()
+    customer = customers[0]['name']
+
+    start = time.perf_counter()
+    ledger = ReceivablesLedger.from_invoices(invoices, key=invoice_key)
+    build = time.perf_counter() - start
+
+    paid = [dict(inv, status='paid', amountPaid=inv['total']) for inv in invoices[:args.batch]]
+    start = time.perf_counter()
+    for inv in paid:
+        ledger.add(invoice_key(inv), inv)
+    update = time.perf_counter() - start
+    invoices[:args.batch] = paid
+
+    def tally(customer_name=None):
+        aging = AgingTally(today)
+        for inv in invoices:
+            aging.add(inv)
+        return aging.report(customer_name)
+
+    print(f'build {build:.2f}s for {args.invoices} invoices ({len(ledger)} open); '
+          f'{args.batch} payments in {update * 1000:.0f} ms')
+    print(f"{'question':<40} {'index ms':>9} {'tally ms':>9}")
+    rows = [
+        ('aging report', lambda: ledger.report(today), tally),
+        ('aging report for one customer', lambda: ledger.report(today, customer), lambda: tally(customer)),
+        ('31-60 days past due (top 10)', lambda: ledger.select(31, 60, today, limit=10), tally)
+    ]
+    for label, indexed, scanned in rows:
+        print(f'{label:<40} {timed(indexed, args.repeat):>9.3f} {timed(scanned, max(1, args.repeat // 10)):>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: crew-analyze payment metrics, pure Python vs NumPy columnar
+
+    python benchmarks/bench_crew_metrics.py [--sizes 10000,100000,1000000]
+
+Columns: the single-pass Python engine, the NumPy engine end to end
+(dict -> columns -> metrics), and NumPy aggregation alone on columns that
+were already built (the resident-data case).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing import columnar
+from synthetic import make_invoices
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='crew-analyze metrics benchmark')
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if columnar.np is None:
+        print('NumPy not installed - reporting the pure-Python path only')
+
+    print(f"{'invoices':>10} {'python ms':>10} {'numpy ms':>10} {'agg ms':>10} {'agg speedup':>12}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        invoices = make_invoices(size)
+        python_s = best_of(lambda: columnar.payment_metrics(invoices, engine='python'), args.repeat)
+        if columnar.np is None:
+            print(f'{size:>10} {python_s * 1000:>10.1f} {"-":>10} {"-":>10} {"-":>12}')
+            continue
+        numpy_s = best_of(lambda: columnar.payment_metrics(invoices, engine='numpy'), args.repeat)
+        cols = columnar.InvoiceColumns.from_invoices(invoices)
+        agg_s = best_of(lambda: columnar.columnar_metrics(cols), args.repeat)
+        print(f'{size:>10} {python_s * 1000:>10.1f} {numpy_s * 1000:>10.1f} {agg_s * 1000:>10.2f} '
+              f'{python_s / agg_s:>11.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: rag-query spending/average answers from the aggregate cube
+
+    python benchmarks/bench_cube.py [--invoices 1000000] [--repeat 20]
+
+Reports the one-off cube build, an incremental batch of changed invoices,
+and per-question latency answered from the cube versus the index + scan
+path it replaces.
+"""
+
+import argparse
+import copy
+import importlib.util
+import os
+import sys
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing.cube import AggregateCube
+from _invoicing.store import Dataset, invoice_key
+from synthetic import make_customers, make_invoices
+
+QUESTIONS = [
+    'total spending this year',
+    'average invoice this month',
+    'total spending last 45 days',
+    'total spending since 2024-01-01',
+    'total spent by {customer} last 6 months',
+    'paid by {customer}'
+]
+
+
+def load_service():
+    spec = importlib.util.spec_from_file_location('rag_query', os.path.join(API_DIR, 'rag-query.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.RAGQuery()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='aggregate cube benchmark')
+    parser.add_argument('--invoices', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1000, help='invoices per incremental update')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    customers = make_customers(max(10, args.invoices // 50))
+    invoices = make_invoices(args.invoices, customers)
+    dataset = Dataset('bench', 1, invoices, customers)
+    service = load_service()
+
+    start = time.perf_counter()
+    cube = AggregateCube.from_invoices(invoices, key=invoice_key)
+    build = time.perf_counter() - start
+
+    changed = [dict(copy.deepcopy(inv), total=inv['total'] + 1) for inv in invoices[:args.batch]]
+    start = time.perf_counter()
+    for inv in changed:
+        cube.add(invoice_key(inv), inv)
+    update = time.perf_counter() - start
+    dataset._cube = AggregateCube.from_invoices(invoices, key=invoice_key)
+
+    print(f'build {build:.2f}s for {args.invoices} invoices ({len(cube.cells)} cells); '
+          f'{args.batch} changed invoices in {update * 1000:.0f} ms')
+    print(f"{'question':<45} {'cube ms':>9} {'scan ms':>9}")
+    index = dataset.index
+    for question in QUESTIONS:
+        question = question.format(customer=customers[0]['name'])
+        timings = []
+        for cube_arg in (dataset.cube, None):
+            # Warm-up: lazily built per-customer date runs are shared by both paths
+            service.process_query(question, invoices, customers, index=index,
+                                  matcher=dataset.matcher, cube=cube_arg)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                service.process_query(question, invoices, customers, index=index,
+                                      matcher=dataset.matcher, cube=cube_arg)
+            timings.append((time.perf_counter() - start) * 1000 / args.repeat)
+        print(f'{question:<45} {timings[0]:>9.2f} {timings[1]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: duplicate and near-duplicate invoice detection
+
+    python benchmarks/bench_dedupe.py [--sizes 100000,1000000] [--planted 100]
+
+Plants exact copies and near copies (new id and number, amount +0.5%) into a
+synthetic ledger, then reports per-stage time and how many planted near
+copies were found.
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing import dedupe
+from synthetic import make_customers, make_invoices
+
+
+def plant(invoices, count, seed=11):
+    """Append `count` exact and `count` near copies; returns the near (original, copy) id pairs"""
+    rng = random.Random(seed)
+    originals = rng.sample(invoices, 2 * count)
+    pairs = []
+    for inv in originals[:count]:
+        invoices.append(copy.deepcopy(inv))
+    for inv in originals[count:]:
+        near = copy.deepcopy(inv)
+        near['id'] = inv['id'] + '-copy'
+        near['number'] = inv['number'] + 'A'
+        near['total'] = round(inv['total'] * 1.005, 2)
+        invoices.append(near)
+        pairs.append((inv['id'], near['id']))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='duplicate detection benchmark')
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--planted', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f'engine: {"numpy" if dedupe.np is not None else "python"}')
+    print(f"{'invoices':>10} {'total s':>8} {'scan ms':>9} {'lsh ms':>8} {'verify ms':>10} "
+          f"{'candidates':>11} {'exact':>6} {'recall':>8}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        invoices = make_invoices(size, make_customers(max(10, size // 50)))
+        pairs = plant(invoices, args.planted)
+
+        start = time.perf_counter()
+        result = dedupe.find_duplicates(invoices)
+        elapsed = time.perf_counter() - start
+
+        clusters = [{inv['id'] for inv in group['invoices']} for group in result['near']]
+        found = sum(1 for original, near in pairs if any(original in c and near in c for c in clusters))
+        timing = result['stats']['timing']
+        print(f"{size:>10} {elapsed:>8.2f} {timing['scan_ms']:>9.0f} {timing['lsh_ms']:>8.0f} "
+              f"{timing['verify_ms']:>10.0f} {result['stats']['candidate_pairs']:>11} "
+              f"{len(result['exact']):>6} {found:>4}/{len(pairs):<3}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark: partitioned execution across worker processes
+
+    python benchmarks/bench_parallel.py [--size 500000] [--workers 1,2,4,8]
+
+Times the Data Organizer scan (crew-analyze organizer) and the index-free
+BM25 scoring pass (rag-query general_search) on one ledger for each worker
+count. Speedup is relative to the first worker count given; with fewer
+cores than workers the extra processes only add overhead.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing.organizer import validate_chunk
+from _invoicing.parallel import partitioned
+from _invoicing.search import query_terms, term_stats
+from synthetic import make_invoices
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='partitioned execution benchmark')
+    parser.add_argument('--size', type=int, default=500000)
+    parser.add_argument('--workers', default=','.join(str(n) for n in (1, 2, 4, 8) if n <= (os.cpu_count() or 1)) or '1')
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--query', default='wax board')
+    args = parser.parse_args()
+
+    invoices = make_invoices(args.size)
+    terms = query_terms(args.query)
+    print(f'{args.size} invoices, {os.cpu_count()} CPUs')
+    print(f"{'workers':>8} {'organize ms':>12} {'speedup':>8} {'search ms':>10} {'speedup':>8}")
+
+    base = None
+    for workers in [int(n) for n in args.workers.split(',')]:
+        organize_s = timed(lambda: partitioned(validate_chunk, invoices, workers=workers,
+                                               chunk_size=args.chunk_size, min_items=0))
+        search_s = timed(lambda: partitioned(term_stats, invoices, args=(terms, None), workers=workers,
+                                             chunk_size=args.chunk_size, min_items=0))
+        if base is None:
+            base = (organize_s, search_s)
+        print(f'{workers:>8} {organize_s * 1000:>12.1f} {base[0] / organize_s:>7.2f}x '
+              f'{search_s * 1000:>10.1f} {base[1] / search_s:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark: dspy-optimize co-occurrence recommendations
+
+    python benchmarks/bench_recommend.py [--skus 50000] [--invoices 200000]
+
+Reports the one-off index build, an incremental batch of new invoices, and
+per-basket lookup latency (median and p99) against the built index.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing.cooccurrence import CooccurrenceIndex
+from synthetic import make_customers, make_invoices, make_products
+
+
+def main():
+    parser = argparse.ArgumentParser(description='co-occurrence recommendation benchmark')
+    parser.add_argument('--skus', type=int, default=50000)
+    parser.add_argument('--invoices', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=1000, help='invoices per incremental update')
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    products = make_products(args.skus)
+    invoices = make_invoices(args.invoices + args.batch, make_customers(200), products)
+    history, batch = invoices[:args.invoices], invoices[args.invoices:]
+
+    start = time.perf_counter()
+    index = CooccurrenceIndex.from_invoices(history, key=lambda inv: inv['id'])
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for inv in batch:
+        index.add(inv['id'], inv)
+    update_s = time.perf_counter() - start
+
+    timings = []
+    for inv in history[:args.lookups]:
+        skus = [item['sku'] for item in inv['items']]
+        start = time.perf_counter()
+        index.recommend(skus, limit=3)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    pairs = sum(len(neighbours) for neighbours in index.pairs.values())
+    print(f'{args.invoices} invoices, {len(index.sku_count)} SKUs seen, {pairs} non-zero pairs')
+    print(f'build            {build_s * 1000:>10.1f} ms')
+    print(f'add {args.batch:<6} invoices {update_s * 1000:>7.1f} ms')
+    print(f'lookup median    {timings[len(timings) // 2] * 1e6:>10.1f} us')
+    print(f'lookup p99       {timings[int(len(timings) * 0.99)] * 1e6:>10.1f} us')
+
+
+if __name__ == '__main__':
+    main()
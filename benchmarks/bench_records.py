@@ -0,0 +1,88 @@
+"""
+Benchmark: resident invoices as JSON dicts vs compact __slots__ records
+
+    python benchmarks/bench_records.py [--invoices 200000] [--repeat 3]
+
+Reports resident memory (tracemalloc, invoices decoded one document at a
+time as the store loads them), the one-time decode cost, per-field access
+(dict.get, record.get, record attribute) and a full analyst-metrics pass
+over each form.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing.columnar import payment_metrics
+from _invoicing.records import InvoiceRecord
+from synthetic import make_invoices
+
+
+def resident_size(build):
+    """(bytes held by what build() returns, seconds to build it)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compact invoice record benchmark')
+    parser.add_argument('--invoices', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    documents = [json.dumps(inv) for inv in make_invoices(args.invoices)]
+
+    dicts, dict_bytes, dict_s = resident_size(lambda: [json.loads(doc) for doc in documents])
+    del dicts
+    records, record_bytes, record_s = resident_size(
+        lambda: [InvoiceRecord.decode(json.loads(doc)) for doc in documents])
+    dicts = [json.loads(doc) for doc in documents]
+    del documents
+
+    print(f"{'form':<8} {'MB':>8} {'bytes/inv':>10} {'load s':>8}")
+    for form, size, elapsed in (('dict', dict_bytes, dict_s), ('record', record_bytes, record_s)):
+        print(f'{form:<8} {size / 1e6:>8.1f} {size / args.invoices:>10.0f} {elapsed:>8.2f}')
+
+    print(f"\n{'access (ns/invoice)':<32} {'status':>8} {'total':>8}")
+    rows = [
+        ('dict.get', lambda: [inv.get('status') for inv in dicts],
+         lambda: [inv.get('total', 0) for inv in dicts]),
+        ('record.get', lambda: [inv.get('status') for inv in records],
+         lambda: [inv.get('total', 0) for inv in records]),
+        ('record attribute (total in cents)', lambda: [inv.status for inv in records],
+         lambda: [inv.total_cents for inv in records])
+    ]
+    for label, status, total in rows:
+        per = [best_of(fn, args.repeat) * 1e9 / args.invoices for fn in (status, total)]
+        print(f'{label:<32} {per[0]:>8.0f} {per[1]:>8.0f}')
+
+    print(f"\n{'analyst metrics pass':<32} {'ms':>8}")
+    for label, invoices in (('dict', dicts), ('record', records)):
+        print(f'{label:<32} {best_of(lambda: payment_metrics(invoices), args.repeat) * 1000:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: rag-query semantic search (vector index)
+
+    python benchmarks/bench_semantic.py [--sizes 100000,1000000] [--queries 50]
+
+Builds the on-disk index, reopens it as a cold start would, then reports
+top-10 query latency (median and p99) and recall@10 against an exact scan
+of the same vectors.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing.semantic import VectorIndex, invoice_summary, np, open_index
+from synthetic import make_customers, make_invoices
+
+
+def make_queries(invoices, count, seed=5):
+    """A few words from random invoice summaries"""
+    rng = random.Random(seed)
+    queries = []
+    for inv in rng.sample(invoices, count):
+        words = invoice_summary(inv).split()
+        queries.append(' '.join(rng.sample(words, min(3, len(words)))))
+    return queries
+
+
+def recall(index, query, results):
+    """Share of the exact top 10 (by score, so ties count) the index returned"""
+    vector = index.embedder.embed([query])[0]
+    size = len(index.keys)
+    scores = (np.asarray(index.vectors[:size]) @ vector)[index.live[:size]]
+    tenth = np.partition(scores, len(scores) - 10)[len(scores) - 10]
+    return sum(1 for score, _ in results if score >= round(float(tenth), 4) - 1e-4) / 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description='semantic search benchmark')
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+
+    if np is None:
+        print('semantic search needs NumPy')
+        return
+
+    def key(inv):
+        return inv['id']
+
+    print(f"{'invoices':>10} {'build s':>8} {'file MB':>8} {'reopen s':>9} {'lists':>6} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'recall@10':>10}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        invoices = make_invoices(size, make_customers(max(10, size // 50)))
+        queries = make_queries(invoices, args.queries)
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            built = open_index(invoices, key=key, directory=directory, version=1)
+            # IVF lists train in the background; keep them with the saved index
+            built.wait_for_training()
+            built.save(1)
+            build = time.perf_counter() - start
+            megabytes = os.path.getsize(os.path.join(directory, 'vectors.f32')) / 1e6
+
+            start = time.perf_counter()
+            index = VectorIndex.load(directory, 1, invoices, key)
+            reopen = time.perf_counter() - start
+
+            latencies = []
+            found = 0
+            for query in queries:
+                start = time.perf_counter()
+                results = index.search(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+                found += recall(index, query, results)
+            latencies.sort()
+            lists = len(index.centroids) if index.centroids is not None else 0
+            print(f"{size:>10} {build:>8.1f} {megabytes:>8.0f} {reopen:>9.2f} {lists:>6} "
+                  f"{latencies[len(latencies) // 2]:>8.2f} {latencies[int(len(latencies) * 0.99)]:>8.2f} "
+                  f"{found / len(queries):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: tenant cold start from SQLite JSON vs the columnar snapshot
+
+    python benchmarks/bench_snapshot.py [--invoices 300000]
+
+Ingests a synthetic ledger into a scratch store, writes its snapshot, then
+for each question times a cold start (fresh store, nothing resident) up to
+the first answer along both paths.
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _invoicing import store
+from synthetic import make_customers, make_invoices
+
+QUESTIONS = [
+    'total spending this year',
+    'average invoice last 3 months',
+    'total spent by {customer} since 2025-01-01',
+    'last 5 invoices for {customer}',
+    'overdue invoices for {customer}'
+]
+
+
+def load_service():
+    spec = importlib.util.spec_from_file_location('rag_query', os.path.join(API_DIR, 'rag-query.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.RAGQuery()
+
+
+def cold_answer(service, root, question, snapshot):
+    """Seconds from a fresh store to the first answer"""
+    path = os.path.join(root, 'bench.ledger')
+    hidden = path + '.off'
+    if not snapshot:
+        os.rename(path, hidden)
+    try:
+        store._default_store = store.InvoiceStore(root)
+        start = time.perf_counter()
+        dataset = store.get_store().load('bench')
+        service.process_query(question, dataset.invoices, dataset.customers, index=dataset.index,
+                              matcher=dataset.matcher, cube=dataset.aggregates)
+        return time.perf_counter() - start
+    finally:
+        if not snapshot:
+            os.rename(hidden, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cold start benchmark')
+    parser.add_argument('--invoices', type=int, default=300000)
+    args = parser.parse_args()
+
+    customers = make_customers(max(10, args.invoices // 50))
+    invoices = make_invoices(args.invoices, customers)
+    service = load_service()
+    with tempfile.TemporaryDirectory() as root:
+        ingest = store.InvoiceStore(root)
+        ingest.upsert('bench', invoices, customers)
+        del invoices
+        start = time.perf_counter()
+        result = ingest.export('bench')
+        export = time.perf_counter() - start
+        print(f"export {export:.2f}s, snapshot {result['snapshot_bytes'] / 1e6:.0f} MB "
+              f"for {args.invoices} invoices")
+
+        print(f"{'first question after a cold start':<52} {'json s':>8} {'snapshot ms':>12}")
+        for question in QUESTIONS:
+            question = question.format(customer=customers[1]['name'])
+            from_json = cold_answer(service, root, question, snapshot=False)
+            from_snapshot = cold_answer(service, root, question, snapshot=True)
+            print(f'{question:<52} {from_json:>8.2f} {from_snapshot * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
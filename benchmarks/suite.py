@@ -0,0 +1,431 @@
+"""
+Benchmark Suite: every agent, task and query type of the three Python endpoints
+
+    python benchmarks/suite.py [--invoices 100000] [--inline 5000] [--output results.json]
+    python benchmarks/suite.py --compare results-before.json --output results-after.json
+
+One seeded synthetic ledger (synthetic.py) feeds two parts:
+- micro: each scenario's Service.handle() plus response encoding, in-process
+  (no HTTP, no response cache): first run, then best and median of --repeat.
+  Inline scenarios send the first --inline invoices the way a client would;
+  @tenant scenarios run against the whole ledger, ingested into a scratch
+  store in chunks so --invoices can go into the millions.
+- http: the long-lived server (server.py) started on a free port over the
+  same store (or an already running one with --url), driven by --concurrency
+  keep-alive clients; latency percentiles and throughput per scenario, and
+  the server's own stage timings from /metrics. The response cache is off
+  unless --result-cache, so repeated bodies measure the work, not the cache.
+  Micro needs the local store, so --url runs http only.
+
+Results go to --output as JSON (git revision, Python, CPU count, arguments
+and every measurement); --compare prints the change per scenario against an
+earlier results file.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timezone
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from _invoicing import store
+from _invoicing.endpoint import NDJSONStream
+from _invoicing.server import load_services
+from synthetic import iter_invoices, make_customers, make_products
+
+TENANT = 'bench'
+INGEST_CHUNK = 50000
+CREW, DSPY, RAG = '/api/crew-analyze', '/api/dspy-optimize', '/api/rag-query'
+SERVER_START_TIMEOUT = 60
+
+
+class Scenario:
+    """One request shape; `ndjson` sends its invoices as NDJSON lines after the request object"""
+
+    def __init__(self, name, route, payload, ndjson=False):
+        self.name = name
+        self.route = route
+        self.payload = payload
+        self.ndjson = ndjson
+
+    def body(self):
+        """(request body, content type) as a client would send it"""
+        if self.ndjson:
+            header = {key: value for key, value in self.payload.items() if key != 'invoices'}
+            lines = [json.dumps(header)] + [json.dumps(inv) for inv in self.payload['invoices']]
+            return '\n'.join(lines).encode(), 'application/x-ndjson'
+        return json.dumps(self.payload).encode(), 'application/json'
+
+
+def scenarios(inline, customers, products):
+    """Every crew agent and mode, dspy task and rag-query intent, inline and @tenant"""
+    top = customers[0]
+    name = top['name']
+    mine = [inv for inv in inline if inv['customerId'] == top['id']]
+    overdue = next((inv for inv in mine if inv['status'] == 'overdue'), mine[0] if mine else {})
+    tenant = {'tenant': TENANT}
+
+    found = [
+        Scenario('crew/analyst', CREW, {'agent': 'analyst', 'invoices': mine, 'customer': top}),
+        Scenario('crew/analyst-batch', CREW, {'agent': 'analyst', 'mode': 'batch', 'invoices': inline,
+                                              'customers': customers}, ndjson=True),
+        Scenario('crew/analyst-aging', CREW, {'agent': 'analyst', 'mode': 'aging', 'invoices': inline}),
+        Scenario('crew/analyst-aging@tenant', CREW, dict(tenant, agent='analyst', mode='aging')),
+        Scenario('crew/collector', CREW, {'agent': 'collector', 'invoices': mine, 'customer': top}),
+        Scenario('crew/collector-batch', CREW, {'agent': 'collector', 'mode': 'batch', 'invoices': inline,
+                                                'customers': customers}, ndjson=True),
+        Scenario('crew/collector@tenant', CREW, dict(tenant, agent='collector', customer=top)),
+        Scenario('crew/organizer', CREW, {'agent': 'organizer', 'invoices': inline, 'customers': customers}),
+        Scenario('crew/organizer-dedupe', CREW, {'agent': 'organizer', 'mode': 'dedupe', 'invoices': inline}),
+        Scenario('crew/organizer-batch', CREW, {'agent': 'organizer', 'mode': 'batch', 'invoices': inline,
+                                                'customers': customers}, ndjson=True),
+        Scenario('dspy/recommend', DSPY, {'task': 'recommend', 'context': {
+            'invoice': inline[0], 'customer': top, 'products': products, 'history': inline}}),
+        Scenario('dspy/recommend@tenant', DSPY, {'task': 'recommend', 'context': dict(
+            tenant, invoice=inline[0], customer=top, products=products)}),
+        Scenario('dspy/followup', DSPY, {'task': 'followup', 'context': {
+            'invoice': overdue, 'customer': top, 'history': inline}}),
+        Scenario('dspy/followup@tenant', DSPY, {'task': 'followup', 'context': dict(
+            tenant, invoice=overdue, customer=top)}),
+        Scenario('dspy/insights', DSPY, {'task': 'insights', 'context': {'invoices': inline}})
+    ]
+    questions = [
+        ('total', f'total spent by {name} this year'),
+        ('overdue', f'overdue invoices for {name}'),
+        ('recent', f'last 10 invoices for {name}'),
+        ('average', 'average invoice this year'),
+        ('paid', f'paid invoices for {name}'),
+        ('aging', 'receivables aging'),
+        ('search', 'wax board')
+    ]
+    for intent, question in questions:
+        found.append(Scenario(f'rag/{intent}', RAG, {'query': question, 'invoices': inline,
+                                                     'customers': customers}))
+        found.append(Scenario(f'rag/{intent}@tenant', RAG, dict(tenant, query=question)))
+    found.append(Scenario('rag/semantic@tenant', RAG, dict(tenant, query='surf wax for the shop',
+                                                           mode='semantic')))
+    return found
+
+
+def ingest(upsert, args, customers, products):
+    """Stream the whole ledger into the tenant, INGEST_CHUNK invoices per upsert
+
+    Returns the first --inline invoices (the inline scenarios' payload) and
+    the seconds taken.
+    """
+    inline, chunk = [], []
+    start = time.perf_counter()
+    for inv in iter_invoices(args.invoices, customers, products, args.seed, args.skew,
+                             product_skew=args.product_skew):
+        if len(inline) < args.inline:
+            inline.append(inv)
+        chunk.append(inv)
+        if len(chunk) == INGEST_CHUNK:
+            upsert(chunk, ())
+            chunk = []
+    upsert(chunk, customers)
+    return inline, time.perf_counter() - start
+
+
+def run_handle(service, payload):
+    """handle() plus encoding the response; returns the response size"""
+    result = service.handle(payload)
+    if isinstance(result, NDJSONStream):
+        return sum(len(line) for line in result.lines())
+    return len(json.dumps(result).encode())
+
+
+def run_micro(services, found, repeat):
+    print(f"{'micro (in-process)':<32} {'first ms':>10} {'best ms':>10} {'median ms':>10} {'KB out':>8}")
+    results = []
+    for scenario in found:
+        service = services[scenario.route]
+        timings = []
+        size = 0
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            size = run_handle(service, scenario.payload)
+            timings.append(time.perf_counter() - start)
+        rest = sorted(timings[1:]) or timings
+        row = {
+            'scenario': scenario.name,
+            'first_ms': timings[0] * 1000,
+            'best_ms': rest[0] * 1000,
+            'median_ms': rest[len(rest) // 2] * 1000,
+            'response_bytes': size
+        }
+        results.append(row)
+        print(f"{scenario.name:<32} {row['first_ms']:>10.2f} {row['best_ms']:>10.2f} "
+              f"{row['median_ms']:>10.2f} {size / 1024:>8.1f}")
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(url, method, path, body=None, headers=None):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=600)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def start_server(root, args):
+    """server.py in a child process over the scratch store; returns (process, base url)"""
+    port = free_port()
+    env = dict(os.environ, INVOICE_STORE_DIR=root)
+    if not args.result_cache:
+        env['RESULT_CACHE_SIZE'] = '0'
+    command = [sys.executable, '-m', '_invoicing.server', '--port', str(port)]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    process = subprocess.Popen(command, cwd=API_DIR, env=env, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if request(url, 'GET', '/health')[0] == 200:
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def drive(url, scenario, requests, concurrency):
+    """One warm-up request, then `requests` POSTs over `concurrency` keep-alive connections"""
+    parts = urlsplit(url)
+    body, content_type = scenario.body()
+    headers = {'Content-Type': content_type}
+    start = time.perf_counter()
+    status, _ = request(url, 'POST', scenario.route, body, headers)
+    warmup = time.perf_counter() - start
+
+    pending = iter(range(requests))
+    lock = threading.Lock()
+    latencies = []
+    statuses = Counter()
+    cache = Counter()
+
+    def client():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=600)
+        try:
+            while True:
+                with lock:
+                    if next(pending, None) is None:
+                        return
+                sent = time.perf_counter()
+                conn.request('POST', scenario.route, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - sent
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status] += 1
+                    cache[response.getheader('X-Cache') or 'none'] += 1
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'scenario': scenario.name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'request_bytes': len(body),
+        'warmup_ms': warmup * 1000,
+        'throughput_rps': requests / wall,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p90_ms': percentile(latencies, 0.9) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'warmup_status': status,
+        'errors': requests - statuses[200],
+        'cache_hits': cache['HIT']
+    }
+
+
+def scrape_stages(url):
+    """Mean server-side milliseconds per (service, stage) from the Prometheus text"""
+    status, text = request(url, 'GET', '/metrics')
+    if status != 200:
+        return {}
+    sums, counts = {}, {}
+    for line in text.decode().splitlines():
+        if not line.startswith('api_stage_seconds_'):
+            continue
+        series, _, value = line.rpartition(' ')
+        family, _, labels = series.partition('{')
+        labels = dict(part.split('=', 1) for part in labels.rstrip('}').split(','))
+        key = (labels['service'].strip('"'), labels.get('stage', '').strip('"'))
+        if family == 'api_stage_seconds_sum':
+            sums[key] = float(value)
+        elif family == 'api_stage_seconds_count':
+            counts[key] = float(value)
+    stages = defaultdict(dict)
+    for (service, stage), total in sorted(sums.items()):
+        if counts.get((service, stage)):
+            stages[service][stage] = total / counts[(service, stage)] * 1000
+    return dict(stages)
+
+
+def run_http(url, found, args):
+    print(f"\n{'http (' + str(args.concurrency) + ' clients)':<32} {'warm ms':>10} {'req/s':>10} "
+          f"{'p50 ms':>10} {'p99 ms':>10} {'errors':>7}")
+    results = []
+    for scenario in found:
+        row = drive(url, scenario, args.requests, args.concurrency)
+        results.append(row)
+        print(f"{scenario.name:<32} {row['warmup_ms']:>10.1f} {row['throughput_rps']:>10.1f} "
+              f"{row['p50_ms']:>10.2f} {row['p99_ms']:>10.2f} {row['errors']:>7}")
+    return results
+
+
+def describe_run(args):
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                  capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        'revision': revision,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'ledger_date': date.today().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': importlib.util.find_spec('numpy') is not None,
+        'arguments': vars(args)
+    }
+
+
+def compare(previous, current):
+    """Print the change of each measurement present in both results files"""
+    print(f"\nchange since {previous['meta'].get('revision')} ({previous['meta'].get('created')})")
+    print(f"{'scenario':<32} {'metric':<16} {'before':>10} {'after':>10} {'change':>8}")
+    for part, metric in (('micro', 'median_ms'), ('http', 'p50_ms'), ('http', 'throughput_rps')):
+        before = {row['scenario']: row for row in previous.get(part, [])}
+        for row in current.get(part, []):
+            old = before.get(row['scenario'])
+            if not old or not old.get(metric):
+                continue
+            change = (row[metric] / old[metric] - 1) * 100
+            print(f"{row['scenario']:<32} {metric:<16} {old[metric]:>10.2f} {row[metric]:>10.2f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark suite for the Python endpoints')
+    parser.add_argument('--invoices', type=int, default=100000, help='tenant ledger size')
+    parser.add_argument('--customers', type=int, default=None, help='default: invoices / 50')
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--skew', type=float, default=1.2, help='customer Zipf exponent')
+    parser.add_argument('--product-skew', type=float, default=0, help='product Zipf exponent (0: uniform)')
+    parser.add_argument('--inline', type=int, default=5000, help='invoices sent with inline requests')
+    parser.add_argument('--only', default='', help='comma-separated scenario name substrings')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=None, help='server CPU worker threads')
+    parser.add_argument('--url', default=None, help='benchmark a running server (the ledger is ingested over HTTP)')
+    parser.add_argument('--result-cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--snapshot', action='store_true', help='write the tenant snapshot after ingest')
+    parser.add_argument('--output', default=None, help='write results as JSON')
+    parser.add_argument('--compare', default=None, help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    customers = make_customers(args.customers or max(10, args.invoices // 50))
+    products = make_products(args.products)
+    results = {'meta': describe_run(args)}
+
+    with tempfile.TemporaryDirectory() as root:
+        if args.url:
+            def upsert(invoices, customer_rows):
+                body = json.dumps({'action': 'ingest', 'tenant': TENANT, 'invoices': invoices,
+                                   'customers': list(customer_rows)})
+                status, reply = request(args.url, 'POST', RAG, body, {'Content-Type': 'application/json'})
+                if status != 200:
+                    raise RuntimeError(f'ingest failed ({status}): {reply[:200]!r}')
+        else:
+            store._default_store = store.InvoiceStore(root)
+
+            def upsert(invoices, customer_rows):
+                store.get_store().upsert(TENANT, invoices, customer_rows)
+
+        inline, seconds = ingest(upsert, args, customers, products)
+        if args.snapshot:
+            if args.url:
+                request(args.url, 'POST', RAG, json.dumps({'action': 'snapshot', 'tenant': TENANT}),
+                        {'Content-Type': 'application/json'})
+            else:
+                store.get_store().export(TENANT)
+        results['ingest'] = {'invoices': args.invoices, 'seconds': seconds,
+                             'invoices_per_second': args.invoices / seconds if seconds else None}
+        print(f'ingested {args.invoices} invoices ({len(customers)} customers) in {seconds:.1f}s; '
+              f'{len(inline)} sent inline')
+
+        found = scenarios(inline, customers, products)
+        if args.only:
+            wanted = [part.strip() for part in args.only.split(',') if part.strip()]
+            found = [scenario for scenario in found if any(part in scenario.name for part in wanted)]
+
+        if not args.skip_micro and not args.url:
+            results['micro'] = run_micro(load_services(), found, args.repeat)
+        if not args.skip_http:
+            process = None
+            url = args.url
+            if url is None:
+                process, url = start_server(root, args)
+            try:
+                results['http'] = run_http(url, found, args)
+                results['server_stages_ms'] = scrape_stages(url)
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2)
+        print(f'\nresults written to {args.output}')
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(json.load(handle), results)
+
+
+if __name__ == '__main__':
+    main()
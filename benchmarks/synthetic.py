@@ -0,0 +1,133 @@
+"""
+Synthetic Ledger Generator
+Seeded invoices/customers/products with a skewed customer distribution,
+used by the benchmark scripts in this folder
+
+    python benchmarks/synthetic.py --invoices 1000000 --output ledger.ndjson
+"""
+
+import argparse
+import json
+import random
+import sys
+from datetime import date, timedelta
+
+STATUSES = ['paid', 'paid', 'paid', 'sent', 'overdue', 'draft', 'partial']
+
+
+def make_customers(count, seed=1):
+    rng = random.Random(seed)
+    prefixes = ['Beach', 'Surf', 'Coastal', 'Karoo', 'Table Bay', 'Jozi', 'Lekker', 'Braai', 'Summit', 'Harbour']
+    suffixes = ['Bums', 'Traders', 'Supplies', 'Cafe', 'Holdings', 'Studio', 'Works', 'Outfitters']
+    return [
+        {
+            'id': f'cust-{i}',
+            'name': f'{rng.choice(prefixes)} {rng.choice(suffixes)} {i}',
+            'email': f'accounts{i}@example.co.za'
+        }
+        for i in range(count)
+    ]
+
+
+def make_products(count, seed=2):
+    rng = random.Random(seed)
+    kinds = ['Wax', 'Board', 'Leash', 'Wetsuit', 'Fin', 'Rack', 'Cap', 'Towel', 'Sunblock', 'Bag']
+    return [
+        {
+            'sku': f'SKU-{i:05d}',
+            'name': f'{rng.choice(kinds)} {i}',
+            'price': round(rng.uniform(20, 4000), 2)
+        }
+        for i in range(count)
+    ]
+
+
+def iter_invoices(count, customers=None, products=None, seed=3, skew=1.2, days=730, today=None,
+                  product_skew=0):
+    """Invoices one at a time, so millions can be streamed without holding the ledger
+
+    Customers follow a Zipf-like distribution (`skew` > 0); with `product_skew`
+    > 0 popular products also turn up more often in baskets. Output depends only
+    on the arguments (pass `today` to pin the dates as well).
+    """
+    rng = random.Random(seed)
+    customers = customers or make_customers(max(10, count // 50))
+    products = products or make_products(500)
+    weights = [1 / (rank + 1) ** skew for rank in range(len(customers))]
+    picks = rng.choices(customers, weights=weights, k=count)
+    product_weights = ([1 / (rank + 1) ** product_skew for rank in range(len(products))]
+                       if product_skew > 0 else None)
+    today = today or date.today()
+
+    for i, customer in enumerate(picks):
+        issued = today - timedelta(days=rng.randint(0, days))
+        items = []
+        size = rng.randint(1, 4)
+        if product_weights is None:
+            basket = rng.sample(products, size)
+        else:
+            basket = list({product['sku']: product
+                           for product in rng.choices(products, weights=product_weights, k=size)}.values())
+        for product in basket:
+            quantity = rng.randint(1, 5)
+            items.append({
+                'sku': product['sku'],
+                'name': product['name'],
+                'quantity': quantity,
+                'price': product['price'],
+                'total': round(product['price'] * quantity, 2)
+            })
+        total = round(sum(item['total'] for item in items), 2)
+        status = rng.choice(STATUSES)
+        invoice = {
+            'id': f'inv-{i}',
+            'number': f'INV-{i + 1:07d}',
+            'customer': customer['name'],
+            'customerId': customer['id'],
+            'date': issued.isoformat(),
+            'dueDate': (issued + timedelta(days=30)).isoformat(),
+            'status': status,
+            'items': items,
+            'total': total,
+            'amountPaid': 0
+        }
+        if status == 'paid':
+            invoice['amountPaid'] = total
+            invoice['paidDate'] = (issued + timedelta(days=rng.randint(0, 60))).isoformat()
+        elif status == 'partial':
+            invoice['amountPaid'] = round(total * rng.uniform(0.1, 0.9), 2)
+        yield invoice
+
+
+def make_invoices(count, customers=None, products=None, seed=3, skew=1.2, days=730, today=None,
+                  product_skew=0):
+    """The iter_invoices() ledger as a list"""
+    return list(iter_invoices(count, customers, products, seed, skew, days, today, product_skew))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='write a synthetic ledger as NDJSON (one invoice per line)')
+    parser.add_argument('--invoices', type=int, default=100000)
+    parser.add_argument('--customers', type=int, default=None, help='default: invoices / 50')
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--skew', type=float, default=1.2)
+    parser.add_argument('--product-skew', type=float, default=0)
+    parser.add_argument('--today', type=date.fromisoformat, default=None, help='YYYY-MM-DD')
+    parser.add_argument('--output', default='-', help='file path, - for stdout')
+    args = parser.parse_args()
+
+    customers = make_customers(args.customers or max(10, args.invoices // 50))
+    invoices = iter_invoices(args.invoices, customers, make_products(args.products), args.seed, args.skew,
+                             today=args.today, product_skew=args.product_skew)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for inv in invoices:
+            out.write(json.dumps(inv) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
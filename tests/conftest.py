@@ -0,0 +1,43 @@
+"""
+Shared setup for the Python API tests
+
+    python -m pytest -q tests
+
+The shared package lives in api/_invoicing and the seeded ledger generator
+in benchmarks/synthetic.py; both are put on sys.path here. The `endpoint`
+fixture loads an api/*.py endpoint's service for tests against its scan path.
+"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+def _load_endpoint(name):
+    """An api/<name>.py endpoint module (file names have hyphens, so not importable by name)"""
+    path = os.path.join(ROOT, 'api', f'{name}.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def endpoint():
+    """Service instance of an endpoint, by file name: endpoint('dspy-optimize')"""
+    return lambda name: _load_endpoint(name).handler.service
+
+
+@pytest.fixture
+def busy_threads():
+    """Switch threads often, so concurrent tests interleave their threads finely"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
@@ -0,0 +1,100 @@
+"""Resident receivables ledger ages invoices like a one-pass tally of the same batch"""
+
+import random
+from datetime import date
+
+import pytest
+
+from _invoicing.aging import AgingTally, ReceivablesLedger
+
+CUSTOMERS = ['Acme', 'acme ', 'Bolt', None]
+# Ordinary days plus both ends of the calendar
+DAYS = ['2024-01-10', '2024-02-29', '2024-04-30', '2024-07-01', '2025-01-01', '0001-01-01', '9999-12-31']
+AS_OF = [date(2024, 5, 1), date(2024, 12, 31), date(1, 1, 1), date(9999, 12, 31)]
+
+
+def random_invoice(rng):
+    inv = {'customer': rng.choice(CUSTOMERS), 'status': rng.choice(['sent', 'overdue', 'paid', 'draft']),
+           'total': rng.choice([None, '10', True]) if rng.random() < 0.15 else rng.randint(1, 100000) / 100,
+           'amountPaid': rng.choice([0, 0, 2.5, None, '2.5'])}
+    if rng.random() < 0.8:
+        inv['dueDate'] = rng.choice(DAYS)
+    if rng.random() < 0.5:
+        inv['date'] = rng.choice(DAYS)
+    return inv
+
+
+def assert_report_equal(expected, actual):
+    assert expected.keys() == actual.keys()
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            assert_report_equal(value, actual[key])
+        else:
+            assert actual[key] == pytest.approx(value, abs=0.011), key
+
+
+def assert_matches_tally(ledger, invoices):
+    for as_of in AS_OF:
+        tally = AgingTally(as_of)
+        for inv in invoices:
+            tally.add(inv)
+        for customer in (None, 'Acme', 'bolt', 'Nobody'):
+            assert_report_equal(tally.report(customer), ledger.report(as_of, customer))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_adds_replacements_and_removals_match_a_tally(seed):
+    rng = random.Random(seed)
+    ledger = ReceivablesLedger.from_invoices([])
+    invoices = {}
+    for step in range(400):
+        key = rng.randrange(60)
+        if rng.random() < 0.3:
+            ledger.remove(key)
+            invoices.pop(key, None)
+        else:
+            invoices[key] = random_invoice(rng)
+            ledger.add(key, invoices[key])
+        if step % 50 == 0:
+            assert_matches_tally(ledger, invoices.values())
+    assert_matches_tally(ledger, invoices.values())
+    assert_matches_tally(ReceivablesLedger.from_invoices(list(invoices.values())), invoices.values())
+
+
+def test_select_returns_the_bucket_oldest_first():
+    invoices = [{'customer': None, 'status': 'sent', 'total': 5, 'dueDate': '9999-12-31'},
+                {'customer': 'Acme', 'status': 'sent', 'total': 7, 'dueDate': '0001-01-01'},
+                {'customer': 'Acme', 'status': 'overdue', 'total': 3, 'dueDate': '2024-01-01'}]
+    ledger = ReceivablesLedger.from_invoices(invoices)
+    count, balance, selected = ledger.select(min_days=91, as_of=date(2024, 12, 31))
+    assert (count, balance) == (2, 10)
+    assert selected == [invoices[1], invoices[2]]
+    assert ledger.select(max_days=-1, as_of=date(2024, 12, 31))[2] == [invoices[0]]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_analyst_ranks_resident_and_inline_ledgers_alike(endpoint, seed):
+    service = endpoint('crew-analyze')
+    rng = random.Random(seed)
+    ledger = ReceivablesLedger.from_invoices([])
+    invoices = {}
+    for step in range(300):
+        key = rng.randrange(30)
+        # Equal totals spread over many customers, so past-due balances tie
+        inv = {'customer': rng.choice(['Acme', 'acme ', 'Bolt', 'Cape', 'Dune', 'Echo', 'Fern', 'Gale', None]),
+               'status': 'sent', 'total': 100, 'dueDate': rng.choice(DAYS[:4])}
+        if rng.random() < 0.3:
+            ledger.remove(key)
+            invoices.pop(key, None)
+        else:
+            invoices[key] = inv
+            ledger.add(key, inv)
+    inline = ReceivablesLedger.from_invoices(list(invoices.values()))
+    as_of = date(2024, 12, 31)
+    resident_report = service.aging_report(ledger, as_of)
+    inline_report = service.aging_report(inline, as_of)
+    balances = [report['past_due_balance'] for report in inline_report['customers']]
+    assert len(set(balances)) < len(balances)
+    assert [report['customer'] for report in resident_report['customers']] == \
+        [report['customer'] for report in inline_report['customers']]
+    assert_report_equal(inline_report, resident_report)
@@ -0,0 +1,33 @@
+"""Analyst batch mode gives each customer the report a single-customer request would"""
+
+from datetime import date
+
+from synthetic import make_customers, make_invoices
+
+from _invoicing.indexes import normalize_name
+
+AS_OF = date(2026, 1, 1)
+
+
+def test_batch_lines_match_single_customer_reports(endpoint):
+    service = endpoint('crew-analyze')
+    customers = make_customers(12)
+    invoices = make_invoices(600, customers=customers[:10], seed=4)
+    # Spelling variants and odd values land with the same customer; one customer is unlisted
+    invoices[0]['customer'] = ' ' + invoices[0]['customer'].upper()
+    invoices[1]['total'] = None
+    invoices[2]['amountPaid'] = '5'
+    invoices.append({'customer': 'Walk-in', 'status': 'overdue', 'total': 40, 'dueDate': '2025-06-01'})
+
+    lines = list(service.analyze_all_customers(invoices, customers, AS_OF))
+    assert lines[-1] == {'agent': 'Invoice Analyst', 'status': 'completed', 'customers': 13}
+    reports = {line['customer']: line for line in lines[:-1]}
+    assert list(reports) == [customer['name'] for customer in customers] + ['Walk-in']
+
+    for name, line in reports.items():
+        own = [inv for inv in invoices if normalize_name(inv.get('customer')) == normalize_name(name)]
+        single = service.analyze_payment_patterns(own, {'name': name}, as_of=AS_OF)
+        if not own:
+            assert line['status'] == single['status'] == 'no_data'
+            continue
+        assert line == single
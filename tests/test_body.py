@@ -0,0 +1,53 @@
+"""NDJSON request bodies answer like the same request sent as one JSON document"""
+
+import io
+import json
+import re
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing.endpoint import serve_post
+
+CUSTOMERS = make_customers(8)
+INVOICES = make_invoices(400, customers=CUSTOMERS, seed=11)
+# Timings differ from run to run
+TIMING = re.compile(rb'"(ms|total_ms|avg_us|timing)": ([0-9.e-]+|\{[^}]*\})')
+
+# (endpoint, request without the streamed list, key of the list in the JSON request)
+REQUESTS = [
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[0], 'as_of': '2026-01-01'}, 'invoices'),
+    ('crew-analyze', {'agent': 'analyst', 'mode': 'batch', 'customers': CUSTOMERS, 'as_of': '2026-01-01'},
+     'invoices'),
+    ('crew-analyze', {'agent': 'collector', 'customer': CUSTOMERS[1]}, 'invoices'),
+    ('crew-analyze', {'agent': 'organizer', 'customers': CUSTOMERS}, 'invoices'),
+    ('dspy-optimize', {'task': 'insights', 'context': {'concentration': True}}, 'context.invoices'),
+    ('dspy-optimize', {'task': 'followup', 'context': {'customer': CUSTOMERS[2], 'invoice': INVOICES[0]}},
+     'context.history'),
+    ('dspy-optimize', {'task': 'recommend', 'context': {'invoice': INVOICES[1], 'products': []}},
+     'context.history'),
+    ('rag-query', {'query': f"total for {CUSTOMERS[3]['name']}", 'customers': CUSTOMERS}, 'invoices')
+]
+
+
+def post(service, body, content_type):
+    status, payload, _ = serve_post(service, {'Content-Type': content_type, 'Content-Length': str(len(body))},
+                                    io.BytesIO(body))
+    if not isinstance(payload, bytes):
+        payload = b''.join(payload.lines())
+    return status, TIMING.sub(b'', payload)
+
+
+@pytest.mark.parametrize('name, request_body, list_key', REQUESTS)
+def test_ndjson_body_answers_like_json(endpoint, name, request_body, list_key):
+    service = endpoint(name)
+    document = json.loads(json.dumps(request_body))
+    target = document
+    *parents, key = list_key.split('.')
+    for parent in parents:
+        target = target[parent]
+    target[key] = INVOICES
+    lines = [json.dumps(request_body)] + [json.dumps(inv) for inv in INVOICES]
+    expected = post(service, json.dumps(document).encode(), 'application/json')
+    assert expected[0] == 200
+    assert post(service, '\n'.join(lines).encode() + b'\n', 'application/x-ndjson') == expected
@@ -0,0 +1,96 @@
+"""Cached responses are the bytes a fresh, uncached run of the same request gives"""
+
+import copy
+import json
+import re
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing import cache as cache_module
+from _invoicing import store as store_module
+from _invoicing.cache import ResultCache
+from _invoicing.endpoint import execute
+from _invoicing.store import InvoiceStore
+
+CUSTOMERS = make_customers(6)
+INVOICES = make_invoices(300, customers=CUSTOMERS, seed=12)
+# Timings differ from run to run (and a hit replays the first run's)
+TIMING = re.compile(rb'"(ms|total_ms|avg_us|timing)": ([0-9.e-]+|\{[^}]*\})')
+
+
+def changed(invoices, number, **fields):
+    invoices = copy.deepcopy(invoices)
+    invoices[number].update(fields)
+    return invoices
+
+
+NAME = CUSTOMERS[0]['name']
+# Neighbouring requests: some share a key (equal after normalization), the rest must not
+REQUESTS = [
+    ('rag-query', {'query': f'total for {NAME}', 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('rag-query', {'query': f'  Total FOR {NAME.upper()} ', 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('rag-query', {'customers': CUSTOMERS, 'invoices': INVOICES, 'query': f'total for {NAME}'}),
+    ('rag-query', {'query': f'total for {NAME}', 'customers': CUSTOMERS,
+                   'invoices': changed(INVOICES, 0, customer=NAME, total=12345)}),
+    ('rag-query', {'query': f'total for {NAME}', 'invoices': INVOICES, 'customers': CUSTOMERS[1:]}),
+    ('rag-query', {'query': 'find wetsuit', 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('rag-query', {'query': 'find wetsuit', 'invoices': INVOICES, 'customers': CUSTOMERS, 'mode': 'keyword'}),
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[1], 'invoices': INVOICES,
+                      'as_of': '2026-01-01'}),
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[1], 'invoices': INVOICES,
+                      'as_of': '2026-03-01'}),
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[2], 'invoices': INVOICES,
+                      'as_of': '2026-01-01'}),
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[1], 'as_of': '2026-01-01',
+                      'invoices': changed(INVOICES, 3, status='paid', amountPaid=1)}),
+    ('dspy-optimize', {'task': 'insights', 'context': {'invoices': INVOICES}}),
+    ('dspy-optimize', {'task': 'insights', 'context': {'invoices': INVOICES, 'concentration': True}}),
+    ('dspy-optimize', {'task': 'insights', 'context': {'concentration': True, 'invoices': INVOICES}}),
+    ('dspy-optimize', {'task': 'insights', 'context': {'invoices': changed(INVOICES, 5, total=99999)}})
+]
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = ResultCache()
+    monkeypatch.setattr(cache_module, '_default_cache', cache)
+    return cache
+
+
+def cached(service, data, if_none_match=None):
+    status, body, headers = execute(service, copy.deepcopy(data), if_none_match)
+    return status, TIMING.sub(b'', body), headers
+
+
+def uncached(service, data):
+    return TIMING.sub(b'', json.dumps(service.handle(copy.deepcopy(data))).encode())
+
+
+def test_cached_bodies_match_uncached_answers(endpoint, fresh_cache):
+    services = {name: endpoint(name) for name in ('crew-analyze', 'dspy-optimize', 'rag-query')}
+    # Twice over: the second pass is served from the cache
+    for _ in range(2):
+        for name, data in REQUESTS:
+            status, body, headers = cached(services[name], data)
+            assert status == 200
+            assert body == uncached(services[name], data), (name, data.get('query'))
+            assert cached(services[name], data, headers['ETag'])[:2] == (304, b'')
+    assert fresh_cache.misses == fresh_cache.stats()['entries']
+    assert fresh_cache.hits >= len(REQUESTS)
+
+
+def test_tenant_answers_follow_ingests(endpoint, fresh_cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(store_module, '_default_store', InvoiceStore(str(tmp_path)))
+    service = endpoint('rag-query')
+    invoices = copy.deepcopy(INVOICES)
+    for number, inv in enumerate(invoices):
+        inv['id'] = f'inv-{number}'
+    service.handle({'action': 'ingest', 'tenant': 'acme', 'invoices': invoices, 'customers': CUSTOMERS})
+    query = {'tenant': 'acme', 'query': f'total for {NAME}'}
+    for step in range(3):
+        for _ in range(2):
+            assert cached(service, query)[1] == uncached(service, query)
+        service.handle({'action': 'ingest', 'tenant': 'acme',
+                        'invoices': [dict(invoices[step], customer=NAME, total=1000 + step)]})
+    assert fresh_cache.hits == 3
@@ -0,0 +1,57 @@
+"""NumPy and pure-Python analyst metrics give the same answers"""
+
+import json
+
+import pytest
+
+from _invoicing.columnar import np, payment_metrics
+from synthetic import make_invoices
+
+needs_numpy = pytest.mark.skipif(np is None, reason='NumPy is not installed')
+
+ODD_TOTALS = [
+    {'status': 'overdue', 'total': None, 'amountPaid': 0},
+    {'status': 'overdue', 'total': '10', 'amountPaid': 0},
+    {'status': 'overdue', 'total': True, 'amountPaid': False},
+    {'status': 'overdue', 'total': 20, 'amountPaid': None},
+    {'status': 'paid', 'total': 5.5, 'amountPaid': '5.5', 'date': '2025-01-01', 'paidDate': '2025-01-11'},
+    {'status': 'sent'},
+    {'status': 'paid', 'total': [1], 'amountPaid': {'a': 1}, 'date': 'not a date', 'paidDate': None}
+]
+
+
+def assert_same(expected, actual):
+    assert expected.keys() == actual.keys()
+    for key, value in expected.items():
+        assert actual[key] == pytest.approx(value), key
+
+
+def test_python_engine_counts_non_numbers_as_zero():
+    metrics = payment_metrics(ODD_TOTALS)
+    assert metrics['total_revenue'] == 25.5
+    assert metrics['overdue_amount'] == 20
+    assert metrics['total_paid'] == 0
+
+
+@needs_numpy
+@pytest.mark.parametrize('batch', [
+    ODD_TOTALS,
+    [{'status': 'overdue', 'total': None}, {'status': 'overdue', 'total': 20}],
+    [{'status': 'overdue', 'total': '10'}, {'status': 'overdue', 'total': 20}],
+    [{'status': 'paid', 'total': True, 'amountPaid': True}, {'status': 'overdue', 'total': 20}],
+    [{'status': 'paid', 'total': 10, 'date': '0001-01-01', 'paidDate': '9999-12-31', 'customer': None},
+     {'status': 'paid', 'total': 5, 'date': '9999-12-31', 'paidDate': '9999-12-31'},
+     {'status': 'overdue', 'total': 20, 'date': '9999-12-31', 'dueDate': '0001-01-01'}]
+], ids=['mixed', 'null', 'string', 'bool', 'extreme-dates'])
+def test_engines_agree_on_null_string_and_bool_amounts(batch):
+    expected = payment_metrics(batch)
+    actual = payment_metrics(batch, engine='numpy')
+    assert_same(expected, actual)
+    # NaN would make the response invalid JSON
+    json.dumps(actual, allow_nan=False)
+
+
+@needs_numpy
+def test_engines_agree_on_a_synthetic_ledger():
+    invoices = make_invoices(2000)
+    assert_same(payment_metrics(invoices), payment_metrics(invoices, engine='numpy'))
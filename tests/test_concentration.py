@@ -0,0 +1,77 @@
+"""Concentration tracker reports what a full sort of every customer's revenue gives"""
+
+import random
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing.concentration import ConcentrationTracker
+
+
+def revenue_pairs(rng, count, customers):
+    # Few distinct amounts, so many customers tie
+    names = [f'C{number}' for number in range(customers)] + [None, 'Unknown']
+    return [(rng.choice(names), rng.choice([0, 10, 25.5, 100, 250])) for _ in range(count)]
+
+
+def full_sort(pairs, top_n):
+    totals = {}
+    for customer, amount in pairs:
+        totals[customer] = totals.get(customer, 0) + amount
+    total = sum(amount for _, amount in pairs)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def share(amount):
+        return round(amount / total * 100, 2) if total > 0 else 0
+
+    return {
+        'top_customers': [{'customer': customer, 'revenue': round(amount, 2), 'share': share(amount)}
+                          for customer, amount in ranked[:top_n]],
+        'hhi': round(sum(amount * amount for amount in totals.values()) / (total * total) * 10000, 1)
+        if total > 0 else 0,
+        'top5_share': share(sum(amount for _, amount in ranked[:5])),
+        'top10_share': share(sum(amount for _, amount in ranked[:10])),
+        'customers': len(totals),
+        'approximate': False
+    }
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('top_n', [1, 3, 10, 40])
+def test_exact_figures_match_a_full_sort(seed, top_n):
+    pairs = revenue_pairs(random.Random(seed), 2000, 30)
+    tracker = ConcentrationTracker(top_n=top_n)
+    for customer, amount in pairs:
+        tracker.add(customer, amount)
+    assert tracker.result() == full_sort(pairs, top_n)
+    # The leader is the first customer max() picks among equal revenues
+    totals = {}
+    for customer, amount in pairs:
+        totals[customer] = totals.get(customer, 0) + amount
+    assert tracker.top(1) == [max(totals.items(), key=lambda item: item[1])]
+
+
+def test_bounded_memory_keeps_the_heavy_customers():
+    rng = random.Random(7)
+    # A few large customers over a long tail of small ones
+    pairs = [(f'big-{rng.randrange(5)}', rng.randint(500, 1500)) for _ in range(2000)]
+    pairs += [(f'small-{rng.randrange(5000)}', rng.randint(1, 20)) for _ in range(20000)]
+    rng.shuffle(pairs)
+    tracker = ConcentrationTracker(top_n=5, max_customers=200)
+    for customer, amount in pairs:
+        tracker.add(customer, amount)
+    expected = full_sort(pairs, 5)
+    result = tracker.result()
+    assert result['approximate'] and result['customers'] is None
+    assert ({entry['customer'] for entry in result['top_customers']}
+            == {entry['customer'] for entry in expected['top_customers']})
+    assert result['hhi'] == pytest.approx(expected['hhi'], rel=0.1)
+    assert result['top5_share'] == pytest.approx(expected['top5_share'], rel=0.05)
+
+
+def test_insights_match_a_full_sort_of_the_ledger(endpoint):
+    service = endpoint('dspy-optimize')
+    invoices = make_invoices(800, customers=make_customers(25), seed=3)
+    result = service.optimize_insights({'invoices': invoices, 'top_n': 7})
+    pairs = [(inv.get('customer', 'Unknown'), inv.get('total', 0)) for inv in invoices]
+    assert result['concentration'] == full_sort(pairs, 7)
@@ -0,0 +1,114 @@
+"""Incrementally kept co-occurrence index recommends like one rebuilt from the live ledger"""
+
+import random
+
+import pytest
+from synthetic import make_customers, make_invoices, make_products
+
+from _invoicing import store as store_module
+from _invoicing.cooccurrence import CooccurrenceIndex, basket
+from _invoicing.store import InvoiceStore
+
+PRODUCTS = make_products(40)
+
+
+def random_invoice(rng, key):
+    items = [{'sku': product['sku'], 'name': product['name'], 'price': product['price']}
+             for product in rng.sample(PRODUCTS[:12], rng.randint(0, 4))]
+    if rng.random() < 0.1:
+        items.append({'name': 'custom work'})
+    return {'id': key, 'items': items}
+
+
+def scan_recommend(invoices, skus, min_support=1):
+    """Every candidate's strongest rule, counted straight from the baskets"""
+    baskets = [basket(inv) for inv in invoices]
+    count = {}
+    for items in baskets:
+        for sku in items:
+            count[sku] = count.get(sku, 0) + 1
+    best = {}
+    for antecedent in skus:
+        for candidate in count:
+            if candidate in skus:
+                continue
+            support = sum(1 for items in baskets if antecedent in items and candidate in items)
+            if not support or support < min_support:
+                continue
+            rule = (support / count[antecedent],
+                    support * len(baskets) / (count[antecedent] * count[candidate]), support)
+            best[candidate] = max(best.get(candidate, rule), rule)
+    return best
+
+
+def assert_matches_rebuild(index, live):
+    rebuilt = CooccurrenceIndex.from_invoices(list(live.values()), key=lambda inv: inv['id'])
+    assert index.baskets == rebuilt.baskets
+    assert index.sku_count == rebuilt.sku_count
+    assert index.pairs == rebuilt.pairs
+    for skus in ({PRODUCTS[0]['sku']}, {PRODUCTS[1]['sku'], PRODUCTS[2]['sku']}, {'SKU-none'}):
+        for limit in (1, 3, 50):
+            assert index.recommend(skus, limit) == rebuilt.recommend(skus, limit)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_adds_replacements_and_removals_match_a_rebuild(seed):
+    rng = random.Random(seed)
+    index = CooccurrenceIndex()
+    live = {}
+    for step in range(400):
+        key = rng.randrange(80)
+        if rng.random() < 0.3:
+            index.remove(key)
+            live.pop(key, None)
+        else:
+            live[key] = random_invoice(rng, key)
+            index.add(key, live[key])
+        if step % 100 == 0:
+            assert_matches_rebuild(index, live)
+    assert_matches_rebuild(index, live)
+
+
+@pytest.mark.parametrize('min_support', [1, 3])
+def test_rules_match_a_scan_of_the_baskets(min_support):
+    rng = random.Random(4)
+    invoices = [random_invoice(rng, key) for key in range(300)]
+    index = CooccurrenceIndex.from_invoices(invoices)
+    for skus in ({PRODUCTS[0]['sku']}, {PRODUCTS[3]['sku'], PRODUCTS[4]['sku'], PRODUCTS[5]['sku']}):
+        expected = scan_recommend(invoices, skus, min_support)
+        ranked = index.recommend(skus, limit=len(expected) + 5, min_support=min_support)
+        assert {sku: (confidence, lift, support) for sku, confidence, lift, support, _ in ranked} == expected
+        # The antecedent named is one whose rule is the candidate's best
+        for sku, confidence, lift, support, antecedent in ranked:
+            assert scan_recommend(invoices, {antecedent}, min_support)[sku] == (confidence, lift, support)
+        top = index.recommend(skus, limit=3, min_support=min_support)
+        assert [entry[1:4] for entry in top] == sorted(expected.values(), reverse=True)[:3]
+
+
+def test_tenant_index_recommends_like_the_sent_history(endpoint, tmp_path, monkeypatch):
+    store = InvoiceStore(str(tmp_path))
+    monkeypatch.setattr(store_module, '_default_store', store)
+    service = endpoint('dspy-optimize')
+    rng = random.Random(5)
+    invoices = make_invoices(400, customers=make_customers(10), products=PRODUCTS[:15], seed=5)
+    for number, inv in enumerate(invoices):
+        inv['id'] = f'inv-{number}'
+    live = {inv['id']: inv for inv in invoices}
+    store.upsert('acme', invoices)
+    with store.reading('acme') as dataset:
+        dataset.cooccurrence  # resident from here on, so ingests update it in place
+
+    for _ in range(5):
+        changed = [dict(live[key], items=random_invoice(rng, key)['items']) for key in rng.sample(sorted(live), 20)]
+        deleted = rng.sample(sorted(live), 10)
+        for inv in changed:
+            live[inv['id']] = inv
+        for key in deleted:
+            del live[key]
+        store.upsert('acme', changed, deleted=deleted)
+        history = list(store.load('acme').invoices)
+        assert sorted(inv['id'] for inv in history) == sorted(live)
+        for sku in (PRODUCTS[0]['sku'], PRODUCTS[7]['sku']):
+            context = {'invoice': {'items': [{'sku': sku, 'total': 100}]}, 'products': PRODUCTS, 'limit': 4}
+            resident = service.optimize_recommendation(dict(context, tenant='acme'))
+            assert resident == service.optimize_recommendation(dict(context, history=history))
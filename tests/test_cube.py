@@ -0,0 +1,83 @@
+"""Aggregate cube answers match the fused scan over the same invoices"""
+
+import random
+from datetime import date
+
+import pytest
+
+from _invoicing import cube as cube_module
+from _invoicing.cube import AGGREGATES, END_DAY, AggregateCube
+from _invoicing.queryplan import scan
+
+CUSTOMERS = ['Acme', ' acme', 'Bolt', None]
+# Ordinary days plus both ends of the calendar (and the last week, month and quarter of it)
+DAYS = ['2023-12-31', '2024-01-01', '2024-02-29', '2024-06-15', '2025-03-31',
+        '0001-01-01', '0001-01-08', '9999-10-01', '9999-12-25', '9999-12-31']
+RANGES = [
+    ('2024-01-01', '2025-01-01'), ('2024-02-01', '2024-03-01'), ('2023-12-25', None),
+    ('2024-06-15', '2024-06-16'), ('0001-01-01', '2024-01-01'), ('9999-01-01', None),
+    ('9999-12-27', None), ('0001-01-01', '0002-01-01')
+]
+
+
+def random_invoice(rng):
+    inv = {'customer': rng.choice(CUSTOMERS), 'status': rng.choice(['paid', 'overdue', 'sent']),
+           'total': rng.choice([None, '12.5', True]) if rng.random() < 0.15 else rng.randint(1, 1000),
+           'amountPaid': rng.choice([0, 0, 5, None, '5'])}
+    if rng.random() < 0.9:
+        inv['date'] = rng.choice(DAYS)
+    return inv
+
+
+def days(start, end):
+    return date.fromisoformat(start).toordinal(), date.fromisoformat(end).toordinal() if end else None
+
+
+def assert_matches_scan(cube, ledger):
+    invoices = list(ledger.values())
+    for customer in ('Acme', 'bolt', None):
+        for (status, value) in AGGREGATES:
+            expected = scan(invoices, customer, None, status, value)[:2]
+            assert cube.aggregate(customer, None, status, value) == expected
+            for start, end in RANGES:
+                expected = scan(invoices, customer, (start, end), status, value)[:2]
+                assert cube.aggregate(customer, days(start, end), status, value) == expected, (start, end)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_adds_replacements_and_removals_match_a_scan(seed):
+    rng = random.Random(seed)
+    cube = AggregateCube()
+    ledger = {}
+    for step in range(300):
+        key = rng.randrange(40)
+        if rng.random() < 0.3:
+            cube.remove(key)
+            ledger.pop(key, None)
+        else:
+            ledger[key] = random_invoice(rng)
+            cube.add(key, ledger[key])
+        if step % 100 == 0:
+            assert_matches_scan(cube, ledger)
+    assert_matches_scan(cube, ledger)
+
+
+def test_ranges_past_the_last_day_are_clamped():
+    cube = AggregateCube.from_invoices([{'customer': 'Acme', 'date': '9999-12-31', 'total': 5}])
+    assert cube.aggregate('Acme', (1, END_DAY + 400)) == (5, 1)
+    assert cube.aggregate('Acme', (date(9999, 12, 31).toordinal(), None)) == (5, 1)
+    assert cube.aggregate(None, (1, None)) == (5, 1)
+
+
+def test_a_failed_add_leaves_the_cube_untouched(monkeypatch):
+    cube = AggregateCube.from_invoices([{'customer': 'Acme', 'date': '2024-01-01', 'total': 5}])
+    cells = {key: list(cell) for key, cell in cube.cells.items()}
+
+    def broken(level, day):
+        raise ValueError('no bucket')
+
+    monkeypatch.setattr(cube_module, 'bucket_bounds', broken)
+    with pytest.raises(ValueError):
+        cube.add(0, {'customer': 'Acme', 'date': '2024-05-05', 'total': 7})
+    assert cube.entries[0][1] == date(2024, 1, 1).toordinal()
+    assert cube.cells == cells
@@ -0,0 +1,111 @@
+"""Blocked MinHash duplicate detection agrees with comparing every pair of invoices"""
+
+import random
+
+import pytest
+
+from _invoicing import dedupe
+from _invoicing.columnar import parse_day
+from _invoicing.dedupe import AMOUNT_TOLERANCE, JACCARD_THRESHOLD, MAX_DAYS_APART
+from _invoicing.dedupe import exact_key, find_duplicates, item_tokens
+from _invoicing.indexes import normalize_name
+
+PRODUCTS = [f'SKU-{n}' for n in range(8)]
+
+
+def random_ledger(rng, count):
+    invoices = []
+    for position in range(count):
+        if invoices and rng.random() < 0.3:
+            # A re-capture: same basket, maybe a new number, amount or date
+            inv = dict(rng.choice(invoices), id=f'inv-{position}')
+            change = rng.random()
+            if change < 0.3:
+                inv['number'] = f'INV-{position}'
+            elif change < 0.6:
+                inv['total'] = round(inv['total'] * rng.choice([1.01, 1.1]), 2)
+            elif change < 0.8:
+                inv['date'] = f"2024-0{rng.randint(1, 3)}-{rng.randint(10, 28)}"
+        else:
+            inv = {'id': f'inv-{position}', 'number': f'INV-{position}',
+                   'customer': rng.choice(['Acme', ' acme', 'Bolt']),
+                   'date': f"2024-0{rng.randint(1, 3)}-{rng.randint(10, 28)}",
+                   'total': rng.choice([100, 101, 250, 1000]),
+                   'items': [{'sku': sku, 'quantity': rng.randint(1, 2)}
+                             for sku in rng.sample(PRODUCTS, rng.randint(1, 3))]}
+        invoices.append(inv)
+    return invoices
+
+
+def near_pairs(invoices):
+    """Every pair of first copies that passes the near-duplicate checks: {(id, id): jaccard}"""
+    firsts = {}
+    for inv in invoices:
+        firsts.setdefault(exact_key(inv), inv)
+    firsts = [inv for inv in firsts.values() if item_tokens(inv)]
+    pairs = {}
+    for i, x in enumerate(firsts):
+        for y in firsts[i + 1:]:
+            if normalize_name(x.get('customer')) != normalize_name(y.get('customer')):
+                continue
+            a, b = item_tokens(x), item_tokens(y)
+            jaccard = len(a & b) / len(a | b)
+            if jaccard < JACCARD_THRESHOLD:
+                continue
+            if abs(x['total'] - y['total']) > AMOUNT_TOLERANCE * max(x['total'], y['total']):
+                continue
+            if abs(parse_day(x['date']) - parse_day(y['date'])) > MAX_DAYS_APART:
+                continue
+            pairs[(x['id'], y['id'])] = jaccard
+    return pairs
+
+
+def clusters(pairs):
+    parent = {}
+
+    def find(key):
+        while parent.setdefault(key, key) != key:
+            key = parent[key]
+        return key
+
+    for x, y in pairs:
+        parent[find(x)] = find(y)
+    grouped = {}
+    for key in parent:
+        grouped.setdefault(find(key), set()).add(key)
+    return list(grouped.values())
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_exact_groups_match_grouping_by_key(seed):
+    invoices = random_ledger(random.Random(seed), 400)
+    groups = {}
+    for inv in invoices:
+        groups.setdefault(exact_key(inv), []).append(inv['id'])
+    expected = [ids for ids in groups.values() if len(ids) > 1]
+    result = find_duplicates(invoices)
+    assert [[ref['id'] for ref in group['invoices']] for group in result['exact']] == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_near_groups_match_a_pairwise_comparison(seed):
+    invoices = random_ledger(random.Random(seed), 400)
+    pairs = near_pairs(invoices)
+    found = [{ref['id'] for ref in group['invoices']} for group in find_duplicates(invoices)['near']]
+    # Everything found passes the checks; LSH may miss a partial match, never an identical basket
+    assert [group for group in found if not any(group <= cluster for cluster in clusters(pairs))] == []
+    identical = [pair for pair, jaccard in pairs.items() if jaccard == 1]
+    assert identical
+    for cluster in clusters(identical):
+        assert any(cluster <= group for group in found)
+
+
+def test_python_signatures_match_numpy(monkeypatch):
+    pytest.importorskip('numpy')
+    invoices = random_ledger(random.Random(9), 600)
+    with_numpy = find_duplicates(invoices)
+    monkeypatch.setattr(dedupe, 'np', None)
+    without = find_duplicates(invoices)
+    for result in (with_numpy, without):
+        del result['stats']['engine'], result['stats']['timing']
+    assert without == with_numpy
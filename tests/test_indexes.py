@@ -0,0 +1,90 @@
+"""Customer and date indexes select what a linear filter of the ledger selects"""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from _invoicing.indexes import InvoiceIndex, invoice_date, normalize_name, top_recent
+
+CUSTOMERS = ['Acme', ' acme', 'Bolt', None, '']
+DAYS = ['2024-01-10', '2024-01-10', '2024-02-29', '2024-03-01T09:30:00', '2024-12-31', '', None]
+RANGES = [None, ('2024-01-01', '2024-02-01'), ('2024-02-29', '2024-03-02'), ('2024-03-01', None),
+          (None, '2024-03-01'), ('2025-01-01', '2026-01-01')]
+
+
+def random_ledger(rng, count):
+    invoices = []
+    for number in range(count):
+        inv = {'number': f'INV-{number}', 'customer': rng.choice(CUSTOMERS),
+               'status': rng.choice(['paid', 'sent', 'overdue'])}
+        day = rng.choice(DAYS)
+        if day is not None:
+            inv['date'] = day
+        invoices.append(inv)
+    return invoices
+
+
+def linear_filter(invoices, customer_name=None, date_range=None, status=None):
+    name = normalize_name(customer_name)
+    matches = []
+    for inv in invoices:
+        if customer_name and normalize_name(inv.get('customer')) != name:
+            continue
+        if date_range is not None:
+            start, end = date_range
+            day = invoice_date(inv)
+            if (start is not None and day < start) or (end is not None and day >= end):
+                continue
+        if status is not None and inv.get('status') != status:
+            continue
+        matches.append(inv)
+    return matches
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_select_matches_a_linear_filter(seed):
+    invoices = random_ledger(random.Random(seed), 200)
+    index = InvoiceIndex(invoices)
+    for customer in ('acme', 'Bolt', None, 'Nobody'):
+        for date_range in RANGES:
+            for status in (None, 'paid'):
+                expected = linear_filter(invoices, customer, date_range, status)
+                assert index.select(customer, date_range, status=status) == expected
+                for limit in (0, 1, 5):
+                    assert index.select(customer, date_range, limit, status) == expected[:limit]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_recent_matches_a_full_sort(seed):
+    invoices = random_ledger(random.Random(seed), 200)
+    index = InvoiceIndex(invoices)
+    for customer in ('acme', 'Bolt', None):
+        filtered = linear_filter(invoices, customer)
+        for limit in (1, 5, 500):
+            expected = sorted(filtered, key=invoice_date, reverse=True)[:limit]
+            assert index.recent(limit, customer) == expected
+            assert top_recent(filtered, limit) == expected
+
+
+QUERIES = ['total for acme this year', 'overdue invoices for Bolt this week', 'average invoice this month',
+           'last 3 invoices for acme', 'recent invoices', 'total spent by Bolt this quarter',
+           'total spent today', 'average invoice for acme']
+
+
+def test_rag_answers_match_with_and_without_the_index(endpoint):
+    service = endpoint('rag-query')
+    rng = random.Random(9)
+    today = date.today()
+    # Timeframes are relative to today
+    days = [(today - timedelta(days=offset)).isoformat() for offset in (0, 0, 1, 6, 8, 31, 89, 200, 400)]
+    days += [today.isoformat() + 'T08:00:00', '']
+    invoices = random_ledger(rng, 300)
+    for inv in invoices:
+        inv['date'] = rng.choice(days)
+        inv['total'] = rng.choice([100, 250.5])
+    customers = [{'name': 'Acme'}, {'name': 'Bolt'}]
+    index = InvoiceIndex(invoices)
+    for query in QUERIES:
+        assert (service.process_query(query, invoices, customers, index=index)
+                == service.process_query(query, invoices, customers))
@@ -0,0 +1,64 @@
+"""Customer matcher finds the same mention as a scan of every customer name"""
+
+import random
+import threading
+from collections import OrderedDict
+
+import pytest
+
+from _invoicing import matcher as matcher_module
+from _invoicing.matcher import CustomerMatcher, matcher_for
+
+NAMES = ['Acme', 'Acme Holdings', 'Bolt', 'Bolt & Nut', 'Ace', 'Nut', 'Cape Town Traders', 'Town']
+WORDS = ['total', 'for', 'acme', 'holdings', 'bolt', '&', 'nut', 'ace', 'cape', 'town', 'traders',
+         'acmes', 'this', 'year', 'Bolt,', 'ACME']
+
+
+def scan_longest(names, text):
+    """Longest whole-word mention (earliest on ties), checking each name in turn"""
+    text = text.lower()
+    best = None
+    for name in names:
+        norm = name.strip().lower()
+        start = text.find(norm)
+        while norm and start != -1:
+            end = start + len(norm)
+            whole = ((start == 0 or not text[start - 1].isalnum())
+                     and (end == len(text) or not text[end].isalnum()))
+            if whole and (best is None or (-(end - start), start) < (-(best[1] - best[0]), best[0])):
+                best = (start, end, name)
+            start = text.find(norm, start + 1)
+    return best[2] if best else None
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_longest_mention_matches_a_scan(seed):
+    rng = random.Random(seed)
+    matcher = CustomerMatcher(NAMES)
+    for _ in range(500):
+        query = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+        assert matcher.longest(query) == scan_longest(NAMES, query), query
+
+
+def test_cache_is_shared_safely_between_threads(monkeypatch, busy_threads):
+    monkeypatch.setattr(matcher_module, '_matcher_cache', OrderedDict())
+    lists = [[{'name': f'{name} {number}'} for name in NAMES] for number in range(40)]
+    errors = []
+
+    def lookups(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(300):
+                customers = rng.choice(lists)
+                name = rng.choice(customers)['name']
+                assert matcher_for(customers).longest(f'total for {name}') == name
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=lookups, args=(seed,)) for seed in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(matcher_module._matcher_cache) <= matcher_module.MATCHER_CACHE_SIZE
@@ -0,0 +1,128 @@
+"""Traced requests answer like untraced ones, and the metrics render as valid Prometheus text"""
+
+import io
+import json
+import re
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing import cache as cache_module
+from _invoicing import metrics
+from _invoicing.cache import ResultCache
+from _invoicing.endpoint import describe, serve_post
+from _invoicing.metrics import Registry, stage
+
+CUSTOMERS = make_customers(6)
+INVOICES = make_invoices(300, customers=CUSTOMERS, seed=10)
+# Timings differ from run to run
+TIMING = re.compile(rb'"(ms|total_ms|avg_us|timing)": ([0-9.e-]+|\{[^}]*\})')
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([a-zA-Z_][a-zA-Z0-9_]*="[^"]*"(,|(?=\})))*\})? (\S+)$')
+
+REQUESTS = [
+    ('rag-query', {'query': f"total for {CUSTOMERS[0]['name']}", 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('rag-query', {'query': 'find wetsuit', 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[1], 'invoices': INVOICES, 'as_of': '2026-01-01'}),
+    ('crew-analyze', {'agent': 'analyst', 'mode': 'batch', 'customers': CUSTOMERS, 'invoices': INVOICES,
+                      'as_of': '2026-01-01'}),
+    ('dspy-optimize', {'task': 'insights', 'context': {'invoices': INVOICES, 'concentration': True}})
+]
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    """An empty registry and response cache, so counts start at zero and nothing is served cached"""
+    monkeypatch.setattr(metrics, 'registry', Registry())
+    monkeypatch.setattr(cache_module, '_default_cache', ResultCache(max_entries=0))
+
+
+def post(service, data, headers=None):
+    body = json.dumps(data).encode()
+    headers = dict({'Content-Type': 'application/json', 'Content-Length': str(len(body))}, **(headers or {}))
+    status, payload, extra = serve_post(service, headers, io.BytesIO(body))
+    if not isinstance(payload, bytes):
+        payload = b''.join(payload.lines())
+    return status, TIMING.sub(b'', payload), extra
+
+
+def untraced(service, data):
+    result = service.handle(json.loads(json.dumps(data)))
+    if not isinstance(result, dict):
+        return b''.join(TIMING.sub(b'', line) for line in result.lines())
+    return TIMING.sub(b'', json.dumps(result).encode())
+
+
+def parse_prometheus(text):
+    """{(name, labels): value}, checking HELP/TYPE come first and histograms are cumulative"""
+    samples = {}
+    types = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, family, kind = line.split(' ')
+            assert kind in ('counter', 'gauge', 'histogram') and family not in types
+            types[family] = kind
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.group(1), match.group(2) or '', match.group(5)
+        family = re.sub(r'_(bucket|sum|count)$', '', name) if name not in types else name
+        assert family in types, line
+        samples[(name, labels)] = float(value)
+
+    for (name, labels), count in samples.items():
+        if name.endswith('_count') and types.get(name[:-6]) == 'histogram':
+            series = labels[:-1] + ',le=' if labels else '{le='
+            buckets = [value for (other, label), value in samples.items()
+                       if other == name[:-6] + '_bucket' and label.startswith(series)]
+            assert buckets == sorted(buckets) and buckets[-1] == count
+            assert (name[:-6] + '_bucket', series + '"+Inf"}') in samples
+    return samples
+
+
+def test_traced_requests_answer_like_untraced_ones(endpoint, fresh_metrics, monkeypatch):
+    monkeypatch.setattr(metrics, 'PROFILE_TOKEN', 'secret')
+    for name, data in REQUESTS:
+        service = endpoint(name)
+        expected = untraced(service, data)
+        status, body, headers = post(service, data)
+        assert (status, body) == (200, expected), name
+        if name != 'crew-analyze' or data.get('mode') != 'batch':
+            assert 'handle' in headers['Server-Timing']
+        # Profiled and with metrics off, the answer stays the same
+        status, body, headers = post(service, data, {'X-Profile': 'cprofile', 'X-Profile-Token': 'secret'})
+        assert (status, body) == (200, expected)
+        assert describe(service, f"profile={headers['X-Profile-Id']}")[0] == 200
+        with monkeypatch.context() as patch:
+            patch.setattr(metrics, 'METRICS_ENABLED', False)
+            assert post(service, data)[:2] == (200, expected)
+    # Outside a request a stage times nothing
+    before = metrics.render()
+    with stage('outside') as timed:
+        pass
+    assert timed.trace is None and metrics.render() == before
+
+
+def test_prometheus_text_counts_every_request(endpoint, fresh_metrics):
+    for name, data in REQUESTS:
+        post(endpoint(name), data)
+    with pytest.raises(Exception):
+        post(endpoint('rag-query'), {'action': 'query', 'tenant': 'nobody', 'version': 'x'})
+    status, text, content_type = describe(endpoint('rag-query'), 'format=prometheus')
+    assert status == 200 and content_type.startswith('text/plain; version=0.0.4')
+    samples = parse_prometheus(text.decode())
+
+    def requests_total(service, status):
+        return samples.get(('api_requests_total', f'{{service="{service}",status="{status}"}}'), 0)
+
+    assert requests_total('rag-query', '200') == 2
+    assert requests_total('crew-analyze', '200') == 2
+    assert requests_total('dspy-optimize', '200') == 1
+    assert sum(value for (name, _), value in samples.items() if name == 'api_requests_total') == 6
+    assert samples[('api_request_seconds_count', '{service="crew-analyze"}')] == 2
+    assert sum(value for (name, labels), value in samples.items()
+               if name == 'api_requests_total' and 'rag-query' in labels and 'status="200"' not in labels) == 1
+    # The failed request missed the cache too: the key is looked up before the handler runs
+    assert samples[('api_cache_requests_total', '{service="rag-query",result="miss"}')] == 3
+    assert samples[('api_request_invoices_sum', '{service="rag-query"}')] == 2 * len(INVOICES)
@@ -0,0 +1,56 @@
+"""Partitioned ledger validation merges to the serial pass over the same ledger"""
+
+import random
+
+import pytest
+
+from _invoicing import organizer
+from _invoicing.organizer import iter_issues, validate_chunk, validate_ledger
+
+
+def random_invoice(rng, position):
+    inv = {'id': f'inv-{position}', 'date': '2024-03-01', 'total': rng.choice([100, -5, 100]),
+           'amountPaid': 0, 'customer': rng.choice(['Acme', 'Bolt', 'Ghost'])}
+    # A small pool of numbers, so duplicates land in the same and in different chunks
+    if rng.random() < 0.95:
+        inv['number'] = f'INV-{rng.randrange(40)}'
+    return inv
+
+
+def in_chunks(size):
+    """partitioned() stand-in that splits in-process, so the merge runs without a pool"""
+    def split(func, items, args=()):
+        return [func(items[start:start + size], start, *args) for start in range(0, len(items), size)]
+    return split
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('chunk_size', [7, 50, 128])
+def test_partitioned_validation_matches_the_serial_pass(monkeypatch, seed, chunk_size):
+    # Every issue is kept, not just the first few, so each one is compared
+    monkeypatch.setattr(organizer, 'DETAIL_LIMIT', 10 ** 6)
+    rng = random.Random(seed)
+    invoices = [random_invoice(rng, position) for position in range(300)]
+    customers = [{'name': 'Acme'}, {'name': 'Bolt'}]
+    serial_stats, serial_details = validate_ledger(invoices, customers)
+    streamed = list(iter_issues(invoices, customers))
+    for issue in streamed:
+        del issue['row']
+    assert serial_details == streamed
+
+    monkeypatch.setattr(organizer, 'partitioned', in_chunks(chunk_size))
+    stats, details = validate_ledger(invoices, customers)
+    assert stats.counts == serial_stats.counts
+    assert details == serial_details
+
+
+def test_a_later_chunks_own_duplicate_points_at_the_ledgers_first_occurrence(monkeypatch):
+    invoices = [{'id': f'inv-{position}', 'number': f'INV-{position}', 'date': '2024-03-01'}
+                for position in range(10)]
+    invoices += [{'id': 'inv-a', 'number': 'INV-0', 'date': '2024-03-01'},
+                 {'id': 'inv-b', 'number': 'INV-0', 'date': '2024-03-01'}]
+    monkeypatch.setattr(organizer, 'partitioned', in_chunks(10))
+    stats, details = validate_ledger(invoices)
+    assert stats.counts['duplicate_invoice_number'] == 2
+    assert [issue['first_invoice_id'] for issue in details] == ['inv-0', 'inv-0']
+    assert details == [issue for _, issue in validate_chunk(invoices)[1]]
@@ -0,0 +1,77 @@
+"""Chunks run on a real process pool merge to the answers of a single in-process pass"""
+
+import random
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing import organizer, parallel
+from _invoicing.organizer import validate_chunk, validate_ledger
+from _invoicing.parallel import partitioned
+from _invoicing.search import search_invoices
+
+QUERIES = ['wetsuit fins', 'karoo traders board', 'overdue sunblock', 'nothing-matches-this']
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Partition from a few items on, into many chunks over two workers"""
+    monkeypatch.setattr(parallel, 'WORKERS', 2)
+    monkeypatch.setattr(parallel, 'CHUNK_SIZE', 97)
+    monkeypatch.setattr(parallel, 'MIN_ITEMS', 0)
+
+
+def ledger(seed):
+    invoices = make_invoices(1000, customers=make_customers(15), seed=seed)
+    rng = random.Random(seed)
+    # Duplicate numbers in the same and in different chunks
+    for inv in rng.sample(invoices, 60):
+        inv['number'] = f'INV-{rng.randrange(20)}'
+    return invoices
+
+
+def test_chunks_come_back_in_order(small_chunks):
+    invoices = [{'id': f'inv-{n}', 'number': f'INV-{n}'} for n in range(1000)]
+    parts = partitioned(validate_chunk, invoices)
+    assert len(parts) == 11 and parallel._pools
+    positions = [position for _, _, numbers in parts for position, _ in numbers.values()]
+    assert positions == list(range(1000))
+    # A streamed (non-list) input runs as one in-process pass
+    assert len(partitioned(validate_chunk, iter(invoices))) == 1
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_pooled_validation_matches_one_pass(small_chunks, monkeypatch, seed):
+    # Workers keep their own DETAIL_LIMIT; issues are spread out, so the first few span chunks
+    invoices = ledger(seed)
+    customers = make_customers(10)
+    stats, details = validate_ledger(invoices, customers)
+    monkeypatch.setattr(parallel, 'MIN_ITEMS', 10 ** 9)
+    serial_stats, serial_details = validate_ledger(invoices, customers)
+    assert stats.counts == serial_stats.counts
+    assert details == serial_details
+    assert len(details) == organizer.DETAIL_LIMIT
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_pooled_search_matches_one_pass(small_chunks, monkeypatch, seed):
+    invoices = ledger(seed)
+    searches = [(query, customer) for query in QUERIES for customer in (None, invoices[0]['customer'])]
+    pooled = [search_invoices(invoices, query, limit=15, customer_name=customer) for query, customer in searches]
+    monkeypatch.setattr(parallel, 'MIN_ITEMS', 10 ** 9)
+    assert pooled == [search_invoices(invoices, query, limit=15, customer_name=customer)
+                      for query, customer in searches]
+
+
+def without_timings(result):
+    result['rules'] = {rule: entry['count'] for rule, entry in result['rules'].items()}
+    return result
+
+
+def test_pooled_endpoint_answers_match_one_pass(endpoint, small_chunks, monkeypatch):
+    invoices = ledger(3)
+    customers = make_customers(15)
+    service = endpoint('crew-analyze')
+    pooled = without_timings(service.organize_data(invoices, customers))
+    monkeypatch.setattr(parallel, 'MIN_ITEMS', 10 ** 9)
+    assert pooled == without_timings(service.organize_data(invoices, customers))
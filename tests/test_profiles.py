@@ -0,0 +1,73 @@
+"""Incrementally kept customer profiles match a scan of each customer's history"""
+
+import random
+
+import pytest
+
+from _invoicing.indexes import normalize_name
+from _invoicing.profiles import ProfileBook, history_profile
+
+CUSTOMERS = ['Acme', ' ACME', 'Bolt', None]
+# Ordinary days plus both ends of the calendar and a far-future outlier
+DAYS = ['2024-01-10', '2024-03-05', '2024-06-30', '2025-02-14', '2250-01-01', '9999-12-31', '0001-01-01']
+
+
+def random_invoice(rng):
+    due = rng.choice(DAYS)
+    inv = {'customer': rng.choice(CUSTOMERS), 'dueDate': due, 'date': due,
+           'status': rng.choice(['paid', 'paid', 'overdue', 'sent'])}
+    if inv['status'] == 'paid':
+        inv['paidDate'] = due if rng.random() < 0.5 else rng.choice(DAYS)
+    if rng.random() < 0.1:
+        inv['total'] = rng.choice([None, '10'])
+    return inv
+
+
+def assert_matches_scan(book, ledger):
+    for customer in CUSTOMERS:
+        history = [inv for inv in ledger.values() if normalize_name(inv['customer']) == normalize_name(customer)]
+        profile = book.get(customer)
+        if not history:
+            assert profile is None
+            continue
+        expected = history_profile(history, customer)
+        for field in ('invoices', 'paid', 'overdue', 'payment_reliability', 'on_time_ratio', 'avg_days_late'):
+            assert profile[field] == expected[field], field
+        if expected['recent_reliability'] is None:
+            assert profile['recent_reliability'] is None
+        else:
+            assert profile['recent_reliability'] == pytest.approx(expected['recent_reliability'], abs=1e-4)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_adds_replacements_and_removals_match_a_scan(seed):
+    rng = random.Random(seed)
+    book = ProfileBook()
+    ledger = {}
+    for step in range(400):
+        key = rng.randrange(40)
+        if rng.random() < 0.3:
+            book.remove(key)
+            ledger.pop(key, None)
+        else:
+            ledger[key] = random_invoice(rng)
+            book.add(key, ledger[key])
+        if step % 20 == 0:
+            assert_matches_scan(book, ledger)
+    assert_matches_scan(book, ledger)
+
+
+@pytest.mark.parametrize('due', ['2250-01-01', '9999-12-31'])
+def test_far_future_invoice_comes_and_goes_without_a_trace(due):
+    history = [
+        {'customer': 'Acme', 'status': 'paid', 'dueDate': '2024-01-10', 'paidDate': '2024-01-10'},
+        {'customer': 'Acme', 'status': 'paid', 'dueDate': '2024-02-10', 'paidDate': '2024-02-20'},
+        {'customer': 'Acme', 'status': 'overdue', 'dueDate': '2024-03-10'}
+    ]
+    book = ProfileBook.from_invoices(history)
+    before = book.get('Acme')
+    book.add('far', {'customer': 'Acme', 'status': 'paid', 'dueDate': due, 'paidDate': due})
+    assert book.get('Acme')['recent_reliability'] == 1.0
+    book.remove('far')
+    assert book.get('Acme') == before
+    assert before['recent_reliability'] == history_profile(history, 'Acme')['recent_reliability']
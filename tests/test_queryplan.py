@@ -0,0 +1,130 @@
+"""Compiled query plans answer like the per-intent filters they replaced"""
+
+import random
+import re
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from _invoicing.indexes import PREFIX_END, InvoiceIndex, normalize_name, top_recent
+from _invoicing.matcher import matcher_for
+from _invoicing.queryplan import QueryPlan, compile_query
+
+CUSTOMERS = [{'name': 'Acme'}, {'name': 'Bolt Works'}]
+QUERIES = ['total for acme', 'Total spent by Bolt Works this year', 'total spending today',
+           'overdue invoices for acme', 'late payments this month', 'outstanding for bolt works',
+           'last 3 invoices for acme', 'recent invoices', 'last 12 invoices',
+           'average invoice this quarter', 'avg for Bolt Works last 3 months', 'average invoice last 12 months',
+           'paid invoices for acme', 'paid this week', 'total paid last week']
+
+
+def old_intent(query):
+    """Keyword routing as process_query did it, one if/elif per intent"""
+    if 'total' in query or 'spending' in query or 'spent' in query:
+        return 'total_spending'
+    elif 'overdue' in query or 'late' in query or 'outstanding' in query:
+        return 'overdue'
+    elif 'last' in query or 'recent' in query:
+        return 'recent'
+    elif 'average' in query or 'avg' in query:
+        return 'average'
+    elif 'paid' in query:
+        return 'paid'
+    return 'general_search'
+
+
+def old_timeframe_range(query):
+    if 'today' in query:
+        today = datetime.now().strftime('%Y-%m-%d')
+        return today, today + PREFIX_END
+    if 'this week' in query or 'last week' in query:
+        return (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'), None
+    if 'this month' in query or 'last month' in query:
+        month = datetime.now().strftime('%Y-%m')
+        return month, month + PREFIX_END
+    if 'quarter' in query or 'last 3 months' in query:
+        return (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d'), None
+    if 'year' in query or 'last 12 months' in query:
+        year = datetime.now().strftime('%Y')
+        return year, year + PREFIX_END
+    return None
+
+
+def old_timeframe_label(query):
+    if 'today' in query:
+        return 'today'
+    for label in ('this week', 'last week', 'this month', 'last month'):
+        if label in query:
+            return label
+    if 'quarter' in query:
+        return 'last quarter'
+    if 'year' in query:
+        return 'this year'
+    return 'all time'
+
+
+def old_filters(query, customer_name, invoices):
+    """(sum, count, rows listed) from the chained customer, timeframe and status filters"""
+    intent = old_intent(query)
+    filtered = invoices
+    if customer_name:
+        name = normalize_name(customer_name)
+        filtered = [inv for inv in filtered if normalize_name(inv.get('customer')) == name]
+    if intent == 'recent':
+        match = re.search(r'(\d+)', query)
+        recent = top_recent(filtered, int(match.group(1)) if match else 5)
+        return None, len(recent), recent
+    if intent in ('total_spending', 'average'):
+        date_range = old_timeframe_range(query)
+        if date_range is not None:
+            start, end = date_range
+            filtered = [inv for inv in filtered
+                        if start <= (inv.get('date') or '') and (end is None or (inv.get('date') or '') < end)]
+        keep = 0 if intent == 'average' else 10
+        return sum(inv.get('total', 0) for inv in filtered), len(filtered), filtered[:keep]
+    status = 'overdue' if intent == 'overdue' else 'paid'
+    kept = [inv for inv in filtered if inv.get('status') == status]
+    if intent == 'overdue':
+        return sum(inv.get('total', 0) - inv.get('amountPaid', 0) for inv in kept), len(kept), kept
+    return sum(inv.get('total', 0) for inv in kept), len(kept), kept[:10]
+
+
+def random_ledger(rng, count):
+    today = date.today()
+    days = [(today - timedelta(days=offset)).isoformat() for offset in (0, 1, 6, 8, 31, 89, 91, 200, 400)]
+    return [{'number': f'INV-{n}', 'customer': rng.choice(['Acme', ' ACME', 'Bolt Works', None]),
+             'status': rng.choice(['paid', 'sent', 'overdue']), 'date': rng.choice(days + ['']),
+             'total': rng.choice([100, 250.5, 80]), 'amountPaid': rng.choice([0, 20])}
+            for n in range(count)]
+
+
+def numbers(answer):
+    total, count, kept = answer
+    return total, count, [inv['number'] for inv in kept]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_plans_select_what_the_per_intent_filters_selected(endpoint, seed):
+    service = endpoint('rag-query')
+    invoices = random_ledger(random.Random(seed), 300)
+    index = InvoiceIndex(invoices)
+    matcher = matcher_for(CUSTOMERS)
+    for query in QUERIES:
+        plan = compile_query(query)
+        assert plan.intent == old_intent(plan.text), query
+        assert plan.timeframe == old_timeframe_label(plan.text), query
+        customer_name = matcher.longest(plan.text)
+        expected = numbers(old_filters(plan.text, customer_name, invoices))
+        if plan.intent == 'recent':
+            listed = service.query_recent(plan, customer_name, invoices)['data']['invoices']
+            assert [inv['number'] for inv in listed] == expected[2], query
+            continue
+        assert numbers(service.execute_plan(plan, customer_name, invoices)) == expected, query
+        assert numbers(service.execute_plan(plan, customer_name, invoices, index=index)) == expected, query
+
+
+def test_equivalent_questions_share_one_plan():
+    plan = compile_query('Total spent by  ACME this year')
+    assert compile_query('total spent by acme this year') is plan
+    fresh = QueryPlan('total spent by acme this year')
+    assert all(getattr(plan, name) == getattr(fresh, name) for name in QueryPlan.__slots__)
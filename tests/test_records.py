@@ -0,0 +1,97 @@
+"""Compact invoice records read like the decoded JSON dicts they replace"""
+
+import copy
+import json
+import pickle
+import random
+import re
+
+import pytest
+from synthetic import make_customers, make_invoices, make_products
+
+from _invoicing import store as store_module
+from _invoicing.records import InvoiceRecord, decode_invoices
+from _invoicing.store import InvoiceStore
+
+# Timings differ from run to run
+TIMING = re.compile(r'"(ms|total_ms|avg_us|timing)": ([0-9.e-]+|\{[^}]*\})')
+ODD_VALUES = [None, True, 0, -3, 0.1, 12.345, 1e300, float('-inf'), '100', '', [], {'a': 1}]
+
+
+def odd_invoice(rng, number):
+    """An invoice with values that do not fit the slots: sub-cent, strings, unknown keys"""
+    inv = {'id': number, 'number': f'INV-{number}'}
+    for key in ('customer', 'date', 'dueDate', 'status', 'total', 'amountPaid', 'customerId', 'notes'):
+        if rng.random() < 0.7:
+            inv[key] = rng.choice(ODD_VALUES + ['Acme', '2024-01-01'])
+    if rng.random() < 0.5:
+        inv['items'] = [{'sku': rng.choice(['A', None, 7]), 'price': rng.choice(ODD_VALUES),
+                         'quantity': rng.choice([1, 2.5, None]), 'colour': 'red'}
+                        for _ in range(rng.randint(0, 3))]
+    elif rng.random() < 0.5:
+        inv['items'] = rng.choice(['none', [1, 2], None])
+    return inv
+
+
+def assert_reads_like(record, doc):
+    assert record.to_dict() == doc
+    assert json.dumps(record.to_dict(), sort_keys=True) == json.dumps(doc, sort_keys=True)
+    assert len(record) == len(doc) and set(record) == set(doc)
+    for key in list(doc) + ['missing', 'lineItems']:
+        assert (key in record) == (key in doc)
+        value = record.get(key, 'default')
+        expected = doc.get(key, 'default')
+        if isinstance(value, list) and value and not isinstance(value[0], int):
+            value = [item.to_dict() if hasattr(item, 'to_dict') else item for item in value]
+        assert value == expected and type(value) is type(expected), key
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_records_read_like_the_decoded_documents(seed):
+    rng = random.Random(seed)
+    docs = make_invoices(200, customers=make_customers(10), seed=seed)
+    docs += [odd_invoice(rng, number) for number in range(300)]
+    records = decode_invoices(copy.deepcopy(docs))
+    for record, doc in zip(records, docs):
+        assert_reads_like(record, doc)
+        assert_reads_like(pickle.loads(pickle.dumps(record)), doc)
+    # Records pass through unchanged
+    assert decode_invoices(records) == records
+
+
+def tenant_answers(endpoint, monkeypatch, root, invoices, customers):
+    """Tenant answers from rag-query, crew-analyze and dspy-optimize, before and after an ingest"""
+    monkeypatch.setattr(store_module, '_default_store', InvoiceStore(root))
+    rag, crew, dspy = endpoint('rag-query'), endpoint('crew-analyze'), endpoint('dspy-optimize')
+    queries = ['total spending this year', 'overdue invoices', 'average invoice last 3 months',
+               f"paid by {customers[1]['name']}", 'recent invoices', 'wetsuit board', 'receivables aging',
+               'over 90 days past due']
+    answers = [rag.handle({'action': 'ingest', 'tenant': 't', 'invoices': invoices[:800],
+                           'customers': customers})]
+    for _ in range(2):
+        answers += [rag.handle({'tenant': 't', 'query': query}) for query in queries]
+        answers.append(crew.handle({'agent': 'analyst', 'mode': 'aging', 'tenant': 't', 'as_of': '2026-01-01'}))
+        answers.append(crew.handle({'agent': 'collector', 'tenant': 't', 'customer': customers[0]}))
+        answers.append(dspy.handle({'task': 'recommend', 'context': {
+            'tenant': 't', 'invoice': {'items': invoices[0]['items']}, 'products': make_products(20)}}))
+        changed = [dict(inv, status='paid', amountPaid=inv['total']) for inv in invoices[:100]]
+        answers.append(rag.handle({'action': 'ingest', 'tenant': 't', 'invoices': changed + invoices[800:],
+                                   'deleted': [inv['id'] for inv in invoices[100:120]]}))
+    return TIMING.sub('', json.dumps(answers, sort_keys=True, default=str))
+
+
+def test_tenant_answers_match_with_dict_invoices(endpoint, tmp_path, monkeypatch):
+    customers = make_customers(15)
+    invoices = make_invoices(1000, customers=customers, seed=2)
+    monkeypatch.setattr(store_module, 'RESIDENT_RECORDS', 'compact')
+    compact = tenant_answers(endpoint, monkeypatch, str(tmp_path / 'compact'), copy.deepcopy(invoices), customers)
+    monkeypatch.setattr(store_module, 'RESIDENT_RECORDS', 'dict')
+    assert tenant_answers(endpoint, monkeypatch, str(tmp_path / 'dict'), copy.deepcopy(invoices), customers) == compact
+    assert type(store_module.get_store().load('t').invoices[0]) is dict
+
+
+def test_compact_datasets_hold_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_module, 'RESIDENT_RECORDS', 'compact')
+    store = InvoiceStore(str(tmp_path))
+    store.upsert('t', make_invoices(10, customers=make_customers(2)))
+    assert all(isinstance(inv, InvoiceRecord) for inv in store.load('t').invoices)
@@ -0,0 +1,62 @@
+"""Incrementally kept BM25 index ranks like a one-off scan of the same ledger"""
+
+import random
+
+import pytest
+
+from _invoicing.indexes import InvoiceIndex, normalize_name
+from _invoicing.search import SearchIndex, search_invoices
+
+CUSTOMERS = ['Acme', ' acme', 'Bolt Works', None]
+WORDS = ['wetsuit', 'fins', 'board', 'wax', 'sunblock', 'rack', 'bag', 'v2.0', 'x-large']
+QUERIES = ['wetsuit', 'fins board', 'wax for acme', 'v2.0 x-large', 'the', 'bolt', 'sunblock sunblock rack']
+
+
+def random_invoice(rng):
+    # Few distinct words, so many invoices score the same
+    return {'customer': rng.choice(CUSTOMERS), 'status': rng.choice(['paid', 'sent']),
+            'items': [{'name': ' '.join(rng.sample(WORDS, rng.randint(1, 2))), 'quantity': rng.randint(1, 3)}
+                      for _ in range(rng.randint(0, 3))],
+            'total': rng.choice([100, 200, None])}
+
+
+def assert_matches_scan(index, ledger):
+    invoices = list(ledger.values())
+    for query in QUERIES:
+        assert index.search(query, limit=10) == search_invoices(invoices, query, limit=10), query
+        for customer in ('acme', 'Bolt Works'):
+            name = normalize_name(customer)
+            ranked = index.search(query, limit=10,
+                                  predicate=lambda inv: normalize_name(inv.get('customer')) == name)
+            assert ranked == search_invoices(invoices, query, limit=10, customer_name=customer)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_adds_replacements_and_removals_match_a_scan(seed):
+    rng = random.Random(seed)
+    index = SearchIndex()
+    # Replacing an invoice keeps its place in the ledger, as the store's upsert does
+    ledger = {}
+    for step in range(300):
+        key = rng.randrange(60)
+        if rng.random() < 0.25:
+            index.remove(key)
+            ledger.pop(key, None)
+        else:
+            ledger[key] = random_invoice(rng)
+            index.add(key, ledger[key])
+        if step % 50 == 0:
+            assert_matches_scan(index, ledger)
+    assert_matches_scan(index, ledger)
+    assert_matches_scan(SearchIndex.from_invoices(list(ledger.values())), ledger)
+
+
+def test_general_search_matches_with_and_without_the_index(endpoint):
+    service = endpoint('rag-query')
+    rng = random.Random(5)
+    invoices = [dict(random_invoice(rng), number=f'INV-{n}', total=100) for n in range(200)]
+    customers = [{'name': 'Acme'}, {'name': 'Bolt Works'}]
+    index = InvoiceIndex(invoices, search=SearchIndex.from_invoices(invoices))
+    for query in ('find wetsuit fins', 'show wax for acme', 'rack bag for bolt works'):
+        assert (service.process_query(query, invoices, customers, index=index)
+                == service.process_query(query, invoices, customers))
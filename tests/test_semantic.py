@@ -0,0 +1,123 @@
+"""Vector index: IVF probing and save/load answer like an exact scan of the same invoices"""
+
+import copy
+import json
+import os
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from synthetic import make_customers, make_invoices  # noqa: E402
+
+from _invoicing import semantic  # noqa: E402
+from _invoicing.semantic import VectorIndex  # noqa: E402
+
+QUERIES = ['wetsuit fins', 'overdue sunblock', 'karoo traders board', 'replaced quantum']
+
+
+def invoice_key(inv):
+    return inv['id']
+
+
+def ranked(index, query, **options):
+    """(score, id) pairs, ids ordered within equal scores (row order differs once regrouped)"""
+    return sorted(((score, inv['id']) for score, inv in index.search(query, limit=20, **options)),
+                  key=lambda pair: (-pair[0], pair[1]))
+
+
+def churn(rng, invoices, indexes, steps):
+    """Add, replace and remove invoices on every index alike; returns the live ledger"""
+    live = {inv['id']: inv for inv in invoices}
+    for step in range(steps):
+        action = rng.random()
+        if action < 0.4:
+            inv = dict(copy.deepcopy(rng.choice(invoices)), id=f'new-{step}', notes=f'quantum {step}')
+        elif action < 0.7:
+            inv = dict(live[rng.choice(sorted(live))], notes='replaced')
+        else:
+            key = rng.choice(sorted(live))
+            del live[key]
+            for index in indexes:
+                index.remove(key)
+            continue
+        live[inv['id']] = inv
+        for index in indexes:
+            index.add(inv['id'], inv)
+    return live
+
+
+@pytest.fixture
+def small_ivf(monkeypatch):
+    """IVF lists from a few hundred vectors on, so tests train quickly"""
+    monkeypatch.setattr(semantic, 'IVF_MIN', 200)
+
+
+def test_probing_every_list_matches_an_exact_scan(small_ivf):
+    rng = random.Random(0)
+    invoices = make_invoices(1500, customers=make_customers(40))
+    ivf = VectorIndex.from_invoices(invoices, key=invoice_key)
+    exact = VectorIndex.from_invoices(invoices, key=invoice_key, ivf=False)
+    ivf.wait_for_training()
+    assert ivf.centroids is not None
+    churn(rng, invoices, [ivf, exact], 300)
+    ivf.wait_for_training()
+    for query in QUERIES:
+        assert ranked(ivf, query, nprobe=len(ivf.centroids)) == ranked(exact, query)
+    ivf.wait_for_training()
+
+
+def test_saves_between_retrains_append_keys_and_load_back(tmp_path):
+    rng = random.Random(1)
+    directory = str(tmp_path / 'vectors')
+    invoices = make_invoices(300, customers=make_customers(20))
+    index = VectorIndex.from_invoices(invoices, key=invoice_key, directory=directory)
+    index.save(1)
+    with open(os.path.join(directory, 'keys.json'), 'rb') as handle:
+        saved_keys = handle.read()
+
+    live = invoices
+    for version in range(2, 6):
+        live = list(churn(rng, live, [index], 20).values())
+        index.save(version)
+        with open(os.path.join(directory, 'keys.json'), 'rb') as handle:
+            assert handle.read() == saved_keys
+        loaded = VectorIndex.load(directory, version, live, invoice_key)
+        assert loaded is not None
+        assert loaded.keys == index.keys
+        for query in QUERIES:
+            assert ranked(loaded, query) == ranked(index, query)
+
+    # Once the log outgrows the keys, keys.json is rewritten and the log starts over
+    for version in range(6, 30):
+        live = list(churn(rng, live, [index], 20).values())
+        index.save(version)
+        assert index._logged <= len(index.keys)
+    loaded = VectorIndex.load(directory, 29, live, invoice_key)
+    assert loaded is not None and loaded.keys == index.keys
+
+
+def test_retrained_lists_rewrite_keys_and_load_back(small_ivf, tmp_path):
+    rng = random.Random(2)
+    directory = str(tmp_path / 'vectors')
+    invoices = make_invoices(500, customers=make_customers(20))
+    index = VectorIndex.from_invoices(invoices, key=invoice_key, directory=directory)
+    index.wait_for_training()
+    assert index.centroids is not None
+    live = list(churn(rng, invoices, [index], 400).values())
+    index.wait_for_training()
+    every_list = len(index.centroids)
+    expected = {query: ranked(index, query, nprobe=every_list) for query in QUERIES}
+    index.wait_for_training()
+    index.save(2)
+    with open(os.path.join(directory, 'keys.json'), encoding='utf-8') as handle:
+        assert json.load(handle) == index.keys
+    assert not os.path.exists(os.path.join(directory, 'keys.log'))
+
+    # Only one index at a time works in the directory
+    loaded = VectorIndex.load(directory, 2, live, invoice_key)
+    assert loaded is not None and loaded.keys == index.keys
+    for query in QUERIES:
+        assert ranked(loaded, query, nprobe=every_list) == expected[query]
+    loaded.wait_for_training()
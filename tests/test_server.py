@@ -0,0 +1,115 @@
+"""Long-lived server answers each request like the per-invocation Vercel handler"""
+
+import asyncio
+import http.client
+import json
+import re
+import threading
+from http.server import HTTPServer
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing.cache import get_cache
+from _invoicing.endpoint import JSONHandler
+from _invoicing.server import APIApp, serve_connection
+
+CUSTOMERS = make_customers(6)
+INVOICES = make_invoices(300, customers=CUSTOMERS, seed=8)
+# Timings differ from run to run
+TIMING = re.compile(rb'"(ms|total_ms|avg_us|timing)": ([0-9.e-]+|\{[^}]*\})')
+HEADERS = ('Content-Type', 'ETag', 'X-Cache', 'Access-Control-Allow-Origin')
+
+REQUESTS = [
+    ('rag-query', {'query': f"total for {CUSTOMERS[0]['name']}", 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('rag-query', {'query': 'find wetsuit', 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('crew-analyze', {'agent': 'analyst', 'customer': CUSTOMERS[1], 'invoices': INVOICES,
+                      'as_of': '2026-01-01'}),
+    ('crew-analyze', {'agent': 'analyst', 'mode': 'batch', 'customers': CUSTOMERS, 'invoices': INVOICES,
+                      'as_of': '2026-01-01'}),
+    ('crew-analyze', {'agent': 'organizer', 'invoices': INVOICES, 'customers': CUSTOMERS}),
+    ('dspy-optimize', {'task': 'insights', 'context': {'invoices': INVOICES}}),
+    ('crew-analyze', {'agent': 'nobody'})
+]
+
+
+@pytest.fixture(scope='module')
+def servers(endpoint):
+    """(port of the long-lived server, {endpoint name: port of a JSONHandler server})"""
+    names = sorted({name for name, _ in REQUESTS})
+    services = {name: endpoint(name) for name in names}
+
+    loop = asyncio.new_event_loop()
+    app = APIApp(services={f'/api/{name}': service for name, service in services.items()}, workers=4)
+    server = loop.run_until_complete(
+        asyncio.start_server(lambda r, w: serve_connection(app, r, w), '127.0.0.1', 0))
+    threads = [threading.Thread(target=loop.run_forever, daemon=True)]
+
+    handlers = {}
+    for name, service in services.items():
+        handler = type('handler', (JSONHandler,), {'service': service, 'log_message': lambda *args: None})
+        handlers[name] = HTTPServer(('127.0.0.1', 0), handler)
+        threads.append(threading.Thread(target=handlers[name].serve_forever, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    yield server.sockets[0].getsockname()[1], {name: h.server_address[1] for name, h in handlers.items()}
+
+    for handler in handlers.values():
+        handler.shutdown()
+        handler.server_close()
+    server.close()
+    loop.call_soon_threadsafe(loop.stop)
+    threads[0].join()
+    app.executor.shutdown()
+    loop.close()
+
+
+def fetch(conn, method, path, body=None, headers=None):
+    """(status, selected headers, body without timings); the cache starts empty for each request"""
+    get_cache().clear()
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    payload = TIMING.sub(b'', response.read())
+    return response.status, {name: response.getheader(name) for name in HEADERS}, payload
+
+
+def test_posts_answer_like_the_vercel_handler(servers):
+    port, handler_ports = servers
+    # One keep-alive connection carries every request to the long-lived server
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for name, request_body in REQUESTS:
+        body = json.dumps(request_body).encode()
+        vercel = http.client.HTTPConnection('127.0.0.1', handler_ports[name], timeout=30)
+        expected = fetch(vercel, 'POST', f'/api/{name}', body, {'Content-Type': 'application/json'})
+        vercel.close()
+        assert fetch(conn, 'POST', f'/api/{name}', body, {'Content-Type': 'application/json'}) == expected, name
+
+    # Bad bodies fail the same way
+    for body in (b'{"query": ', b'[]'):
+        vercel = http.client.HTTPConnection('127.0.0.1', handler_ports['rag-query'], timeout=30)
+        expected = fetch(vercel, 'POST', '/api/rag-query', body)
+        vercel.close()
+        assert expected[0] >= 400
+        assert fetch(conn, 'POST', '/api/rag-query', body) == expected
+    conn.close()
+
+
+def test_revalidation_and_routes(servers):
+    port, handler_ports = servers
+    body = json.dumps(REQUESTS[0][1]).encode()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    status, headers, _ = fetch(conn, 'POST', '/api/rag-query', body)
+    assert status == 200 and headers['ETag']
+    revalidated = fetch(conn, 'POST', '/api/rag-query', body, {'If-None-Match': headers['ETag']})
+
+    vercel = http.client.HTTPConnection('127.0.0.1', handler_ports['rag-query'], timeout=30)
+    assert fetch(vercel, 'POST', '/api/rag-query', body, {'If-None-Match': headers['ETag']}) == revalidated
+    assert revalidated[0] == 304 and revalidated[2] == b''
+    vercel.close()
+
+    status, _, payload = fetch(conn, 'GET', '/health')
+    assert status == 200
+    assert json.loads(payload)['endpoints'] == sorted(f'/api/{name}' for name in handler_ports)
+    assert fetch(conn, 'GET', '/api/unknown')[0] == 404
+    conn.close()
@@ -0,0 +1,79 @@
+"""Incremental insight snapshots answer like a full insights scan of the same ledger"""
+
+import random
+
+import pytest
+
+from _invoicing.snapshots import InsightSnapshot
+
+CUSTOMERS = ['Acme', 'acme ', 'Bolt', None, 'Unknown'] + [f'Customer {n}' for n in range(25)]
+ODD_TOTALS = [None, '10', True, [1]]
+
+
+def random_invoice(rng, number):
+    total = rng.choice(ODD_TOTALS) if rng.random() < 0.15 else rng.randint(1, 10 ** 6)
+    inv = {'id': f'inv-{number}', 'total': total,
+           'status': rng.choice(['paid', 'sent', 'overdue'])}
+    if rng.random() < 0.9:
+        inv['customer'] = rng.choice(CUSTOMERS)
+    return inv
+
+
+def insights(service, context):
+    """(result without the snapshot id, snapshot id)"""
+    result = service.optimize_insights(context)
+    return result, result.pop('snapshot', None)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_snapshot_deltas_match_a_full_scan(endpoint, seed):
+    service = endpoint('dspy-optimize')
+    rng = random.Random(seed)
+    ledger = {}
+    for number in range(60):
+        inv = random_invoice(rng, number)
+        ledger[inv['id']] = inv
+
+    snapshot = service.optimize_insights({'incremental': True, 'invoices': list(ledger.values())})['snapshot']
+    for step in range(40):
+        added = [random_invoice(rng, 1000 * (step + 1) + n) for n in range(rng.randint(0, 3))]
+        updated = [dict(random_invoice(rng, 0), id=key) for key in rng.sample(sorted(ledger), 2)]
+        deleted = rng.sample(sorted(ledger), rng.randint(0, 3))
+        deleted = [key for key in deleted if key not in {inv['id'] for inv in updated}]
+        for inv in added + updated:
+            ledger[inv['id']] = inv
+        for key in deleted:
+            del ledger[key]
+
+        delta, snapshot = insights(service, {'snapshot': snapshot, 'added': added, 'updated': updated,
+                                             'deleted': deleted, 'concentration': True})
+        assert delta == insights(service, {'invoices': list(ledger.values())})[0]
+
+
+def test_top_customer_ties_go_to_the_first_seen_customer():
+    snapshot = InsightSnapshot()
+    snapshot.apply(added=[{'id': '1', 'customer': None, 'total': 10},
+                          {'id': '2', 'customer': 'Bolt', 'total': 10},
+                          {'id': '3', 'customer': 'Acme', 'total': 10}])
+    assert snapshot.top_customer() == (None, 10)
+    snapshot.apply(deleted=['1'])
+    assert snapshot.top_customer() == ('Bolt', 10)
+
+
+def test_zero_revenue_customers_stay_until_their_last_invoice_goes():
+    snapshot = InsightSnapshot()
+    snapshot.apply(added=[{'id': '1', 'customer': 'Acme', 'total': 5},
+                          {'id': '2', 'customer': 'Acme', 'total': None}])
+    snapshot.apply(deleted=['1'])
+    assert snapshot.customer_revenue == {'Acme': 0}
+    snapshot.apply(deleted=['2'])
+    assert snapshot.customer_revenue == {}
+    assert snapshot.top_customer() is None
+
+
+def test_heap_stays_bounded_under_churn():
+    snapshot = InsightSnapshot()
+    for step in range(2000):
+        snapshot.apply(updated=[{'id': str(step % 7), 'customer': f'C{step % 5}', 'total': step}])
+    assert len(snapshot._top) <= 2 * len(snapshot.customer_revenue) + 16
+    assert snapshot.top_customer() == max(snapshot.customer_revenue.items(), key=lambda item: item[1])
@@ -0,0 +1,120 @@
+"""Tenant store: resident datasets answer like a scan of the stored ledger"""
+
+import threading
+
+import pytest
+from synthetic import make_customers, make_invoices
+
+from _invoicing.search import search_invoices
+from _invoicing import store as store_module
+from _invoicing.store import InvoiceStore
+
+QUERIES = ['karoo traders', 'sunblock bag', 'overdue lekker', 'rack 424']
+
+
+def ledger(count, seed):
+    invoices = make_invoices(count, customers=make_customers(20), seed=seed)
+    for number, inv in enumerate(invoices):
+        inv['id'] = f'inv-{seed}-{number}'
+    return invoices
+
+
+def test_searches_during_ingests_read_one_whole_version(tmp_path, busy_threads):
+    store = InvoiceStore(str(tmp_path))
+    store.upsert('acme', ledger(300, 0))
+    with store.reading('acme') as dataset:
+        dataset.search  # resident from here on, so ingests update it in place
+    errors = []
+    done = threading.Event()
+
+    def ingest():
+        try:
+            for seed in range(1, 16):
+                batch = ledger(40, seed)
+                store.upsert('acme', batch, deleted=[f'inv-0-{seed}'])
+        except Exception as error:
+            errors.append(error)
+        finally:
+            done.set()
+
+    def search():
+        try:
+            while not done.is_set():
+                with store.reading('acme') as dataset:
+                    # The version can't move under a reader: the same searches keep the same answers
+                    first = [dataset.search.search(query, limit=5) for query in QUERIES]
+                    for _ in range(20):
+                        assert [dataset.search.search(query, limit=5) for query in QUERIES] == first
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=ingest)] + [threading.Thread(target=search) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with store.reading('acme') as dataset:
+        assert dataset.version == store.version('acme')
+        assert len(dataset.invoices) == 300 + 15 * 40 - 15
+        for query in QUERIES:
+            assert dataset.search.search(query, limit=5) == search_invoices(dataset.invoices, query, limit=5)
+
+
+@pytest.fixture
+def tenant_store(tmp_path, monkeypatch):
+    """A fresh store behind the endpoints' get_store()"""
+    store = InvoiceStore(str(tmp_path))
+    monkeypatch.setattr(store_module, '_default_store', store)
+    return store
+
+
+RAG_QUERIES = ['total for Karoo Traders 9', 'overdue invoices', 'average invoice for Lekker Works 6',
+               'last 5 invoices', 'sunblock', 'how much has Table Bay Traders 1 spent this year']
+
+
+def test_tenant_queries_answer_like_the_inline_ledger(endpoint, tenant_store):
+    service = endpoint('rag-query')
+    invoices, customers = ledger(400, 0), make_customers(20)
+    service.handle({'action': 'ingest', 'tenant': 'acme', 'invoices': invoices[:300], 'customers': customers})
+    service.handle({'action': 'ingest', 'tenant': 'acme', 'invoices': invoices[300:]})
+    for query in RAG_QUERIES:
+        resident = service.handle({'tenant': 'acme', 'query': query})
+        assert resident.pop('dataset_version') == tenant_store.version('acme') == 2
+        assert resident == service.handle({'query': query, 'invoices': invoices, 'customers': customers})
+
+    # A cold process reads the same ledger back from disk
+    cold = InvoiceStore(tenant_store.root)
+    assert cold.version('acme') == 2
+    assert [dict(inv) for inv in cold.load('acme').invoices] == invoices
+
+# Averages only: answers that list invoices round each total, so they need numeric ones
+AGGREGATE_QUERIES = ['average invoice for Lekker Works 6', 'average invoice for Karoo Traders 9 this year',
+                     'average invoice amount', 'average invoice last month']
+
+
+def assert_same_answer(expected, actual):
+    """Equal answers, up to the float rounding of summing in a different order"""
+    assert expected.keys() == actual.keys()
+    assert expected['query_type'] == actual['query_type']
+    assert expected['data'] == pytest.approx(actual['data'], abs=0.011)
+
+
+def test_cold_start_from_a_snapshot_answers_like_the_resident_dataset(endpoint, tenant_store, monkeypatch):
+    service = endpoint('rag-query')
+    invoices, customers = ledger(300, 0), make_customers(20)
+    # Totals SQLite would coerce, or that the resident paths count as 0
+    for inv, total in zip(invoices[::5], ['100.50', None, True, '', '2e3']):
+        inv['total'] = total
+    invoices[3]['amountPaid'] = '12'
+    service.handle({'action': 'ingest', 'tenant': 'acme', 'invoices': invoices, 'customers': customers})
+    service.handle({'action': 'snapshot', 'tenant': 'acme'})
+    resident = {query: service.handle({'tenant': 'acme', 'query': query}) for query in AGGREGATE_QUERIES}
+
+    monkeypatch.setattr(store_module, '_default_store', InvoiceStore(tenant_store.root))
+    for query in AGGREGATE_QUERIES:
+        cold = service.handle({'tenant': 'acme', 'query': query})
+        assert store_module.get_store().load('acme').snapshot is not None
+        assert_same_answer(cold, resident[query])
+        cold.pop('dataset_version')
+        assert_same_answer(cold, service.handle({'query': query, 'invoices': invoices, 'customers': customers}))
@@ -0,0 +1,93 @@
+"""Compiled follow-up templates: batch rendering matches single renders and the original copy"""
+
+import random
+
+from synthetic import make_customers, make_invoices
+
+from _invoicing.indexes import normalize_name
+from _invoicing.templates import FOLLOWUP_TEMPLATES, TemplateEngine
+
+BRAND = 'Aweh Be Lekker'
+
+
+def original_collector_message(customer, invoice_num, amount, due_date, tone):
+    """The collector's follow-up as it was written inline before the template engine"""
+    if tone == 'friendly':
+        return f"""Hi {customer.get('name', 'there')}! 👋
+
+Hope you're doing well! Just a friendly reminder that invoice {invoice_num} (R{amount:.2f}) was due on {due_date}.
+
+We know things get busy - would you be able to settle this soon? Let us know if you need any help!
+
+Thanks so much,
+Aweh Be Lekker Team"""
+    return f"""Dear {customer.get('name', 'Customer')},
+
+This is a reminder that invoice {invoice_num} for R{amount:.2f} is overdue (due date: {due_date}).
+
+Please arrange payment at your earliest convenience. If you have any questions or need to discuss payment terms, please don't hesitate to contact us.
+
+Best regards,
+Aweh Be Lekker"""
+
+
+def random_values(rng):
+    values = {'customer_name': rng.choice(['Acme', 'Bolt Works', 'Ünïcode {braces}']),
+              'invoice_number': rng.choice(['INV-1', 'INV-{2}', 7]),
+              'amount': rng.choice([0, 12.5, 1234567.891, -3]),
+              'due_date': rng.choice(['2026-01-31', '']),
+              'days_overdue': rng.randint(0, 90)}
+    for name in rng.sample(sorted(values), rng.randint(0, 2)):
+        if name not in ('invoice_number', 'amount'):
+            del values[name]
+    return values
+
+
+def test_batches_render_like_single_templates():
+    rng = random.Random(0)
+    jobs = [(template_set, tone, random_values(rng))
+            for _ in range(200)
+            for template_set, locales in FOLLOWUP_TEMPLATES.items()
+            for tone in locales['en-ZA']]
+    rng.shuffle(jobs)
+    texts, timing = TemplateEngine(brand=BRAND).render_batch(jobs)
+    single = TemplateEngine(brand=BRAND)
+    assert texts == [single.render(template_set, tone, values) for template_set, tone, values in jobs]
+    assert sum(entry['renders'] for entry in timing) == len(jobs)
+    # An unknown locale falls back to the default copy
+    values = random_values(rng)
+    assert (single.render('collector', 'friendly', values, locale='fr-FR')
+            == single.render('collector', 'friendly', values))
+
+
+def test_collector_copy_matches_the_original_messages(endpoint):
+    service = endpoint('crew-analyze')
+    rng = random.Random(1)
+    for _ in range(100):
+        customer = {'name': rng.choice(['Acme', 'Bolt Works'])} if rng.random() < 0.8 else {}
+        invoices = [{'number': f'INV-{n}', 'status': 'overdue', 'total': rng.choice([100, 99.999, 5000]),
+                     'amountPaid': rng.choice([0, 10.5]), 'dueDate': '2026-02-01'}
+                    for n in range(rng.randint(1, 9))]
+        result = service.draft_followup(invoices, customer)
+        tone = 'friendly' if len(invoices) > 5 else 'professional'
+        assert [followup['message'] for followup in result['followups']] == [
+            original_collector_message(customer, inv['number'], inv['total'] - inv['amountPaid'],
+                                       inv['dueDate'], tone)
+            for inv in invoices]
+
+
+def test_collector_batch_matches_per_customer_drafts(endpoint):
+    service = endpoint('crew-analyze')
+    customers = make_customers(10)
+    invoices = make_invoices(500, customers=customers, seed=6)
+    lines = list(service.draft_all_followups(invoices, customers))
+    assert lines[-1]['count'] == len(lines) - 1 > 0
+
+    batch = {}
+    for followup in lines[:-1]:
+        batch.setdefault(followup.pop('customer'), []).append(followup)
+    for customer in customers:
+        key = normalize_name(customer['name'])
+        own = [inv for inv in invoices if normalize_name(inv.get('customer')) == key]
+        single = service.draft_followup(own, customer)
+        assert batch.get(customer['name'], []) == single['followups']